@@ -1,4 +1,5 @@
 import streamlit as st
+from services import env, warm_up
 
 st.set_page_config(page_title="Document GPT Assistant", layout="centered")
 st.title("📄 Document GPT Assistant")
@@ -12,3 +13,9 @@ Welcome to the Document GPT Assistant. Use the sidebar to:
 - 📤 Export results to Excel
 - 📊 Explore interactive dashboards
 """)
+
+# Import the heavy SDKs in the background while this page is read, so the first
+# switch to another page doesn't pay for them. preload_modules="" turns it off.
+preload_modules = env("preload_modules", "pandas,altair,openai,azure.storage.blob,azure.search.documents")
+if preload_modules:
+    warm_up([name.strip() for name in preload_modules.split(",") if name.strip()])
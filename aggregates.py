@@ -0,0 +1,115 @@
+import threading
+
+import pandas as pd
+
+# Pre-aggregated entity cube for the Dashboard.
+#
+# Entities are rolled up to one row per Company x Year x Key x Document with the
+# counts and sums the dashboard needs, so sidebar changes filter a few thousand cube
+# rows instead of every extracted entity. The cube follows the entity store's version:
+# rows appended through the same store are merged in incrementally, any other change
+# (reviews, writes from another process) triggers a rebuild on the next read.
+
+GRAIN = ["Company", "Year", "Key", "Document"]
+MEASURES = ["Count", "ValueSum", "ConfidenceSum", "ConfidenceCount"]
+
+
+def build_cube(df):
+    if df.empty:
+        return pd.DataFrame(columns=GRAIN + MEASURES)
+    rolled = df[GRAIN].copy()
+    rolled["Count"] = 1
+    rolled["ValueSum"] = df["Value"].fillna(0)
+    rolled["ConfidenceSum"] = df["Confidence"].fillna(0)
+    rolled["ConfidenceCount"] = df["Confidence"].notna().astype("int64")
+    cube = rolled.groupby(GRAIN, observed=True, dropna=False, sort=False)[MEASURES].sum().reset_index()
+    return _encode(cube)
+
+
+def merge_cubes(cube, delta):
+    combined = pd.concat([cube.astype({c: object for c in GRAIN}), delta.astype({c: object for c in GRAIN})])
+    merged = combined.groupby(GRAIN, dropna=False, sort=False)[MEASURES].sum().reset_index()
+    return _encode(merged)
+
+
+def _encode(cube):
+    # Categorical codes make the per-filter masks cheap
+    return cube.astype({"Company": "category", "Key": "category", "Document": "category", "Year": "Int64"})
+
+
+class DashboardCube:
+    def __init__(self, store):
+        self.store = store
+        self.lock = threading.Lock()
+        self.version = None
+        self.cube = None
+        store.listeners.append(self)
+
+    def get(self):
+        version = self.store.version()
+        with self.lock:
+            if self.cube is None or self.version != version:
+                self.cube = build_cube(self.store.read(columns=GRAIN + ["Value", "Confidence"]))
+                self.version = version
+            return self.cube
+
+    # === Store notifications ===
+    def on_append(self, df, version_before, version_after):
+        with self.lock:
+            if self.cube is None or self.version != version_before:
+                self.cube = None
+                return
+            self.cube = merge_cubes(self.cube, build_cube(df))
+            self.version = version_after
+
+    def invalidate(self):
+        with self.lock:
+            self.cube = None
+
+    # === Queries ===
+    def options(self):
+        cube = self.get()
+        companies = cube["Company"].dropna().unique().tolist()
+        years = sorted(cube["Year"].dropna().unique())
+        return companies, years
+
+    def filtered(self, company=None, year=None):
+        cube = self.get()
+        mask = pd.Series(True, index=cube.index)
+        if company is not None:
+            mask &= cube["Company"] == company
+        if year is not None:
+            mask &= cube["Year"] == year
+        return cube[mask]
+
+    @staticmethod
+    def summary(cube):
+        confidence_count = cube["ConfidenceCount"].sum()
+        return {
+            "reports": cube["Document"].nunique(),
+            "revenue": float(cube.loc[cube["Key"] == "Revenue", "ValueSum"].sum()),
+            "average_confidence": float(cube["ConfidenceSum"].sum() / confidence_count) if confidence_count else float("nan"),
+        }
+
+    @staticmethod
+    def key_by_company_year(cube, key="Revenue"):
+        # Chart-ready rows: one per Company x Year
+        rows = cube[cube["Key"] == key]
+        return (
+            rows.groupby(["Company", "Year"], observed=True)
+            .agg(Value=("ValueSum", "sum"), Documents=("Document", "nunique"))
+            .reset_index()
+        )
+
+
+_cubes = {}
+_cubes_lock = threading.Lock()
+
+
+def get_cube(store):
+    # One cube per entity store per process
+    with _cubes_lock:
+        cube = _cubes.get(id(store))
+        if cube is None:
+            cube = _cubes[id(store)] = DashboardCube(store)
+        return cube
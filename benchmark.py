@@ -0,0 +1,433 @@
+import argparse
+import datetime
+import inspect
+import json
+import os
+import platform
+import shutil
+import subprocess
+import tempfile
+import time
+
+import numpy as np
+
+from retriever import AzureSearchRetriever, BruteForceIndex, IVFIndex, build_index
+
+# Offline benchmarks on synthetic data and in-process service fakes (fakes.py).
+#
+#   python benchmark.py retrieval --sizes 10000 100000 --dim 1536
+#   python benchmark.py ingestion --sizes 20 200 --latency 0.05 --throttle 0.1
+#   python benchmark.py chat --sizes 1000 10000 --backend azure
+#   python benchmark.py entity_store --sizes 10000 1000000
+#   python benchmark.py all --compare
+#
+# retrieval: recall@k and per-query latency of the IVF index against the exact
+# brute-force baseline.
+# ingestion: the OCR -> embed -> index pipeline (pipeline.py) over `size` fake PDFs.
+# chat: the Chat page's embed -> retrieve -> context -> streamed answer path over a
+# `size`-chunk corpus, cold and then from cache.
+# entity_store: table writes/reads, dashboard cube, review queue, appends, reviews and
+# export for each entity store backend at `size` rows.
+#
+# Every result is appended to data/benchmarks.jsonl with the git commit it ran on;
+# --compare prints the change against the last recorded run from another commit.
+
+
+# === Synthetic data ===
+def clustered_vectors(count, dim, clusters=64, spread=0.35, seed=0):
+    # Embeddings of real documents are clustered by topic; uniform noise would make IVF look worse than it is
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(clusters, dim)).astype(np.float32)
+    labels = rng.integers(0, clusters, size=count)
+    return (centers[labels] + spread * rng.normal(size=(count, dim))).astype(np.float32)
+
+
+def _percentile_ms(samples, q):
+    return round(float(np.percentile(samples, q)) * 1000, 3)
+
+
+# === Retrieval ===
+def bench_retrieval(size, dim=1536, queries=200, k=10, n_probe=8, seed=0):
+    vectors = clustered_vectors(size + queries, dim, seed=seed)
+    corpus, query_vectors = vectors[:size], vectors[size:]
+    rows = [{"text": str(i), "source": "synthetic.json", "page": i} for i in range(size)]
+
+    started = time.perf_counter()
+    brute = BruteForceIndex(corpus, rows)
+    brute_build = time.perf_counter() - started
+
+    started = time.perf_counter()
+    ivf = IVFIndex(corpus, rows, n_probe=n_probe)
+    ivf_build = time.perf_counter() - started
+
+    brute_times = []
+    ivf_times = []
+    recall = []
+    for query in query_vectors:
+        started = time.perf_counter()
+        exact = brute.search(query, k)
+        brute_times.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        approximate = ivf.search(query, k)
+        ivf_times.append(time.perf_counter() - started)
+
+        expected = {r["page"] for r in exact}
+        recall.append(len(expected & {r["page"] for r in approximate}) / len(expected))
+
+    return {
+        "benchmark": "retrieval",
+        "size": size,
+        "dim": dim,
+        "k": k,
+        "n_probe": n_probe,
+        "recall_at_k": round(float(np.mean(recall)), 4),
+        "brute_build_s": round(brute_build, 3),
+        "ivf_build_s": round(ivf_build, 3),
+        "brute_p50_ms": _percentile_ms(brute_times, 50),
+        "brute_p95_ms": _percentile_ms(brute_times, 95),
+        "ivf_p50_ms": _percentile_ms(ivf_times, 50),
+        "ivf_p95_ms": _percentile_ms(ivf_times, 95),
+    }
+
+
+# === Ingestion ===
+def bench_ingestion(size, dim=64, pages=5, latency=0.05, throttle=0.0, ocr_workers=8, embed_workers=2,
+                    embedding_format="json", seed=0):
+    from fakes import (
+        FakeBlobServiceClient, FakeDocumentAnalysisClient, FakeOpenAI, FakeSearchClient, Throttle,
+        seed_landing_container,
+    )
+    from pipeline import Pipeline, settings_from_env
+
+    args = argparse.Namespace(
+        dry_run=True, ocr_workers=ocr_workers, embed_workers=embed_workers, queue_size=32, index_batch_size=1000,
+        index_concurrency=4,
+    )
+    settings = settings_from_env(args)
+    manifest_dir = tempfile.mkdtemp(prefix="benchmark-manifests-")
+    settings.update(manifest_dir=manifest_dir, full_rebuild=False, embedding_format=embedding_format)
+
+    # Document Intelligence and the embeddings deployment are the quota-bound services
+    ocr_throttle = Throttle(probability=throttle, retry_after=latency, seed=seed)
+    embed_throttle = Throttle(probability=throttle, retry_after=latency / 10, seed=seed + 1)
+    blob_service_client = FakeBlobServiceClient(latency=latency / 20)
+    seed_landing_container(blob_service_client.get_container_client(settings["doc_container_name"]), size)
+    pipeline = Pipeline(
+        blob_service_client,
+        FakeDocumentAnalysisClient(pages_per_document=pages, latency=latency, throttle=ocr_throttle),
+        FakeOpenAI(dimensions=dim, latency=latency / 10, throttle=embed_throttle),
+        FakeSearchClient(latency=latency / 10),
+        settings,
+    )
+    try:
+        summary = pipeline.run()
+    finally:
+        shutil.rmtree(manifest_dir, ignore_errors=True)
+
+    elapsed = max(summary["elapsed_seconds"], 1e-9)
+    stages = summary["stages"]
+    return {
+        "benchmark": "ingestion",
+        "size": size,
+        "pages": pages,
+        "latency": latency,
+        "throttle": throttle,
+        "ocr_workers": ocr_workers,
+        "embed_workers": embed_workers,
+        "embedding_format": embedding_format,
+        "elapsed_s": summary["elapsed_seconds"],
+        "documents_per_minute": round(stages["ocr"]["items"] * 60 / elapsed, 1),
+        "pages_per_second": round(stages["ocr"]["items"] * pages / elapsed, 1),
+        "failed": sum(stage["failed"] for stage in stages.values()),
+        "ocr_throttled": ocr_throttle.throttled,
+        "embed_throttled": embed_throttle.throttled,
+        "embedding_requests": summary["embedding_requests"],
+        "index_requests": summary["index_requests"],
+        **{f"{name}_busy_s": stage["busy_seconds"] for name, stage in stages.items()},
+    }
+
+
+# === Chat retrieval path ===
+def bench_chat(size, dim=256, queries=50, k=10, latency=0.0, throttle=0.0, backend="local", context_token_budget=1500,
+               seed=0):
+    from cache import ChatCache
+    from chat_client import stream_chat
+    from embedder import count_tokens
+    from fakes import FakeChatSession, FakeOpenAI, FakeSearchClient, Throttle, fake_embedding, synthetic_chunks, synthetic_questions
+
+    rows = synthetic_chunks(size, seed=seed)
+    started = time.perf_counter()
+    vectors = np.asarray([fake_embedding(row["text"], dim) for row in rows], dtype=np.float32)
+    if backend == "azure":
+        search_client = FakeSearchClient(latency=latency)
+        search_client.upload_documents([{"id": str(i), "embedding": vector.tolist(), **row} for i, (row, vector) in enumerate(zip(rows, vectors))])
+        retriever = AzureSearchRetriever(search_client)
+    else:
+        retriever = build_index(vectors, rows, kind="auto")
+    if backend == "hybrid":
+        from hybrid import BM25Index, HybridRetriever
+
+        retriever = HybridRetriever(retriever, BM25Index(rows))
+    build_s = time.perf_counter() - started
+
+    openai_client = FakeOpenAI(dimensions=dim, latency=latency)
+    session = FakeChatSession(latency=latency * 5, token_latency=latency / 20, throttle=Throttle(probability=throttle, seed=seed))
+    chat_cache = ChatCache()
+    questions = synthetic_questions(queries, seed=seed)
+    phases = {name: [] for name in ("embed", "search", "context", "first_token", "answer", "total", "cached_total")}
+    errors = 0
+
+    def ask(question, record):
+        started = time.perf_counter()
+        # Mirrors pages/6_Chat.py: embed, retrieve, dedupe + budget, then the streamed answer
+        t = time.perf_counter()
+        vector, _ = chat_cache.embed(question, lambda: openai_client.embeddings.create(model="fake", input=[question]).data[0].embedding)
+        record("embed", time.perf_counter() - t)
+
+        t = time.perf_counter()
+        search = (lambda: retriever.search(vector, k=k, query=question)) if backend == "hybrid" else (lambda: retriever.search(vector, k=k))
+        results, _ = chat_cache.retrieve(vector, retriever.version, k, search)
+        record("search", time.perf_counter() - t)
+
+        t = time.perf_counter()
+        seen = set()
+        context = []
+        used_tokens = 0
+        for r in sorted(results, key=lambda x: -x["score"]):
+            text = r["text"].strip()
+            if text in seen:
+                continue
+            seen.add(text)
+            tokens = count_tokens(text)
+            if context and used_tokens + tokens > context_token_budget:
+                continue
+            context.append(text)
+            used_tokens += tokens
+        context = "\n\n---\n\n".join(context)
+        record("context", time.perf_counter() - t)
+
+        payload = {"messages": [{"role": "user", "content": f"Answer the question: '{question}' using the context below:\n\n{context}"}]}
+        key = chat_cache.answer_key(question, context)
+        cached = chat_cache.answers.lookup(key)
+        if cached is None:
+            timings = {}
+            answer = "".join(stream_chat(session, "https://fake/chat", "fake-key", payload, timings=timings))
+            chat_cache.answers.store(key, answer, timings["total_s"])
+            record("first_token", timings.get("first_token_s", timings["total_s"]))
+            record("answer", timings["total_s"])
+        return time.perf_counter() - started
+
+    for question in questions:
+        try:
+            phases["total"].append(ask(question, lambda name, seconds: phases[name].append(seconds)))
+        except RuntimeError:
+            errors += 1
+    # The same questions again are answered from the caches
+    for question in questions:
+        try:
+            phases["cached_total"].append(ask(question, lambda name, seconds: None))
+        except RuntimeError:
+            errors += 1
+
+    result = {
+        "benchmark": "chat",
+        "size": size,
+        "dim": dim,
+        "queries": queries,
+        "backend": backend if backend != "local" else type(retriever).__name__,
+        "latency": latency,
+        "throttle": throttle,
+        "build_s": round(build_s, 3),
+        "errors": errors,
+    }
+    for name, samples in phases.items():
+        if samples:
+            result[f"{name}_p50_ms"] = _percentile_ms(samples, 50)
+            result[f"{name}_p95_ms"] = _percentile_ms(samples, 95)
+    return result
+
+
+# === Entity store / dashboard ===
+def _timed(function, repeat=1):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        value = function()
+        samples.append(time.perf_counter() - started)
+    return value, float(np.median(samples))
+
+
+def bench_entity_store(size, backends=("csv", "parquet", "sqlite"), seed=0):
+    from aggregates import DashboardCube
+    from entity_store import CSVBackend, EntityStore, ParquetBackend, SQLiteBackend, with_entity_ids
+    from export import export_entities
+    from fakes import synthetic_entities
+
+    classes = {"csv": CSVBackend, "parquet": ParquetBackend, "sqlite": SQLiteBackend}
+    suffixes = {"csv": "entities.csv", "parquet": "entities.parquet", "sqlite": "entities.db"}
+    entities = synthetic_entities(size, seed=seed)
+    results = []
+    for backend in backends:
+        directory = tempfile.mkdtemp(prefix=f"benchmark-{backend}-")
+        try:
+            path = os.path.join(directory, suffixes[backend])
+            try:
+                store = EntityStore(classes[backend](path))
+                _, write_s = _timed(lambda: store.replace(entities))
+            except ImportError as e:
+                results.append({"benchmark": "entity_store", "size": size, "backend": backend, "skipped": str(e)})
+                continue
+
+            # A fresh store per timing so nothing is served from the in-process frame cache
+            _, read_s = _timed(lambda: EntityStore(classes[backend](path)).read(), repeat=3)
+            company, year = entities["Company"].iloc[0], int(entities["Year"].iloc[0])
+            _, filtered_read_s = _timed(
+                lambda: EntityStore(classes[backend](path)).read(
+                    columns=["Company", "Year", "Key", "Value", "Document", "Page", "Confidence"],
+                    filters={"Company": company, "Year": year},
+                ),
+                repeat=3,
+            )
+
+            cube = DashboardCube(store)
+            _, cube_build_s = _timed(cube.get)
+            _, cube_filter_s = _timed(
+                lambda: (cube.summary(cube.filtered(company, year)), cube.key_by_company_year(cube.filtered(company))),
+                repeat=20,
+            )
+            _, review_page_s = _timed(lambda: store.low_confidence(0.9, 0, 25), repeat=5)
+
+            # Appends merge into the cube incrementally; reviews invalidate it
+            new_rows = synthetic_entities(100, seed=seed + 1)
+            _, append_s = _timed(lambda: (store.append(new_rows), cube.get()))
+            ids = store.read(columns=["EntityId"])["EntityId"].head(25).tolist()
+            _, review_s = _timed(lambda: store.update({i: {"Confidence": 0.99} for i in ids}))
+            _, cube_rebuild_s = _timed(cube.get)
+
+            (export_path, export_rows), export_s = _timed(lambda: export_entities(store, "csv", directory=directory))
+            os.remove(export_path)
+
+            results.append({
+                "benchmark": "entity_store",
+                "size": size,
+                "backend": backend,
+                "write_s": round(write_s, 3),
+                "read_s": round(read_s, 3),
+                "filtered_read_s": round(filtered_read_s, 4),
+                "cube_build_s": round(cube_build_s, 3),
+                "cube_filter_ms": round(cube_filter_s * 1000, 3),
+                "review_page_ms": round(review_page_s * 1000, 3),
+                "append_100_s": round(append_s, 4),
+                "review_25_s": round(review_s, 4),
+                "cube_rebuild_s": round(cube_rebuild_s, 3),
+                "export_csv_s": round(export_s, 3),
+                "export_rows": export_rows,
+            })
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+    return results
+
+
+benchmarks = {
+    "retrieval": bench_retrieval,
+    "ingestion": bench_ingestion,
+    "chat": bench_chat,
+    "entity_store": bench_entity_store,
+}
+
+default_sizes = {
+    "retrieval": [10000, 100000],
+    "ingestion": [20, 200],
+    "chat": [1000, 10000],
+    "entity_store": [10000, 100000, 1000000],
+}
+
+
+# === Recording and comparison ===
+def git_revision():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], capture_output=True, text=True).stdout.strip())
+    except (OSError, subprocess.CalledProcessError):
+        return None, False
+    return commit, dirty
+
+
+def _configuration(result):
+    # Everything that is not a measurement identifies the configuration
+    measured = ("_s", "_ms", "_per_minute", "_per_second", "recall_at_k", "throttled", "requests", "errors", "failed", "rows")
+    return {
+        key: value for key, value in result.items()
+        if key not in ("commit", "dirty", "recorded_at", "python", "machine") and not key.endswith(measured)
+    }
+
+
+def record_result(path, result):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "a", encoding="utf-8") as f:
+        f.write(json.dumps(result) + "\n")
+
+
+def previous_result(path, result):
+    # The last recorded run of the same configuration on a different commit
+    if not os.path.exists(path):
+        return None
+    configuration = _configuration(result)
+    previous = None
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            recorded = json.loads(line)
+            if recorded.get("commit") != result.get("commit") and _configuration(recorded) == configuration:
+                previous = recorded
+    return previous
+
+
+def compare(result, previous):
+    changes = {}
+    for key, value in result.items():
+        before = previous.get(key)
+        if key in _configuration(result) or not isinstance(value, (int, float)) or not isinstance(before, (int, float)) or not before:
+            continue
+        changes[key] = f"{before} -> {value} ({(value - before) / before:+.1%})"
+    return changes
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run offline benchmarks on synthetic data and local service fakes")
+    parser.add_argument("benchmark", choices=sorted(benchmarks) + ["all"])
+    parser.add_argument("--sizes", type=int, nargs="+", help="data sizes (defaults depend on the benchmark)")
+    parser.add_argument("--dim", type=int, help="embedding dimensions")
+    parser.add_argument("--latency", type=float, help="simulated seconds per service call")
+    parser.add_argument("--throttle", type=float, help="fraction of service calls rejected with 429")
+    parser.add_argument("--backend", help="chat: local, hybrid or azure (fake Search); entity_store: one backend")
+    parser.add_argument("--record", default="data/benchmarks.jsonl", help="results file ('' to skip recording)")
+    parser.add_argument("--compare", action="store_true", help="show the change against the last run on another commit")
+    args = parser.parse_args()
+
+    commit, dirty = git_revision()
+    for name in sorted(benchmarks) if args.benchmark == "all" else [args.benchmark]:
+        function = benchmarks[name]
+        accepted = inspect.signature(function).parameters
+        options = {"dim": args.dim, "latency": args.latency, "throttle": args.throttle, "backend": args.backend}
+        if name == "entity_store" and args.backend:
+            options["backends"] = [args.backend]
+        options = {key: value for key, value in options.items() if key in accepted and value is not None}
+
+        for size in args.sizes or default_sizes[name]:
+            results = function(size, **options)
+            for result in results if isinstance(results, list) else [results]:
+                result.update(
+                    commit=commit,
+                    dirty=dirty,
+                    recorded_at=datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+                    python=platform.python_version(),
+                    machine=platform.machine(),
+                )
+                print(json.dumps(result))
+                if args.compare and args.record:
+                    previous = previous_result(args.record, result)
+                    if previous:
+                        print(f"   vs {previous['commit']}: {json.dumps(compare(result, previous))}")
+                if args.record:
+                    record_result(args.record, result)
@@ -0,0 +1,44 @@
+import os
+import json
+from azure.storage.blob import BlobServiceClient
+from dotenv import load_dotenv
+from chunking import chunk_page
+from hybrid import BM25Index
+
+# Load environment variables
+load_dotenv()
+
+# === CONFIGURATION ===
+blob_connection_string = os.getenv("blob_connection_string")
+parsed_container_name = os.getenv("parsed_container_name")
+
+# Where the BM25 index used by retrieval_mode=hybrid is written
+lexical_index_path = os.getenv("lexical_index_path", "data/lexical_index")
+
+# Same chunking as step3.py, so lexical and vector hits on a chunk fuse into one result
+chunk_max_tokens = int(os.getenv("chunk_max_tokens", "400"))
+chunk_overlap_tokens = int(os.getenv("chunk_overlap_tokens", "60"))
+
+# === INIT CLIENTS ===
+blob_service_client = BlobServiceClient.from_connection_string(blob_connection_string)
+parsed_container_client = blob_service_client.get_container_client(parsed_container_name)
+
+# === COLLECT CHUNKS OF EVERY PARSED PAGE ===
+rows = []
+
+for blob in parsed_container_client.list_blobs():
+    if not blob.name.endswith(".json"):
+        continue
+    pages = json.loads(parsed_container_client.download_blob(blob.name).readall())
+    for page in pages:
+        if not page["text"].strip():
+            continue
+        for chunk in chunk_page(page, chunk_max_tokens, chunk_overlap_tokens):
+            rows.append({"text": chunk["text"], "source": blob.name, "page": page["page"], "chunk": chunk["chunk"]})
+
+print(f"Loaded {len(rows)} chunks")
+
+# === BUILD + SAVE ===
+index = BM25Index(rows)
+index.save(lexical_index_path)
+print(f"🎉 Saved BM25 index with {len(index.postings)} terms to {lexical_index_path}")
@@ -0,0 +1,51 @@
+import os
+import json
+from azure.storage.blob import BlobServiceClient
+from dotenv import load_dotenv
+from embedding_store import sync_shards, load_shard
+from retriever import build_index
+
+# Load environment variables
+load_dotenv()
+
+# === CONFIGURATION ===
+blob_connection_string = os.getenv("blob_connection_string")
+embedding_container_name = os.getenv("embeddings_container_name")
+
+# "json" (one blob per page) or "npy" (one float32 matrix + metadata blob per document)
+embedding_format = os.getenv("embedding_format", "json")
+embedding_cache_dir = os.getenv("embedding_cache_dir", "data/embeddings")
+
+# Where the local index is written, and which kind to build ("auto", "brute" or "ivf")
+local_index_path = os.getenv("local_index_path", "data/local_index")
+local_index_kind = os.getenv("local_index_kind", "auto")
+ivf_n_probe = int(os.getenv("ivf_n_probe", "8"))
+
+# === INIT CLIENTS ===
+blob_service_client = BlobServiceClient.from_connection_string(blob_connection_string)
+embedding_container_client = blob_service_client.get_container_client(embedding_container_name)
+
+# === COLLECT VECTORS + METADATA ===
+vectors = []
+rows = []
+
+if embedding_format == "npy":
+    for path in sync_shards(embedding_container_client, embedding_cache_dir):
+        shard_vectors, shard_rows = load_shard(path)
+        vectors.extend(shard_vectors)
+        rows.extend(shard_rows)
+else:
+    for blob in embedding_container_client.list_blobs():
+        if not blob.name.endswith(".embedding.json"):
+            continue
+        data = json.loads(embedding_container_client.download_blob(blob.name).readall())
+        vectors.append(data.pop("embedding"))
+        rows.append(data)
+
+print(f"Loaded {len(rows)} embeddings")
+
+# === BUILD + SAVE ===
+index = build_index(vectors, rows, kind=local_index_kind, n_probe=ivf_n_probe)
+index.save(local_index_path)
+
+print(f"🎉 Saved {index.kind} index with {len(rows)} vectors to {local_index_path}")
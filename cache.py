@@ -0,0 +1,201 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+# Layered caches for the Chat page.
+#
+#   query text               -> query embedding
+#   (embedding, index version) -> retrieved chunks
+#   (question, context hash) -> answer
+#
+# Each layer is an in-process LRU with TTL, optionally backed by a SQLite file so
+# every Streamlit session (and process) shares it. Retrieval keys include the index
+# version, so rebuilding the index makes old entries unreachable; they then age out.
+
+
+def make_key(*parts):
+    return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+def normalize_question(text):
+    return " ".join(text.lower().split())
+
+
+class MemoryCache:
+    def __init__(self, max_entries=1024, ttl=3600):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()  # key -> (expires, value)
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.time():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries[key] = (time.time() + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+class DiskCache:
+    # SQLite-backed LRU with TTL; values are stored as JSON
+    def __init__(self, path, namespace, max_entries=100000, ttl=86400):
+        self.path = path
+        self.namespace = namespace
+        self.max_entries = max_entries
+        self.ttl = ttl
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache ("
+                "namespace TEXT, key TEXT, value TEXT, expires REAL, accessed REAL, "
+                "PRIMARY KEY (namespace, key))"
+            )
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=10)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def get(self, key):
+        now = time.time()
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT value, expires FROM cache WHERE namespace = ? AND key = ?", (self.namespace, key)
+            ).fetchone()
+            if row is None:
+                return None
+            if row[1] < now:
+                conn.execute("DELETE FROM cache WHERE namespace = ? AND key = ?", (self.namespace, key))
+                return None
+            conn.execute("UPDATE cache SET accessed = ? WHERE namespace = ? AND key = ?", (now, self.namespace, key))
+        return json.loads(row[0])
+
+    def set(self, key, value):
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO cache (namespace, key, value, expires, accessed) VALUES (?, ?, ?, ?, ?)",
+                (self.namespace, key, json.dumps(value), now + self.ttl, now),
+            )
+            conn.execute(
+                "DELETE FROM cache WHERE namespace = ? AND key IN ("
+                "SELECT key FROM cache WHERE namespace = ? ORDER BY accessed DESC LIMIT -1 OFFSET ?)",
+                (self.namespace, self.namespace, self.max_entries),
+            )
+
+    def clear(self):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM cache WHERE namespace = ?", (self.namespace,))
+
+
+class CacheLayer:
+    # Memory in front of an optional disk cache, with hit/miss and time-saved counters
+    def __init__(self, name, memory, disk=None):
+        self.name = name
+        self.memory = memory
+        self.disk = disk
+        self.hits = 0
+        self.misses = 0
+        self.saved_seconds = 0.0
+        self.lock = threading.Lock()
+
+    def lookup(self, key):
+        entry = self.memory.get(key)
+        if entry is None and self.disk is not None:
+            entry = self.disk.get(key)
+            if entry is not None:
+                self.memory.set(key, entry)
+
+        with self.lock:
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.saved_seconds += entry["seconds"]
+        return entry
+
+    def store(self, key, value, seconds):
+        entry = {"value": value, "seconds": seconds}
+        self.memory.set(key, entry)
+        if self.disk is not None:
+            self.disk.set(key, entry)
+
+    def get_or_compute(self, key, compute):
+        entry = self.lookup(key)
+        if entry is not None:
+            return entry["value"], True
+
+        started = time.perf_counter()
+        value = compute()
+        self.store(key, value, time.perf_counter() - started)
+        return value, False
+
+    def clear(self):
+        self.memory.clear()
+        if self.disk is not None:
+            self.disk.clear()
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "layer": self.name,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0,
+            "saved_seconds": round(self.saved_seconds, 2),
+        }
+
+
+class ChatCache:
+    def __init__(self, disk_path=None, max_entries=1024, ttl=3600):
+        def layer(name):
+            disk = DiskCache(disk_path, name, ttl=ttl) if disk_path else None
+            return CacheLayer(name, MemoryCache(max_entries, ttl), disk)
+
+        self.embeddings = layer("embedding")
+        self.retrieval = layer("retrieval")
+        self.answers = layer("answer")
+
+    def embed(self, question, compute):
+        return self.embeddings.get_or_compute(make_key(normalize_question(question)), compute)
+
+    def retrieve(self, vector, index_version, k, compute):
+        return self.retrieval.get_or_compute(make_key(vector, index_version, k), compute)
+
+    def answer(self, question, context, compute):
+        return self.answers.get_or_compute(self.answer_key(question, context), compute)
+
+    def answer_key(self, question, context):
+        # For streamed answers, which are looked up and stored separately
+        return make_key(normalize_question(question), make_key(context))
+
+    def clear(self):
+        for layer in (self.embeddings, self.retrieval, self.answers):
+            layer.clear()
+
+    def stats(self):
+        return [layer.stats() for layer in (self.embeddings, self.retrieval, self.answers)]
@@ -0,0 +1,59 @@
+import json
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# Chat-completions calls over a pooled HTTP session.
+#
+# `stream_chat` posts with `"stream": true` and yields content deltas as the server-sent
+# events arrive, so the page can render the answer from the first token instead of
+# waiting for the last one. Failures raise RuntimeError with a message fit for display.
+
+
+def make_session(pool_size=10):
+    # One keep-alive connection pool per process instead of a new TCP/TLS handshake per request
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def _headers(api_key):
+    return {"Content-Type": "application/json", "api-key": api_key}
+
+
+def complete_chat(session, uri, api_key, payload, timeout=120):
+    response = session.post(uri, headers=_headers(api_key), json=payload, timeout=timeout)
+    if response.status_code != 200:
+        raise RuntimeError(f"❌ Request failed: {response.status_code} - {response.text}")
+    try:
+        return response.json()["choices"][0]["message"]["content"]
+    except (KeyError, IndexError):
+        raise RuntimeError("⚠️ Unexpected response format from GPT-4o.")
+
+
+def stream_chat(session, uri, api_key, payload, timeout=120, timings=None):
+    # Yields answer text deltas. If `timings` is a dict it receives `first_token_s` and `total_s`.
+    started = time.perf_counter()
+    with session.post(uri, headers=_headers(api_key), json={**payload, "stream": True},
+                      timeout=timeout, stream=True) as response:
+        if response.status_code != 200:
+            raise RuntimeError(f"❌ Request failed: {response.status_code} - {response.text}")
+        for line in response.iter_lines(decode_unicode=True):
+            if not line or not line.startswith("data:"):
+                continue
+            data = line[len("data:"):].strip()
+            if data == "[DONE]":
+                break
+            event = json.loads(data)
+            for choice in event.get("choices", []):
+                delta = (choice.get("delta") or {}).get("content")
+                if not delta:
+                    continue
+                if timings is not None and "first_token_s" not in timings:
+                    timings["first_token_s"] = time.perf_counter() - started
+                yield delta
+    if timings is not None:
+        timings["total_s"] = time.perf_counter() - started
@@ -0,0 +1,104 @@
+import re
+
+from embedder import count_tokens
+
+# Token-bounded page chunking with overlap.
+#
+# Pages are split along the lines Document Intelligence returned (stored by main.py as
+# `lines`), so a sentence fragment or table row is never cut in half. Runs of mostly
+# numeric lines (table rows) are kept together with the line above them (the header)
+# where they fit, and each chunk repeats the last `overlap_tokens` of the previous one.
+
+_number = re.compile(r"^[\(\-–]?[$€£%]?\d[\d,.\s%)]*$")
+
+
+def is_table_line(line):
+    tokens = line.split()
+    if not tokens:
+        return False
+    numeric = sum(1 for token in tokens if _number.match(token))
+    return numeric * 2 >= len(tokens)
+
+
+def _split_long(text, max_tokens):
+    # Fallback for a single line longer than a chunk: split it into word windows
+    words = text.split()
+    piece = []
+    for word in words:
+        piece.append(word)
+        if count_tokens(" ".join(piece)) >= max_tokens:
+            yield " ".join(piece)
+            piece = []
+    if piece:
+        yield " ".join(piece)
+
+
+def _blocks(lines, max_tokens):
+    # Group lines into atomic blocks: a table header plus its numeric rows, or a single line
+    blocks = []
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        if is_table_line(line) and blocks:
+            candidate = blocks[-1] + [line]
+            if count_tokens(" ".join(candidate)) <= max_tokens:
+                blocks[-1] = candidate
+                continue
+        if count_tokens(line) > max_tokens:
+            blocks.extend([part] for part in _split_long(line, max_tokens))
+        else:
+            blocks.append([line])
+    return blocks
+
+
+def chunk_page(page, max_tokens=400, overlap_tokens=60):
+    # Returns [{"chunk", "text", "offset"}] where offset is the character offset of the
+    # chunk's first line in page["text"]. max_tokens <= 0 keeps the whole page as one chunk.
+    text = page["text"]
+    if max_tokens <= 0 or count_tokens(text) <= max_tokens:
+        return [{"chunk": 0, "text": text, "offset": 0}]
+
+    lines = page.get("lines") or re.split(r"(?<=[.!?])\s+", text)
+    blocks = _blocks(lines, max_tokens)
+
+    # Character offset of every block within the page text (lines are joined by spaces)
+    offsets = []
+    cursor = 0
+    for block in blocks:
+        found = text.find(block[0], cursor)
+        offsets.append(found if found >= 0 else cursor)
+        cursor = max(cursor, offsets[-1])
+
+    chunks = []
+    start = 0
+    while start < len(blocks):
+        end = start
+        tokens = 0
+        while end < len(blocks):
+            block_tokens = count_tokens(" ".join(blocks[end]))
+            if end > start and tokens + block_tokens > max_tokens:
+                break
+            tokens += block_tokens
+            end += 1
+
+        chunks.append({
+            "chunk": len(chunks),
+            "text": " ".join(line for block in blocks[start:end] for line in block),
+            "offset": offsets[start],
+        })
+        if end >= len(blocks):
+            break
+
+        # Step back over trailing blocks that fit in the overlap, always moving forward
+        next_start = end
+        overlap = 0
+        while next_start - 1 > start:
+            block_tokens = count_tokens(" ".join(blocks[next_start - 1]))
+            if overlap + block_tokens > overlap_tokens:
+                break
+            overlap += block_tokens
+            next_start -= 1
+        start = next_start
+
+    return chunks
@@ -0,0 +1,166 @@
+import math
+import re
+import time
+
+from embedder import count_tokens, truncate_to_tokens
+from hybrid import tokenize
+
+# Multi-turn state for the Chat page.
+#
+# A Conversation keeps the turns of one Streamlit session. Follow-up questions ("and in
+# 2022?", "how does that compare to its EBITDA?") are rewritten into standalone queries
+# before they are embedded, so retrieval and the caches see a self-contained question.
+# A turn whose standalone query embeds close to an earlier one reuses that turn's
+# retrieved chunks instead of searching again. `messages()` keeps the history under its
+# own token budget (the retrieved context has a separate one): the most recent turns
+# verbatim, older turns folded into a short extractive summary.
+
+_follow_up = re.compile(
+    r"^(and|also|what about|how about|same|compared|versus|vs\.?)\b"
+    r"|\b(it|its|it's|they|them|their|this|that|these|those|he|she|his|her|there|then|previous|above|same)\b",
+    re.IGNORECASE,
+)
+_sentence = re.compile(r"(?<=[.!?])\s+")
+
+REWRITE_PROMPT = (
+    "Rewrite the user's last question as a standalone question that can be understood without the conversation. "
+    "Resolve pronouns and references (companies, years, metrics) from the earlier turns. "
+    "Reply with the rewritten question only."
+)
+
+
+def is_follow_up(question):
+    return len(question.split()) <= 4 or _follow_up.search(question) is not None
+
+
+def cosine(a, b):
+    dot = sum(x * y for x, y in zip(a, b))
+    norm = math.sqrt(sum(x * x for x in a)) * math.sqrt(sum(y * y for y in b))
+    return dot / norm if norm else 0.0
+
+
+class Conversation:
+    def __init__(self, history_token_budget=1200, recent_turns=3, summary_tokens=300, reuse_threshold=0.92,
+                 max_turns=10):
+        self.turns = []  # {"question", "standalone", "answer", "vector", "chunks", "version", "at"}
+        self.summary = []  # one line per turn that left the verbatim window
+        self.history_token_budget = history_token_budget
+        self.recent_turns = recent_turns
+        self.summary_tokens = summary_tokens
+        self.reuse_threshold = reuse_threshold
+        self.max_turns = max(max_turns, recent_turns)
+
+    # === Query rewriting ===
+    def standalone_query(self, question, complete=None):
+        # `complete(payload)` asks the chat model; without it, or if it fails, the last
+        # standalone question's terms are carried over
+        if not self.turns or not is_follow_up(question):
+            return question
+        if complete is not None:
+            recent = self.turns[-self.recent_turns:]
+            transcript = "\n".join(
+                f"User: {turn['standalone']}\nAssistant: {truncate_to_tokens(turn['answer'], 150)}" for turn in recent
+            )
+            payload = {
+                "messages": [
+                    {"role": "system", "content": REWRITE_PROMPT},
+                    {"role": "user", "content": f"{transcript}\nUser: {question}"},
+                ],
+                "temperature": 0,
+                "max_tokens": 100,
+            }
+            try:
+                rewritten = complete(payload).strip().strip('"')
+                if rewritten:
+                    return rewritten
+            except RuntimeError:
+                pass
+        previous = self.turns[-1]["standalone"]
+        missing = [term for term in tokenize(previous) if term not in set(tokenize(question))]
+        return f"{question} ({' '.join(missing)})" if missing else question
+
+    # === Retrieval reuse ===
+    def reusable_chunks(self, vector, version=None):
+        # Chunks retrieved for an earlier, near-identical standalone query from the same
+        # index version (the retriever's `version`), so a rebuilt index is searched again
+        best, best_similarity = None, self.reuse_threshold
+        for turn in self.turns:
+            if turn["vector"] is None or turn.get("version") != version:
+                continue
+            similarity = cosine(vector, turn["vector"])
+            if similarity >= best_similarity:
+                best, best_similarity = turn, similarity
+        return None if best is None else best["chunks"]
+
+    # === Turns + prompt packing ===
+    def add_turn(self, question, standalone, answer, vector, chunks, version=None):
+        self.turns.append({
+            "question": question, "standalone": standalone, "answer": answer,
+            "vector": list(vector) if vector is not None else None, "chunks": chunks, "version": version,
+            "at": time.time(),
+        })
+        for turn in self.turns[:-self.recent_turns]:
+            if not turn.get("folded"):
+                self._fold(turn)
+        # Folded turns stay only for retrieval reuse, and only the latest few of them
+        del self.turns[:-self.max_turns]
+
+    @staticmethod
+    def _summary_line(turn):
+        first_sentence = _sentence.split(turn["answer"].strip(), maxsplit=1)[0]
+        return f"- Q: {turn['standalone']} A: {truncate_to_tokens(first_sentence, 60)}"
+
+    def _fold(self, turn):
+        turn["folded"] = True
+        self.summary.append(self._summary_line(turn))
+        while len(self.summary) > 1 and count_tokens("\n".join(self.summary)) > self.summary_tokens:
+            self.summary.pop(0)
+
+    def history_messages(self):
+        # Most recent turns verbatim (newest kept first), older ones as a summary, within the budget
+        budget = self.history_token_budget
+        messages = []
+        recent = [turn for turn in self.turns if not turn.get("folded")]
+        summary = list(self.summary)
+        for position in range(len(recent) - 1, -1, -1):
+            turn = recent[position]
+            pair = [
+                {"role": "user", "content": turn["standalone"]},
+                {"role": "assistant", "content": turn["answer"]},
+            ]
+            tokens = sum(count_tokens(message["content"]) for message in pair)
+            if tokens > budget:
+                if messages:
+                    # Recent turns that don't fit verbatim are summarized like older ones
+                    summary += [self._summary_line(older) for older in recent[:position + 1]]
+                    break
+                pair[1]["content"] = truncate_to_tokens(turn["answer"], max(budget - count_tokens(turn["standalone"]), 0))
+                tokens = budget
+            messages[:0] = pair
+            budget -= tokens
+        if summary and budget > 0:
+            messages[:0] = self._summary_message(summary, budget)
+        return messages
+
+    @staticmethod
+    def _summary_message(summary, budget):
+        # The newest summary lines that fit in `budget`, in conversation order
+        heading = "Earlier in this conversation:"
+        budget -= count_tokens(heading)
+        kept = []
+        for line in reversed(summary):
+            tokens = count_tokens(line) + 1  # and its newline
+            if tokens > budget:
+                break
+            kept.insert(0, line)
+            budget -= tokens
+        if not kept:
+            return []
+        return [{"role": "system", "content": "\n".join([heading, *kept])}]
+
+    def messages(self, system_prompt, user_content):
+        return [{"role": "system", "content": system_prompt}, *self.history_messages(), {"role": "user", "content": user_content}]
+
+    def clear(self):
+        self.turns.clear()
+        self.summary.clear()
@@ -0,0 +1,166 @@
+import hashlib
+import json
+import os
+import re
+
+import numpy as np
+
+from manifest import document_id
+
+# Near-duplicate chunk detection for the embedding step.
+#
+# Each chunk gets a MinHash signature over its word shingles; locality-sensitive
+# hashing (signature bands) finds candidate matches and the estimated Jaccard
+# similarity confirms them. A chunk whose estimate reaches `threshold` against an
+# already embedded ("canonical") chunk is not embedded again but recorded as another
+# (source, page) reference of it. The state is persisted next to the manifests so
+# boilerplate repeated across reports and years is only embedded once.
+#
+# Canonicals belong to the file that produced them. `release(owner)` forgets a file's
+# canonicals and references and returns the files that pointed at its canonicals, which
+# must be re-embedded. step3.py, pipeline.py and the job workers all embed through
+# `collapse(owner, chunks)`, so they agree on which chunks have been embedded.
+
+_prime = (1 << 61) - 1
+_word = re.compile(r"\w+")
+
+
+def _unhex(signature):
+    return np.frombuffer(bytes.fromhex(signature), dtype=np.uint32)
+
+
+def _hash32(text):
+    return int.from_bytes(hashlib.blake2b(text.encode("utf-8"), digest_size=4).digest(), "big")
+
+
+class NearDuplicateIndex:
+    def __init__(self, path=None, threshold=0.9, num_perm=64, bands=16, shingle_size=5, full_rebuild=False, seed=1):
+        self.path = path
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows_per_band = num_perm // bands
+        self.shingle_size = shingle_size
+        rng = np.random.default_rng(seed)
+        # a < 2**31 keeps a * hash + b inside uint64
+        self.a = rng.integers(1, 1 << 31, size=num_perm, dtype=np.uint64)
+        self.b = rng.integers(0, 1 << 32, size=num_perm, dtype=np.uint64)
+        self.load(full_rebuild)
+
+    def load(self, empty=False):
+        # (Re)reads the saved state, e.g. after another process changed it
+        self.canonical = {}  # doc id -> {"owner", "source", "page", "chunk", "signature"}
+        self.references = {}  # canonical doc id -> [{"owner", "source", "page", "chunk"}]
+        self.buckets = {}  # (band, band hash) -> set of canonical doc ids
+        self.owned = {}  # owner -> canonical doc ids it produced
+        self.referencing = {}  # owner -> canonical doc ids it references
+        if empty or not self.path or not os.path.exists(self.path):
+            return
+        with open(self.path, "r", encoding="utf-8") as f:
+            state = json.load(f)
+        for doc_id, entry in state["canonical"].items():
+            self._index(doc_id, entry, _unhex(entry["signature"]))
+        for doc_id, refs in state["references"].items():
+            for ref in refs:
+                self.add_reference(doc_id, ref["owner"], ref)
+
+    # === Signatures ===
+    def signature(self, text):
+        words = _word.findall(text.lower())
+        size = self.shingle_size
+        shingles = {" ".join(words[i:i + size]) for i in range(max(1, len(words) - size + 1))}
+        hashes = np.fromiter((_hash32(s) for s in shingles), dtype=np.uint64, count=len(shingles))
+        permuted = (self.a[:, None] * hashes[None, :] + self.b[:, None]) % _prime
+        return (permuted.min(axis=1) & 0xFFFFFFFF).astype(np.uint32)
+
+    def _bands(self, signature):
+        step = self.rows_per_band
+        return [(band, signature[band * step:(band + 1) * step].tobytes().hex()) for band in range(self.bands)]
+
+    def _index(self, doc_id, entry, signature):
+        self.canonical[doc_id] = {**entry, "signature": signature.tobytes().hex()}
+        self.owned.setdefault(entry["owner"], set()).add(doc_id)
+        for band in self._bands(signature):
+            self.buckets.setdefault(band, set()).add(doc_id)
+
+    # === Lookup / registration ===
+    def find(self, signature):
+        # The canonical chunk this signature duplicates, or None
+        candidates = set()
+        for band in self._bands(signature):
+            candidates.update(self.buckets.get(band, ()))
+        best, best_similarity = None, self.threshold
+        for doc_id in candidates:
+            similarity = float(np.mean(_unhex(self.canonical[doc_id]["signature"]) == signature))
+            if similarity >= best_similarity:
+                best, best_similarity = doc_id, similarity
+        return best
+
+    def add(self, doc_id, owner, row, signature):
+        self._index(doc_id, {"owner": owner, "source": row["source"], "page": row["page"], "chunk": row["chunk"]}, signature)
+
+    def add_reference(self, canonical_id, owner, row):
+        self.references.setdefault(canonical_id, []).append(
+            {"owner": owner, "source": row["source"], "page": row["page"], "chunk": row["chunk"]}
+        )
+        self.referencing.setdefault(owner, set()).add(canonical_id)
+
+    def collapse(self, owner, chunks):
+        # Registers the chunks ({"page", "chunk", "text"}) of file `owner`. Returns the chunks
+        # to embed, and {(page, chunk): canonical doc id} for the near-duplicates of chunks
+        # embedded earlier (in this run or before), which only get a reference.
+        unique = []
+        duplicates = {}
+        for chunk in chunks:
+            row = {"source": owner, "page": chunk["page"], "chunk": chunk["chunk"]}
+            signature = self.signature(chunk["text"])
+            canonical = self.find(signature)
+            if canonical is not None:
+                self.add_reference(canonical, owner, row)
+                duplicates[(chunk["page"], chunk["chunk"])] = canonical
+                continue
+            self.add(document_id(owner, chunk["page"], chunk["chunk"]), owner, row, signature)
+            unique.append(chunk)
+        return unique, duplicates
+
+    def release(self, owner):
+        dependants = set()
+        for doc_id in self.owned.pop(owner, ()):
+            entry = self.canonical.pop(doc_id)
+            for band in self._bands(_unhex(entry["signature"])):
+                self.buckets.get(band, set()).discard(doc_id)
+            for ref in self.references.pop(doc_id, []):
+                dependants.add(ref["owner"])
+                self.referencing.get(ref["owner"], set()).discard(doc_id)
+        for doc_id in self.referencing.pop(owner, ()):
+            refs = [ref for ref in self.references.get(doc_id, []) if ref["owner"] != owner]
+            if refs:
+                self.references[doc_id] = refs
+            else:
+                self.references.pop(doc_id, None)
+        dependants.discard(owner)
+        return dependants
+
+    # === Persistence / publishing ===
+    def duplicates_by_chunk(self):
+        # Document id (manifest.document_id) of each canonical chunk -> [source, page] of
+        # its near-duplicates. Keyed per chunk, not per page: a page holding one boilerplate
+        # chunk must not pull in the duplicates of that boilerplate for its other chunks.
+        pages = {}
+        for doc_id, refs in self.references.items():
+            if doc_id not in self.canonical:
+                continue
+            entry = pages.setdefault(doc_id, [])
+            for ref in refs:
+                if [ref["source"], ref["page"]] not in entry:
+                    entry.append([ref["source"], ref["page"]])
+        return pages
+
+    def save(self):
+        if not self.path:
+            return
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"canonical": self.canonical, "references": self.references}, f)
+        os.replace(tmp_path, self.path)
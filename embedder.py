@@ -0,0 +1,136 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from metrics import registry
+from ocr import is_throttled, backoff_delay
+
+# Batched embedding requests.
+#
+# Inputs from many pages (and files) are packed into each embeddings call up to the
+# deployment's input-count and token limits, several batches run concurrently, and
+# only the items that failed are retried. The client only needs an OpenAI-style
+# `embeddings.create(model=..., input=[...])`, so a local fake endpoint works too.
+
+_encoding = None
+_encoding_loaded = False
+
+
+def _get_encoding():
+    # Loaded on first use: importing tiktoken and reading its BPE file costs a page load
+    global _encoding, _encoding_loaded
+    if not _encoding_loaded:
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding("cl100k_base")
+        except Exception:  # tiktoken is optional, fall back to a ~4 chars/token estimate
+            _encoding = None
+        _encoding_loaded = True
+    return _encoding
+
+
+def count_tokens(text):
+    encoding = _get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    return len(text) // 4 + 1
+
+
+def truncate_to_tokens(text, max_tokens):
+    encoding = _get_encoding()
+    if encoding is not None:
+        tokens = encoding.encode(text, disallowed_special=())
+        if len(tokens) <= max_tokens:
+            return text
+        return encoding.decode(tokens[:max_tokens])
+    if count_tokens(text) <= max_tokens:
+        return text
+    return text[:(max_tokens - 1) * 4]  # count_tokens estimates len // 4 + 1
+
+
+# === Packing ===
+def pack_batches(items, max_inputs=64, max_batch_tokens=100000, max_input_tokens=8191):
+    # items is a list of (key, text). Yields lists of (key, text, tokens) that respect
+    # both the per-request input count and the total token budget.
+    batch = []
+    batch_tokens = 0
+    for key, text in items:
+        text = truncate_to_tokens(text, max_input_tokens)
+        tokens = count_tokens(text)
+        if batch and (len(batch) >= max_inputs or batch_tokens + tokens > max_batch_tokens):
+            yield batch
+            batch = []
+            batch_tokens = 0
+        batch.append((key, text, tokens))
+        batch_tokens += tokens
+    if batch:
+        yield batch
+
+
+class BatchEmbedder:
+    def __init__(self, client, model, max_inputs=64, max_batch_tokens=100000, max_input_tokens=8191,
+                 concurrency=4, max_retries=5, base_delay=1.0):
+        self.client = client
+        self.model = model
+        self.max_inputs = max_inputs
+        self.max_batch_tokens = max_batch_tokens
+        self.max_input_tokens = max_input_tokens
+        self.concurrency = max(1, int(concurrency))
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.requests = 0
+        self.retries = 0
+        self.tokens = 0
+        self.lock = threading.Lock()
+
+    def _count(self, requests=0, retries=0, tokens=0):
+        with self.lock:
+            self.requests += requests
+            self.retries += retries
+            self.tokens += tokens
+        if retries:
+            registry.increment("embed.retries", retries)
+        if tokens:
+            registry.increment("embed.tokens", tokens)
+
+    def _request(self, batch):
+        with registry.timer("embed.request"):
+            response = self.client.embeddings.create(model=self.model, input=[text for _, text, _ in batch])
+        registry.increment("embed.inputs", len(batch))
+        self._count(requests=1, tokens=sum(tokens for _, _, tokens in batch))
+        # The service returns one item per input, tagged with its position
+        ordered = sorted(response.data, key=lambda d: d.index)
+        return {batch[d.index][0]: d.embedding for d in ordered}
+
+    def _embed_batch(self, batch, attempt=0):
+        # Returns (embeddings by key, {key: error}) for one packed batch.
+        try:
+            return self._request(batch), {}
+        except Exception as e:
+            if is_throttled(e):
+                if attempt >= self.max_retries:
+                    return {}, {key: e for key, _, _ in batch}
+                self._count(retries=1)
+                time.sleep(backoff_delay(e, attempt, base_delay=self.base_delay))
+                return self._embed_batch(batch, attempt + 1)
+            if len(batch) == 1:
+                return {}, {batch[0][0]: e}
+            # A bad input fails the whole request: split to isolate it and retry only the rest
+            self._count(retries=1)
+            middle = len(batch) // 2
+            left, left_failed = self._embed_batch(batch[:middle])
+            right, right_failed = self._embed_batch(batch[middle:])
+            return {**left, **right}, {**left_failed, **right_failed}
+
+    def embed(self, items):
+        # items is an iterable of (key, text). Returns (embeddings by key, {key: error}).
+        batches = list(pack_batches(items, self.max_inputs, self.max_batch_tokens, self.max_input_tokens))
+        embeddings = {}
+        failed = {}
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            futures = [executor.submit(self._embed_batch, batch) for batch in batches]
+            for future in as_completed(futures):
+                done, errors = future.result()
+                embeddings.update(done)
+                failed.update(errors)
+        return embeddings, failed
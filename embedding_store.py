@@ -0,0 +1,115 @@
+import io
+import json
+import os
+
+import numpy as np
+
+# Compact per-document embedding shards.
+#
+# Instead of one `*.pageN.embedding.json` blob per page, each parsed document is stored
+# as two blobs: `<doc>.vectors.npy`, a float32 matrix with one row per page/chunk, and
+# `<doc>.meta.json`, the matching metadata rows (source, page, offset, text). Shards
+# are mirrored into a local cache directory and opened with memory mapping so the
+# indexer and local search can read vectors without copying or parsing them.
+
+VECTORS_SUFFIX = ".vectors.npy"
+META_SUFFIX = ".meta.json"
+# Written by step3.py: document id of a kept chunk -> [source, page] of its near-duplicates
+DUPLICATES_BLOB = "_duplicates.json"
+
+
+def shard_base(source):
+    return source[:-len(".json")] if source.endswith(".json") else source
+
+
+def shard_names(source):
+    base = shard_base(source)
+    return base + VECTORS_SUFFIX, base + META_SUFFIX
+
+
+# === Writing ===
+def serialize_vectors(embeddings):
+    buffer = io.BytesIO()
+    np.save(buffer, np.asarray(embeddings, dtype=np.float32), allow_pickle=False)
+    return buffer.getvalue()
+
+
+def write_shard(container_client, source, rows, embeddings):
+    # rows[i] describes embeddings[i]; returns the blob names written
+    vectors_name, meta_name = shard_names(source)
+    container_client.upload_blob(name=vectors_name, data=serialize_vectors(embeddings), overwrite=True)
+    container_client.upload_blob(name=meta_name, data=json.dumps(rows, ensure_ascii=False), overwrite=True)
+    return [vectors_name, meta_name]
+
+
+# === Local cache ===
+def _local_path(cache_dir, blob_name):
+    return os.path.join(cache_dir, blob_name.replace("/", os.sep))
+
+
+def sync_shards(container_client, cache_dir):
+    # Mirror shard blobs into cache_dir, downloading only those whose ETag changed, and
+    # delete cached shards whose blob is gone. Returns the local paths of every vectors
+    # file currently in the container.
+    etags_path = os.path.join(cache_dir, "etags.json")
+    etags = {}
+    if os.path.exists(etags_path):
+        with open(etags_path, "r", encoding="utf-8") as f:
+            etags = json.load(f)
+
+    vectors_paths = []
+    listed = set()
+    for blob in container_client.list_blobs():
+        if not blob.name.endswith((VECTORS_SUFFIX, META_SUFFIX)):
+            continue
+        listed.add(blob.name)
+        path = _local_path(cache_dir, blob.name)
+        if etags.get(blob.name) != blob.etag or not os.path.exists(path):
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            with open(path, "wb") as f:
+                container_client.download_blob(blob.name).readinto(f)
+            etags[blob.name] = blob.etag
+        if blob.name.endswith(VECTORS_SUFFIX):
+            vectors_paths.append(path)
+
+    # Shards of deleted documents must not stay in the local or IVF index
+    etags = {name: etag for name, etag in etags.items() if name in listed}
+    for root, _, files in os.walk(cache_dir):
+        for file_name in files:
+            path = os.path.join(root, file_name)
+            blob_name = os.path.relpath(path, cache_dir).replace(os.sep, "/")
+            if file_name.endswith((VECTORS_SUFFIX, META_SUFFIX)) and blob_name not in listed:
+                os.remove(path)
+
+    os.makedirs(cache_dir, exist_ok=True)
+    with open(etags_path, "w", encoding="utf-8") as f:
+        json.dump(etags, f)
+    return vectors_paths
+
+
+# === Reading ===
+def load_shard(vectors_path):
+    # Returns (memory-mapped float32 matrix, metadata rows)
+    vectors = np.load(vectors_path, mmap_mode="r")
+    with open(vectors_path[:-len(VECTORS_SUFFIX)] + META_SUFFIX, "r", encoding="utf-8") as f:
+        rows = json.load(f)
+    return vectors, rows
+
+
+def iter_shards(cache_dir):
+    for root, _, files in os.walk(cache_dir):
+        for file_name in sorted(files):
+            if file_name.endswith(VECTORS_SUFFIX):
+                yield load_shard(os.path.join(root, file_name))
+
+
+def load_all(cache_dir):
+    # Stacks every shard into one matrix (this copies) with the concatenated metadata rows
+    matrices = []
+    rows = []
+    for vectors, shard_rows in iter_shards(cache_dir):
+        matrices.append(vectors)
+        rows.extend(shard_rows)
+    if not matrices:
+        return np.zeros((0, 0), dtype=np.float32), rows
+    return np.concatenate(matrices).astype(np.float32, copy=False), rows
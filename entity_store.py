@@ -0,0 +1,581 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+import pandas as pd
+
+# Shared store for extracted entities.
+#
+# All pages read through `get_store()`, which keeps one typed DataFrame per process
+# and only re-reads the backing file when its version (mtime/size) changes, so widget
+# interactions no longer re-parse the whole table. Every row has a stable EntityId.
+# New rows are appended; edits to existing rows are addressed by EntityId. Backends:
+#   - csv: data/entities.csv (default, appended in place)
+#   - parquet: a directory of part files; reads push column and row filters down
+#   - sqlite: one table; reads push column and row filters down as SQL, edits are UPDATEs
+# For csv and parquet, edits and deletions go to an append-only change log
+# (`<path>.changes.jsonl`) that is replayed on read and folded into the table every
+# `compact_every` changes.
+# All writes hold a lock file so concurrent reviewers and uploads never lose rows.
+
+COLUMNS = ["EntityId", "Document", "Company", "Year", "Key", "Value", "Page", "Confidence"]
+
+DTYPES = {
+    "EntityId": "string",
+    "Document": "string",
+    "Company": "category",
+    "Year": "Int64",
+    "Key": "category",
+    "Value": "float64",
+    "Page": "Int64",
+    "Confidence": "float64",
+}
+
+DEFAULT_PATHS = {
+    "csv": "data/entities.csv",
+    "parquet": "data/entities.parquet",
+    "sqlite": "data/entities.sqlite",
+}
+
+
+def apply_dtypes(df):
+    df = df.copy()
+    for column in COLUMNS:
+        if column not in df.columns:
+            continue
+        dtype = DTYPES[column]
+        if dtype in ("Int64", "float64"):
+            df[column] = pd.to_numeric(df[column], errors="coerce").astype(dtype)
+        else:
+            df[column] = df[column].astype(dtype)
+    return df
+
+
+def empty_frame(columns=None):
+    return apply_dtypes(pd.DataFrame(columns=columns or COLUMNS))
+
+
+def _apply_filters(df, filters):
+    # filters maps a column to a value or a list of accepted values
+    for column, value in (filters or {}).items():
+        values = value if isinstance(value, (list, tuple, set)) else [value]
+        df = df[df[column].isin(values)]
+    return df
+
+
+def _file_version(path):
+    if not os.path.exists(path):
+        return None
+    if os.path.isdir(path):
+        stats = [os.stat(os.path.join(path, name)) for name in sorted(os.listdir(path))]
+        return tuple((s.st_mtime_ns, s.st_size) for s in stats)
+    stat = os.stat(path)
+    return stat.st_mtime_ns, stat.st_size
+
+
+def new_entity_id():
+    return uuid.uuid4().hex
+
+
+def with_entity_ids(df):
+    # Assigns an EntityId to rows that do not have one yet
+    df = df.copy()
+    if "EntityId" not in df.columns:
+        df.insert(0, "EntityId", pd.NA)
+    missing = df["EntityId"].isna()
+    if missing.any():
+        df["EntityId"] = df["EntityId"].astype(object)
+        df.loc[missing, "EntityId"] = [new_entity_id() for _ in range(int(missing.sum()))]
+    return df
+
+
+# === Locking + change log ===
+class FileLock:
+    # Cross-process lock using an exclusively created file; stale locks are broken after `stale` seconds
+    def __init__(self, path, timeout=30, stale=120):
+        self.path = path
+        self.timeout = timeout
+        self.stale = stale
+        self.fd = None
+
+    def __enter__(self):
+        deadline = time.monotonic() + self.timeout
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        while True:
+            try:
+                self.fd = os.open(self.path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+                return self
+            except FileExistsError:
+                try:
+                    if time.time() - os.path.getmtime(self.path) > self.stale:
+                        os.remove(self.path)
+                        continue
+                except FileNotFoundError:
+                    continue
+                if time.monotonic() > deadline:
+                    raise TimeoutError(f"Timed out waiting for lock {self.path}")
+                time.sleep(0.05)
+
+    def __exit__(self, *exc):
+        os.close(self.fd)
+        os.remove(self.path)
+
+
+class ChangeLog:
+    # Append-only JSON lines of {"id": EntityId, "fields": {...}, "at": timestamp}, or
+    # {"id": EntityId, "deleted": true, "at": timestamp} for a removed row
+    def __init__(self, path):
+        self.path = path
+
+    def version(self):
+        return _file_version(self.path)
+
+    def append(self, changes):
+        lines = "".join(
+            json.dumps({"id": entity_id, "fields": fields, "at": time.time()}, default=str) + "\n"
+            for entity_id, fields in changes.items()
+        )
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(lines)
+
+    def delete(self, entity_ids):
+        lines = "".join(json.dumps({"id": entity_id, "deleted": True, "at": time.time()}) + "\n" for entity_id in entity_ids)
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(lines)
+
+    def read(self):
+        if not os.path.exists(self.path):
+            return []
+        with open(self.path, "r", encoding="utf-8") as f:
+            return [json.loads(line) for line in f if line.strip()]
+
+    def clear(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def apply_changes(df, changes):
+    # Replays change-log entries (last write per field wins) onto rows matched by EntityId
+    # and drops deleted rows
+    if not changes or df.empty:
+        return df
+    deleted = {change["id"] for change in changes if change.get("deleted")}
+    if deleted:
+        df = df[~df["EntityId"].isin(deleted)]
+    edits = [change for change in changes if "fields" in change]
+    if not edits or df.empty:
+        return df
+    updates = pd.DataFrame([{"EntityId": change["id"], **change["fields"]} for change in edits])
+    df = df.set_index("EntityId")
+    for column in updates.columns.drop("EntityId"):
+        if column not in df.columns:
+            continue
+        latest = updates.dropna(subset=[column]).groupby("EntityId")[column].last()
+        latest = latest[latest.index.isin(df.index)]
+        if latest.empty:
+            continue
+        df[column] = df[column].astype(object)
+        df.loc[latest.index, column] = latest
+    return apply_dtypes(df.reset_index())
+
+
+# === Backends ===
+class CSVBackend:
+    name = "csv"
+    pushdown = False
+
+    def __init__(self, path):
+        self.path = path
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def version(self):
+        return _file_version(self.path)
+
+    def read(self, columns=None, filters=None):
+        if not self.exists():
+            return empty_frame(columns)
+        return apply_dtypes(pd.read_csv(self.path, usecols=columns))
+
+    def iter_chunks(self, chunksize, filters=None, min_confidence=None):
+        # No pushdown for CSV: the store filters each chunk
+        if not self.exists():
+            return
+        for chunk in pd.read_csv(self.path, chunksize=chunksize):
+            yield apply_dtypes(chunk)
+
+    def append(self, df):
+        write_header = not self.exists() or os.path.getsize(self.path) == 0
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        df.to_csv(self.path, mode="a", header=write_header, index=False)
+
+    def replace(self, df):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        df.to_csv(tmp_path, index=False)
+        os.replace(tmp_path, self.path)
+
+
+class ParquetBackend:
+    name = "parquet"
+    pushdown = True
+
+    def __init__(self, path):
+        self.path = path
+
+    def exists(self):
+        return os.path.isdir(self.path) and any(name.endswith(".parquet") for name in os.listdir(self.path))
+
+    def version(self):
+        return _file_version(self.path)
+
+    def read(self, columns=None, filters=None):
+        if not self.exists():
+            return empty_frame(columns)
+        pushed = [
+            (column, "in", list(value) if isinstance(value, (list, tuple, set)) else [value])
+            for column, value in (filters or {}).items()
+        ]
+        return apply_dtypes(pd.read_parquet(self.path, columns=columns, filters=pushed or None))
+
+    def iter_chunks(self, chunksize, filters=None, min_confidence=None):
+        if not self.exists():
+            return
+        import pyarrow.dataset as ds
+
+        expression = None
+        for column, value in (filters or {}).items():
+            values = list(value) if isinstance(value, (list, tuple, set)) else [value]
+            clause = ds.field(column).isin(values)
+            expression = clause if expression is None else expression & clause
+        if min_confidence is not None:
+            clause = ds.field("Confidence") >= min_confidence
+            expression = clause if expression is None else expression & clause
+        dataset = ds.dataset(self.path, format="parquet")
+        for batch in dataset.to_batches(filter=expression, batch_size=chunksize):
+            if batch.num_rows:
+                yield apply_dtypes(batch.to_pandas())
+
+    def _write_part(self, df):
+        os.makedirs(self.path, exist_ok=True)
+        name = f"part-{time.time_ns()}.parquet"
+        tmp_path = os.path.join(self.path, f".{name}.tmp")
+        apply_dtypes(df).to_parquet(tmp_path, index=False)
+        os.replace(tmp_path, os.path.join(self.path, name))
+
+    def append(self, df):
+        self._write_part(df)
+
+    def replace(self, df):
+        old_parts = [name for name in os.listdir(self.path) if name.endswith(".parquet")] if os.path.isdir(self.path) else []
+        self._write_part(df)
+        for name in old_parts:
+            os.remove(os.path.join(self.path, name))
+
+
+class SQLiteBackend:
+    name = "sqlite"
+    pushdown = True
+
+    def __init__(self, path):
+        self.path = path
+
+    def _connect(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        return sqlite3.connect(self.path, timeout=30)
+
+    def exists(self):
+        if not os.path.exists(self.path):
+            return False
+        conn = self._connect()
+        try:
+            return self._has_table(conn)
+        finally:
+            conn.close()
+
+    def version(self):
+        return _file_version(self.path)
+
+    def read(self, columns=None, filters=None):
+        if not self.exists():
+            return empty_frame(columns)
+        selected = ", ".join(f'"{column}"' for column in (columns or COLUMNS))
+        clauses = []
+        params = []
+        for column, value in (filters or {}).items():
+            values = list(value) if isinstance(value, (list, tuple, set)) else [value]
+            clauses.append(f'"{column}" IN ({", ".join("?" for _ in values)})')
+            params.extend(values)
+        where = f" WHERE {' AND '.join(clauses)}" if clauses else ""
+        conn = self._connect()
+        try:
+            return apply_dtypes(pd.read_sql_query(f"SELECT {selected} FROM entities{where}", conn, params=params))
+        finally:
+            conn.close()
+
+    def iter_chunks(self, chunksize, filters=None, min_confidence=None):
+        if not self.exists():
+            return
+        clauses = []
+        params = []
+        for column, value in (filters or {}).items():
+            values = list(value) if isinstance(value, (list, tuple, set)) else [value]
+            clauses.append(f'"{column}" IN ({", ".join("?" for _ in values)})')
+            params.extend(values)
+        if min_confidence is not None:
+            clauses.append('"Confidence" >= ?')
+            params.append(min_confidence)
+        where = f" WHERE {' AND '.join(clauses)}" if clauses else ""
+        conn = self._connect()
+        try:
+            for chunk in pd.read_sql_query(f"SELECT * FROM entities{where}", conn, params=params, chunksize=chunksize):
+                yield apply_dtypes(chunk)
+        finally:
+            conn.close()
+
+    def _has_table(self, conn):
+        return conn.execute("SELECT name FROM sqlite_master WHERE name = 'entities'").fetchone() is not None
+
+    def _write(self, conn, df, if_exists):
+        # Caller holds a transaction on conn. The indexes are created with the table, so
+        # appends to an existing table never touch them.
+        created = if_exists == "replace" or not self._has_table(conn)
+        # sqlite3 cannot bind pandas' nullable scalars, so hand it plain objects and None
+        df.astype(object).where(df.notna(), None).to_sql("entities", conn, if_exists=if_exists, index=False)
+        if created:
+            conn.execute('CREATE UNIQUE INDEX IF NOT EXISTS entities_id ON entities ("EntityId")')
+            conn.execute('CREATE INDEX IF NOT EXISTS entities_document ON entities ("Document")')
+            conn.execute('CREATE INDEX IF NOT EXISTS entities_confidence ON entities ("Confidence")')
+
+    def _transaction(self, write):
+        conn = self._connect()
+        try:
+            with conn:
+                return write(conn)
+        finally:
+            conn.close()
+
+    def append(self, df):
+        self._transaction(lambda conn: self._write(conn, df, "append"))
+
+    def replace(self, df):
+        self._transaction(lambda conn: self._write(conn, df, "replace"))
+
+    def replace_document(self, document, df):
+        # The document's old rows out and its new rows in, in one transaction; returns
+        # whether there were old rows
+        def write(conn):
+            removed = 0
+            if self._has_table(conn):
+                removed = conn.execute('DELETE FROM entities WHERE "Document" = ?', (document,)).rowcount
+            if len(df):
+                self._write(conn, df, "append")
+            return removed > 0
+
+        return self._transaction(write)
+
+    def update(self, changes):
+        # One transaction of row-addressed UPDATEs
+        conn = self._connect()
+        try:
+            with conn:
+                for entity_id, fields in changes.items():
+                    assignments = ", ".join(f'"{column}" = ?' for column in fields)
+                    conn.execute(
+                        f'UPDATE entities SET {assignments} WHERE "EntityId" = ?',
+                        [*fields.values(), entity_id],
+                    )
+        finally:
+            conn.close()
+
+    def low_confidence(self, threshold, offset, limit):
+        conn = self._connect()
+        try:
+            total = conn.execute('SELECT COUNT(*) FROM entities WHERE "Confidence" < ?', (threshold,)).fetchone()[0]
+            page = pd.read_sql_query(
+                'SELECT * FROM entities WHERE "Confidence" < ? ORDER BY rowid LIMIT ? OFFSET ?',
+                conn, params=(threshold, limit, offset),
+            )
+        finally:
+            conn.close()
+        return apply_dtypes(page), total
+
+
+_backends = {backend.name: backend for backend in (CSVBackend, ParquetBackend, SQLiteBackend)}
+
+
+# === Store ===
+class EntityStore:
+    def __init__(self, backend, compact_every=1000):
+        self.backend = backend
+        self.compact_every = compact_every
+        self.lock = threading.Lock()
+        self.file_lock = FileLock(f"{backend.path}.lock")
+        # Backends without row updates (csv, parquet) record edits in a change log
+        self.changes = None if hasattr(backend, "update") else ChangeLog(f"{backend.path}.changes.jsonl")
+        self._cached = None  # (version, full typed DataFrame)
+        # Derived views (e.g. the dashboard cube) notified of appends and other changes
+        self.listeners = []
+
+    def _notify_changed(self):
+        for listener in self.listeners:
+            listener.invalidate()
+
+    def exists(self):
+        return self.backend.exists()
+
+    def version(self):
+        return self.backend.version(), self.changes.version() if self.changes else None
+
+    def _with_changes(self, df):
+        return apply_changes(df, self.changes.read()) if self.changes else df
+
+    def _full(self):
+        version = self.version()
+        with self.lock:
+            if self._cached is None or self._cached[0] != version:
+                self._cached = (version, self._with_changes(self.backend.read()))
+            return self._cached[1]
+
+    def read(self, columns=None, filters=None):
+        # The returned frame is shared by every caller: copy it before modifying it
+        if self.backend.pushdown and (columns or filters):
+            if not self.changes:
+                return self.backend.read(columns=columns, filters=filters)
+            # Pushed-down filters saw the base rows; re-check them after replaying edits
+            needed = None if columns is None else list(dict.fromkeys(["EntityId", *columns, *(filters or {})]))
+            df = _apply_filters(self._with_changes(self.backend.read(columns=needed, filters=filters)), filters)
+            return df[columns] if columns else df
+        df = _apply_filters(self._full(), filters)
+        return df[columns] if columns else df
+
+    def iter_chunks(self, filters=None, min_confidence=None, chunksize=50000):
+        # Streams the table in chunks without building the full frame. Filters are pushed
+        # into the backend unless pending change-log edits could change their outcome.
+        changes = self.changes.read() if self.changes else []
+        pushed = {} if changes else {"filters": filters, "min_confidence": min_confidence}
+        for chunk in self.backend.iter_chunks(chunksize, **pushed):
+            chunk = _apply_filters(apply_changes(chunk, changes), filters)
+            if min_confidence is not None:
+                chunk = chunk[chunk["Confidence"] >= min_confidence]
+            if len(chunk):
+                yield chunk
+
+    def low_confidence(self, threshold=0.90, offset=0, limit=50):
+        # One page of the review queue plus its total size
+        if hasattr(self.backend, "low_confidence"):
+            return self.backend.low_confidence(threshold, offset, limit)
+        df = self._full()
+        queue = df[df["Confidence"] < threshold]
+        return queue.iloc[offset:offset + limit], len(queue)
+
+    def append(self, rows):
+        df = rows if isinstance(rows, pd.DataFrame) else pd.DataFrame(rows)
+        df = apply_dtypes(with_entity_ids(df.reindex(columns=COLUMNS)))
+        with self.file_lock:
+            version_before = self.version()
+            self.backend.append(df)
+            version_after = self.version()
+        for listener in self.listeners:
+            listener.on_append(df, version_before, version_after)
+        return len(df)
+
+    def update(self, changes):
+        # changes maps EntityId -> {column: new value}; only those rows are written
+        if not changes:
+            return
+        with self.file_lock:
+            if not self.changes:
+                self.backend.update(changes)
+            else:
+                self.changes.append(changes)
+                if len(self.changes.read()) >= self.compact_every:
+                    self._compact()
+        self._notify_changed()
+
+    def compact(self):
+        with self.file_lock:
+            self._compact()
+        self._notify_changed()
+
+    def _compact(self):
+        # Folds the change log into the table; caller holds the file lock
+        if not self.changes:
+            return
+        self.backend.replace(self._with_changes(self.backend.read()))
+        self.changes.clear()
+        self._cached = None
+
+    def replace(self, df):
+        with self.file_lock:
+            self.backend.replace(apply_dtypes(with_entity_ids(df.reindex(columns=COLUMNS))))
+            if self.changes:
+                self.changes.clear()
+            self._cached = None
+        self._notify_changed()
+
+    def replace_document(self, document, rows):
+        # Swaps every row of `document` for `rows` under the file lock, so re-processing a
+        # document (or retrying after a write that succeeded) never duplicates its entities.
+        # A new document is a plain append; otherwise only its old rows are removed (a DELETE
+        # for sqlite, delete markers in the change log for csv and parquet).
+        df = rows if isinstance(rows, pd.DataFrame) else pd.DataFrame(rows)
+        df = apply_dtypes(with_entity_ids(df.reindex(columns=COLUMNS)))
+        with self.file_lock:
+            version_before = self.version()
+            if not self.changes:
+                replaced = self.backend.replace_document(document, df)
+            else:
+                old_ids = []
+                if self.exists():
+                    old_ids = self.read(columns=["EntityId"], filters={"Document": document})["EntityId"].tolist()
+                if old_ids:
+                    self.changes.delete(old_ids)
+                if len(df):
+                    self.backend.append(df)
+                replaced = bool(old_ids)
+                if replaced and len(self.changes.read()) >= self.compact_every:
+                    self._compact()
+            version_after = self.version()
+        if replaced:
+            self._notify_changed()
+        else:
+            for listener in self.listeners:
+                listener.on_append(df, version_before, version_after)
+        return len(df)
+
+    def ensure_entity_ids(self):
+        # One-off migration for tables written before EntityId existed
+        if not self.exists():
+            return
+        with self.file_lock:
+            df = self.backend.read()
+            if df.empty or ("EntityId" in df.columns and not df["EntityId"].isna().any()):
+                return
+            self.backend.replace(apply_dtypes(with_entity_ids(df.reindex(columns=COLUMNS))))
+            self._cached = None
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_store(backend=None, path=None):
+    # One store per process and (backend, path); settings come from entity_store_backend
+    # and entity_store_path. A new parquet/sqlite store is seeded from data/entities.csv.
+    backend = backend or os.getenv("entity_store_backend", "csv")
+    path = path or os.getenv("entity_store_path") or DEFAULT_PATHS[backend]
+    with _stores_lock:
+        store = _stores.get((backend, path))
+        if store is None:
+            store = EntityStore(_backends[backend](path))
+            legacy = CSVBackend(DEFAULT_PATHS["csv"])
+            if backend != "csv" and not store.exists() and legacy.exists():
+                store.replace(legacy.read())
+            store.ensure_entity_ids()
+            _stores[(backend, path)] = store
+        return store
@@ -0,0 +1,134 @@
+import os
+import tempfile
+import time
+
+from entity_store import DTYPES
+
+# Streaming entity export.
+#
+# Rows are pulled from the entity store in chunks (with company/year/key/confidence
+# filters pushed down where the backend supports it) and written incrementally to a
+# temporary file, so memory stays flat regardless of table size. Formats: csv, xlsx
+# (openpyxl write-only mode) and parquet (pyarrow ParquetWriter, with the schema taken
+# from the entity store dtypes). Files go to EXPORT_DIR unless a directory is given;
+# `remove_stale_exports` deletes the ones a session left behind.
+
+EXPORT_COLUMNS = ["Document", "Company", "Year", "Key", "Value", "Page", "Confidence"]
+
+FORMATS = {
+    "csv": ("text/csv", ".csv"),
+    "xlsx": ("application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", ".xlsx"),
+    "parquet": ("application/vnd.apache.parquet", ".parquet"),
+}
+
+EXCEL_MAX_ROWS = 1048575  # per sheet, excluding the header
+
+EXPORT_DIR = os.path.join(tempfile.gettempdir(), "entity-exports")
+
+
+def _cell(value):
+    # openpyxl cannot write pandas' NA / NaN markers
+    return None if value is None or value != value or str(value) == "<NA>" else value
+
+
+def write_csv(chunks, path):
+    rows = 0
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        for i, chunk in enumerate(chunks):
+            chunk.to_csv(f, header=i == 0, index=False)
+            rows += len(chunk)
+        if rows == 0:
+            f.write(",".join(EXPORT_COLUMNS) + "\n")
+    return rows
+
+
+def write_xlsx(chunks, path):
+    from openpyxl import Workbook
+
+    workbook = Workbook(write_only=True)
+    sheet = None
+    sheet_rows = 0
+    rows = 0
+    for chunk in chunks:
+        for record in chunk.itertuples(index=False, name=None):
+            if sheet is None or sheet_rows >= EXCEL_MAX_ROWS:
+                sheet = workbook.create_sheet(f"Entities {len(workbook.worksheets) + 1}")
+                sheet.append(EXPORT_COLUMNS)
+                sheet_rows = 0
+            sheet.append([_cell(value) for value in record])
+            sheet_rows += 1
+            rows += 1
+    if sheet is None:
+        workbook.create_sheet("Entities 1").append(EXPORT_COLUMNS)
+    workbook.save(path)
+    return rows
+
+
+def parquet_schema():
+    # From the entity store dtypes, so every chunk (and an empty export) gets the same
+    # types whatever pandas infers for it; categories are written as plain strings
+    import pyarrow as pa
+
+    types = {"string": pa.string(), "category": pa.string(), "Int64": pa.int64(), "float64": pa.float64()}
+    return pa.schema([(column, types[DTYPES[column]]) for column in EXPORT_COLUMNS])
+
+
+def write_parquet(chunks, path):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = parquet_schema()
+    rows = 0
+    with pq.ParquetWriter(path, schema) as writer:
+        for chunk in chunks:
+            chunk = chunk.astype({"Company": "string", "Key": "string"})
+            writer.write_table(pa.Table.from_pandas(chunk, schema=schema, preserve_index=False))
+            rows += len(chunk)
+    return rows
+
+
+_writers = {"csv": write_csv, "xlsx": write_xlsx, "parquet": write_parquet}
+
+
+def export_entities(store, file_format="csv", filters=None, min_confidence=None, chunksize=50000, directory=None):
+    # Returns (path of the written file, number of rows). The caller removes the file.
+    _, suffix = FORMATS[file_format]
+    directory = directory or EXPORT_DIR
+    os.makedirs(directory, exist_ok=True)
+    fd, path = tempfile.mkstemp(prefix="entities-", suffix=suffix, dir=directory)
+    os.close(fd)
+    chunks = (
+        chunk[EXPORT_COLUMNS]
+        for chunk in store.iter_chunks(filters=filters, min_confidence=min_confidence, chunksize=chunksize)
+    )
+    try:
+        rows = _writers[file_format](chunks, path)
+    except Exception:
+        os.remove(path)
+        raise
+    return path, rows
+
+
+def remove_stale_exports(directory=None, max_age=3600):
+    # Exports older than max_age seconds, e.g. from sessions that were closed before
+    # preparing another one. Returns the number of files removed.
+    directory = directory or EXPORT_DIR
+    if not os.path.isdir(directory):
+        return 0
+    cutoff = time.time() - max_age
+    removed = 0
+    for entry in os.scandir(directory):
+        if entry.is_file() and entry.name.startswith("entities-") and entry.stat().st_mtime < cutoff:
+            try:
+                os.remove(entry.path)
+                removed += 1
+            except OSError:
+                pass  # removed by another session
+    return removed
+
+
+def preview(store, filters=None, min_confidence=None, limit=200):
+    # A bounded sample: only the first chunk that has matching rows is read
+    for chunk in store.iter_chunks(filters=filters, min_confidence=min_confidence, chunksize=max(limit, 5000)):
+        return chunk[EXPORT_COLUMNS].head(limit)
+    return None
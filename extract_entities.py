@@ -0,0 +1,96 @@
+import os
+import json
+from azure.storage.blob import BlobServiceClient
+from dotenv import load_dotenv
+from manifest import Manifest, blob_fingerprint
+from entity_store import get_store
+from extraction import ExtractionPool, extract_document, llm_fallback
+from chat_client import make_session, complete_chat
+from metrics import registry, enable_jsonl
+
+# Load environment variables
+load_dotenv()
+
+# === CONFIGURATION ===
+blob_connection_string = os.getenv("blob_connection_string")
+parsed_container_name = os.getenv("parsed_container_name")
+gpt4o_uri = os.getenv("gpt-4o-uri")
+openai_key = os.getenv("openai_key")
+
+# Set full_rebuild=true to ignore the manifest and re-extract every parsed file
+full_rebuild = os.getenv("full_rebuild", "false").lower() == "true"
+
+extraction_workers = int(os.getenv("extraction_workers", "4"))
+extraction_llm_fallback = os.getenv("extraction_llm_fallback", "false").lower() == "true"
+extraction_fallback_threshold = float(os.getenv("extraction_fallback_threshold", "0.8"))
+
+# Timings and counters are appended here for the Metrics page
+enable_jsonl(os.getenv("metrics_path", "data/metrics.jsonl"))
+
+# === INIT CLIENTS ===
+blob_service_client = BlobServiceClient.from_connection_string(blob_connection_string)
+parsed_container_client = blob_service_client.get_container_client(parsed_container_name)
+
+store = get_store()
+manifest = Manifest("extract", full_rebuild=full_rebuild)
+session = make_session()
+fallback = llm_fallback(lambda payload: complete_chat(session, gpt4o_uri, openai_key, payload)) if extraction_llm_fallback else None
+
+# === EXTRACT ONE PARSED FILE (worker thread) ===
+def extract(blob_name, pdf_name):
+    pages = json.loads(parsed_container_client.download_blob(blob_name).readall())
+    with registry.timer("extract.document"):
+        return extract_document(pdf_name, pages, fallback=fallback, fallback_threshold=extraction_fallback_threshold)
+
+# === PROCESS EACH NEW OR CHANGED PARSED FILE ===
+results = {}  # blob name -> (fingerprint, pdf name, rows)
+
+def run(blob_name, fingerprint):
+    pdf_name = blob_name.replace(".json", ".pdf")
+    rows = extract(blob_name, pdf_name)
+    results[blob_name] = (fingerprint, pdf_name, rows)
+    return len(rows)
+
+pool = ExtractionPool(run, extraction_workers)
+job_ids = []
+skipped = 0
+
+for blob in parsed_container_client.list_blobs():
+    if not blob.name.endswith(".json"):
+        continue
+    fingerprint = blob_fingerprint(blob)
+    if manifest.is_current(blob.name, fingerprint):
+        skipped += 1
+        continue
+    job_ids.append(pool.submit(blob.name, fingerprint))
+
+pool.executor.shutdown(wait=True)
+
+# === WRITE ROWS ===
+new_rows = []
+replaced = set()
+extracted = []
+for job in pool.status(job_ids):
+    if job["status"] == "failed":
+        print(f"❌ Failed to extract {job['name']}: {job['error']}")
+        continue
+    fingerprint, pdf_name, rows = results[job["name"]]
+    if job["name"] in manifest.entries:
+        replaced.add(pdf_name)  # changed file: its earlier rows are dropped below
+    new_rows.extend(rows)
+    extracted.append((job["name"], fingerprint, len(rows)))
+    print(f"✅ Extracted {len(rows)} entities from {job['name']}")
+
+if replaced:
+    df = store.read()
+    store.replace(df[~df["Document"].isin(replaced)])
+if new_rows:
+    store.append(new_rows)
+registry.increment("extract.rows", len(new_rows))
+
+# Only recorded once the rows are in the store
+for name, fingerprint, count in extracted:
+    manifest.record(name, fingerprint, rows=count)
+manifest.save()
+print(f"⏭️ Skipped {skipped} unchanged files")
+print(f"🎉 Added {len(new_rows)} entities to the entity store!")
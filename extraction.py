@@ -0,0 +1,319 @@
+import json
+import os
+import re
+import threading
+import time
+import uuid
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from chunking import is_table_line
+
+# Financial entity extraction from parsed pages.
+#
+# Turns the pages main.py writes ({"page", "text", "lines"}) into entity store rows
+# (Document, Company, Year, Key, Value, Page, Confidence):
+#   - table rows ("Revenue  4,034  3,812") are matched against the column headers
+#     ("2023  2022") on the same page, which gives the year of each value;
+#   - otherwise prose ("revenue increased to AED 4.0 billion") is matched with a
+#     lower confidence.
+# The best candidate per key is kept for each document. An optional `fallback(page,
+# keys)` (e.g. `llm_fallback`) is only consulted for pages that mention a key but
+# where the rules found nothing above `fallback_threshold`.
+# Values are in millions: table values as the report states them (reports tabulate in
+# millions), prose amounts scaled by their "billion"/"million"/"thousand" unit. Percentages
+# are never taken as values; a prose amount without a unit has no known scale and is only
+# kept, with UNSCALED_CONFIDENCE, when the page has nothing better.
+
+KEYS = {
+    "Revenue": r"(?:total\s+)?revenues?|turnover|net\s+sales",
+    "Net Profit": r"net\s+(?:profit|income|earnings)|profit\s+for\s+the\s+(?:year|period)",
+    "EBITDA": r"(?:adjusted\s+)?ebitda",
+    "Operating Profit": r"operating\s+(?:profit|income)",
+    "Total Assets": r"total\s+assets",
+    "Total Liabilities": r"total\s+liabilities",
+    "Total Equity": r"total\s+(?:shareholders['’]?\s+)?equity",
+    "Operating Cash Flow": r"(?:net\s+)?cash\s+(?:generated\s+)?from\s+operating\s+activities|operating\s+cash\s+flows?",
+    "Capital Expenditure": r"capital\s+expenditures?|capex",
+}
+
+_labels = {key: re.compile(rf"\b(?:{pattern})\b", re.IGNORECASE) for key, pattern in KEYS.items()}
+_row_label = {key: re.compile(rf"^\s*(?:{pattern})\b", re.IGNORECASE) for key, pattern in KEYS.items()}
+_number = re.compile(r"\(?-?\d{1,3}(?:,\d{3})+(?:\.\d+)?\)?|\(?-?\d+(?:\.\d+)?\)?")
+_inline_value = re.compile(
+    r"(AED|USD|US\$|\$|EUR|€|GBP|£)?\s*(\(?-?\d[\d,]*(?:\.\d+)?\)?)\s*"
+    r"(?:(billion|bn|million|mn|m|thousand)\b|(%|per\s?cent\b|pct\b))?",
+    re.IGNORECASE,
+)
+_percent = re.compile(r"\(?-?\d[\d,]*(?:\.\d+)?\)?\s*(?:%|per\s?cent\b|pct\b)", re.IGNORECASE)
+_unit_word = re.compile(r"\d\s*(?:billion|bn|million|mn|thousand)\b", re.IGNORECASE)
+_year = re.compile(r"\b(19[89]\d|20\d{2})\b")
+# Header words around the year columns: "AED million Notes 2023 2022", "US$'000 2023 2022"
+_header_noise = re.compile(
+    r"(?:aed|usd|us\$|\$|eur|€|gbp|£|dh|\(?restated\)?|notes?|"
+    r"billions?|bn|millions?|mn|m|thousands?|in|[a-z$€£]*['’]000)",
+    re.IGNORECASE,
+)
+# A small bare integer before the values of a row: a note reference ("Revenue 5 4,034 3,812")
+_note_reference = re.compile(r"\d{1,2}")
+_year_ended = re.compile(r"(?:year|period)\s+ended[^.\n]{0,30}?\b(19[89]\d|20\d{2})\b", re.IGNORECASE)
+_scale = {"billion": 1000, "bn": 1000, "million": 1, "mn": 1, "m": 1, "thousand": 0.001}
+_name_noise = {"annual", "report", "financial", "financials", "statements", "fs", "consolidated", "interim", "results"}
+
+TABLE_CONFIDENCE = 0.95  # row label + year-headed column
+ROW_CONFIDENCE = 0.88  # row label, no column headers found
+PROSE_CONFIDENCE = 0.72  # amount with a unit; +0.08 with a currency too
+UNSCALED_CONFIDENCE = 0.5  # bare number, unit unknown: below the review threshold
+FALLBACK_CONFIDENCE = 0.85
+
+
+# === Parsing helpers ===
+def parse_number(token):
+    negative = token.startswith("(") and token.endswith(")")
+    try:
+        value = float(token.strip("()").replace(",", ""))
+    except ValueError:
+        return None
+    return -value if negative else value
+
+
+def parse_value(text):
+    # A value typed on the Review page, in millions like extracted ones: "1,234",
+    # "(12.5)", "4.0bn", "AED 4 billion". None if it isn't a single amount.
+    value_match = _inline_value.fullmatch(text.strip())
+    if value_match is None:
+        return None
+    _, token, unit, percent = value_match.groups()
+    value = parse_number(token)
+    if percent or value is None:
+        return None
+    return round(value * _scale[unit.lower()], 6) if unit else value
+
+
+def _looks_like_year(token):
+    return bool(_year.fullmatch(token.strip("()")))
+
+
+def company_from_name(name):
+    # "ADNOC_2023.pdf" -> "ADNOC", "Mubadala Annual Report 2022.pdf" -> "Mubadala"
+    stem = os.path.splitext(os.path.basename(name))[0]
+    words = []
+    for word in re.split(r"[_\-\s.]+", stem):
+        if not word or _year.fullmatch(word) or word.lower() in _name_noise:
+            break
+        words.append(word)
+    return " ".join(words) or stem
+
+
+def document_year(name, pages):
+    # The file name wins; otherwise the most frequent "year ended ... YYYY", then any year
+    match = _year.search(os.path.basename(name))
+    if match:
+        return int(match.group(1))
+    text = " ".join(page.get("text", "") for page in pages)
+    for pattern in (_year_ended, _year):
+        years = Counter(int(y) for y in pattern.findall(text))
+        if years:
+            return years.most_common(1)[0][0]
+    return None
+
+
+def _header_years(lines):
+    # Column headers: the first line made up mostly of years once currency, unit and
+    # "Notes" words are set aside, e.g. "AED million Notes 2023 2022"
+    for line in lines:
+        tokens = [t for t in line.split() if not _header_noise.fullmatch(t)]
+        years = [int(t) for t in tokens if _year.fullmatch(t)]
+        if len(years) >= 2 and len(years) * 2 >= len(tokens):
+            return years
+    return None
+
+
+# === Rules ===
+def extract_page(page, year=None):
+    # Candidate rows for one page: [{"Key", "Value", "Year", "Page", "Confidence"}]
+    lines = page.get("lines") or page.get("text", "").split("\n")
+    columns = _header_years(lines)
+    candidates = []
+
+    for line in lines:
+        for key, label in _row_label.items():
+            match = label.match(line)
+            if not match:
+                continue
+            rest = line[match.end():]
+            if _unit_word.search(rest):
+                break  # an inline amount ("EBITDA of $2.5bn"), scaled by the prose rules below
+            rest = _percent.sub(" ", rest)  # growth/margin columns are not values
+            if is_table_line(rest) or not re.search(r"[a-z]{3,}", rest, re.IGNORECASE):
+                values = [t for t in _number.findall(rest) if not _looks_like_year(t)]
+                if columns and len(values) > len(columns):
+                    values = values[-len(columns):]  # a leading note reference column
+                elif not columns and len(values) > 1 and _note_reference.fullmatch(values[0]):
+                    values = values[1:]  # no headers: a small leading integer is a note reference
+                if not values:
+                    continue
+                column = 0
+                if columns and year in columns and columns.index(year) < len(values):
+                    column = columns.index(year)
+                value = parse_number(values[column])
+                if value is None:
+                    continue
+                candidates.append({
+                    "Key": key,
+                    "Value": value,
+                    "Year": columns[column] if columns and column < len(columns) else year,
+                    "Page": page["page"],
+                    "Confidence": TABLE_CONFIDENCE if columns else ROW_CONFIDENCE,
+                })
+            break
+
+    if candidates:
+        return candidates
+
+    # Prose: a key label followed closely by an amount
+    text = page.get("text", "")
+    for key, label in _labels.items():
+        for match in label.finditer(text):
+            window = text[match.end():match.end() + 80]
+            amount = _prose_amount(window)
+            if amount is None:
+                continue
+            value, confidence = amount
+            candidates.append({
+                "Key": key,
+                "Value": value,
+                "Year": year,
+                "Page": page["page"],
+                "Confidence": confidence,
+            })
+            break
+    return candidates
+
+
+def _prose_amount(window):
+    # (value in millions, confidence) of the best amount after a key label: the first one
+    # with a unit, else the first bare number. Percentages and years are skipped.
+    bare = None
+    for value_match in _inline_value.finditer(window):
+        currency, token, unit, percent = value_match.groups()
+        if percent or (_looks_like_year(token) and not unit):
+            continue
+        value = parse_number(token)
+        if value is None:
+            continue
+        if unit:
+            confidence = PROSE_CONFIDENCE + (0.08 if currency else 0)
+            return round(value * _scale[unit.lower()], 6), round(confidence, 2)
+        if bare is None:
+            bare = (value, UNSCALED_CONFIDENCE)
+    return bare
+
+
+def mentions_keys(page):
+    text = page.get("text", "")
+    return [key for key, label in _labels.items() if label.search(text)]
+
+
+# === Document ===
+def extract_document(name, pages, company=None, fallback=None, fallback_threshold=0.8, max_fallback_pages=5):
+    # Returns one row per key found in the document: the most confident candidate,
+    # preferring earlier pages on ties (summary tables usually come first)
+    company = company or company_from_name(name)
+    year = document_year(name, pages)
+    best = {}
+    fallback_pages = 0
+
+    for page in pages:
+        candidates = extract_page(page, year)
+        if fallback is not None and fallback_pages < max_fallback_pages:
+            keys = mentions_keys(page)
+            if keys and max((c["Confidence"] for c in candidates), default=0) < fallback_threshold:
+                fallback_pages += 1
+                candidates += [
+                    {**c, "Page": page["page"], "Year": c.get("Year") or year, "Confidence": FALLBACK_CONFIDENCE}
+                    for c in fallback(page, keys)
+                ]
+        for candidate in candidates:
+            current = best.get(candidate["Key"])
+            if current is None or candidate["Confidence"] > current["Confidence"]:
+                best[candidate["Key"]] = candidate
+
+    return [
+        {"Document": name, "Company": company, **candidate}
+        for candidate in sorted(best.values(), key=lambda c: list(KEYS).index(c["Key"]))
+    ]
+
+
+# === LLM fallback ===
+def llm_fallback(complete):
+    # `complete(payload)` returns the assistant message text (e.g. chat_client.complete_chat
+    # with its session/uri/key bound). Returns a fallback for extract_document.
+    def fallback(page, keys):
+        payload = {
+            "messages": [
+                {
+                    "role": "system",
+                    "content": (
+                        "Extract financial figures from the report page. Reply with only a JSON list of "
+                        '{"key": ..., "value": <number as reported>, "year": <fiscal year or null>} objects, '
+                        "using only these keys: " + ", ".join(keys) + ". Omit keys that are not stated on the page."
+                    ),
+                },
+                {"role": "user", "content": page.get("text", "")[:12000]},
+            ],
+            "temperature": 0,
+            "max_tokens": 400,
+        }
+        try:
+            reply = complete(payload)
+            items = json.loads(reply[reply.index("["):reply.rindex("]") + 1])
+        except (RuntimeError, ValueError):
+            return []
+        candidates = []
+        for item in items:
+            value = item.get("value")
+            if item.get("key") not in keys or not isinstance(value, (int, float)):
+                continue
+            year = item.get("year")
+            candidates.append({"Key": item["key"], "Value": float(value), "Year": int(year) if isinstance(year, int) else None})
+        return candidates
+
+    return fallback
+
+
+# === Background workers ===
+class ExtractionPool:
+    # Runs `process(name, data)` (returning the number of rows written) on worker threads
+    # and keeps each job's status, so the Streamlit script thread only submits and polls.
+    def __init__(self, process, workers=4):
+        self.process = process
+        self.executor = ThreadPoolExecutor(max_workers=max(1, int(workers)), thread_name_prefix="extract")
+        self.jobs = {}
+        self.lock = threading.Lock()
+
+    def submit(self, name, data):
+        job_id = uuid.uuid4().hex
+        with self.lock:
+            self.jobs[job_id] = {"id": job_id, "name": name, "status": "queued", "rows": 0, "error": None,
+                                 "submitted": time.time(), "seconds": None}
+        self.executor.submit(self._run, job_id, name, data)
+        return job_id
+
+    def _update(self, job_id, **fields):
+        with self.lock:
+            self.jobs[job_id].update(fields)
+
+    def _run(self, job_id, name, data):
+        started = time.perf_counter()
+        self._update(job_id, status="running")
+        try:
+            rows = self.process(name, data)
+        except Exception as e:
+            self._update(job_id, status="failed", error=str(e), seconds=round(time.perf_counter() - started, 1))
+            return
+        self._update(job_id, status="done", rows=rows, seconds=round(time.perf_counter() - started, 1))
+
+    def status(self, job_ids):
+        with self.lock:
+            return [dict(self.jobs[job_id]) for job_id in job_ids if job_id in self.jobs]
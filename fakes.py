@@ -0,0 +1,356 @@
+import collections
+import hashlib
+import io
+import json
+import math
+import random
+import threading
+import time
+import types
+
+# In-process stand-ins for the Azure services, for dry runs and benchmarks.
+#
+# Each fake mirrors only the subset of the SDK surface this repo calls. `latency` is
+# the simulated service time per call in seconds, and an optional `Throttle` makes
+# calls fail with 429 the way a service over its quota does.
+
+
+class FakeHttpError(Exception):
+    # Shaped like the SDKs' HTTP errors as far as ocr.is_throttled / backoff_delay look
+    def __init__(self, status_code, retry_after=None):
+        super().__init__(f"Fake service returned {status_code}")
+        self.status_code = status_code
+        headers = {} if retry_after is None else {"Retry-After": str(retry_after)}
+        self.response = types.SimpleNamespace(status_code=status_code, headers=headers)
+
+
+class Throttle:
+    # Rejects calls beyond `max_per_second` (sliding one-second window) and a random
+    # `probability` fraction of the rest
+    def __init__(self, max_per_second=0, probability=0.0, retry_after=None, seed=0):
+        self.max_per_second = max_per_second
+        self.probability = probability
+        self.retry_after = retry_after
+        self.rng = random.Random(seed)
+        self.window = collections.deque()
+        self.calls = 0
+        self.throttled = 0
+        self.lock = threading.Lock()
+
+    def check(self):
+        with self.lock:
+            now = time.monotonic()
+            while self.window and now - self.window[0] > 1:
+                self.window.popleft()
+            rejected = (
+                (self.max_per_second and len(self.window) >= self.max_per_second)
+                or (self.probability and self.rng.random() < self.probability)
+            )
+            if rejected:
+                self.throttled += 1
+            else:
+                self.calls += 1
+                self.window.append(now)
+        if rejected:
+            raise FakeHttpError(429, self.retry_after)
+
+
+def _sleep(latency):
+    if latency:
+        time.sleep(latency)
+
+
+def _call(latency, throttle):
+    if throttle is not None:
+        throttle.check()
+    _sleep(latency)
+
+
+# === Blob Storage ===
+class FakeDownload:
+    def __init__(self, data):
+        self.data = data
+
+    def readall(self):
+        return self.data
+
+    def readinto(self, stream):
+        stream.write(self.data)
+        return len(self.data)
+
+
+class FakeContainerClient:
+    def __init__(self, name, latency=0.0, throttle=None):
+        self.name = name
+        self.latency = latency
+        self.throttle = throttle
+        self.blobs = {}  # name -> (bytes, etag)
+        self.lock = threading.Lock()
+
+    def create_container(self):
+        pass
+
+    def list_blobs(self):
+        _call(self.latency, self.throttle)
+        with self.lock:
+            items = sorted(self.blobs.items())
+        return [types.SimpleNamespace(name=name, etag=etag, size=len(data)) for name, (data, etag) in items]
+
+    def download_blob(self, name):
+        _call(self.latency, self.throttle)
+        with self.lock:
+            return FakeDownload(self.blobs[name][0])
+
+    def upload_blob(self, name, data, overwrite=False):
+        _call(self.latency, self.throttle)
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        elif not isinstance(data, bytes):
+            data = data.read()
+        etag = hashlib.md5(data).hexdigest()
+        with self.lock:
+            if name in self.blobs and not overwrite:
+                raise ValueError(f"Blob {name} already exists")
+            self.blobs[name] = (data, etag)
+        return {"etag": etag}
+
+    def delete_blob(self, name):
+        _call(self.latency, self.throttle)
+        with self.lock:
+            self.blobs.pop(name, None)
+
+
+class FakeBlobServiceClient:
+    account_name = "fakeaccount"
+    credential = types.SimpleNamespace(account_key="fake-key")
+
+    def __init__(self, latency=0.0, throttle=None):
+        self.latency = latency
+        self.throttle = throttle
+        self.containers = {}
+
+    def get_container_client(self, name):
+        if name not in self.containers:
+            self.containers[name] = FakeContainerClient(name, self.latency, self.throttle)
+        return self.containers[name]
+
+
+# === Document Intelligence ===
+class FakePoller:
+    def __init__(self, result, latency):
+        self._result = result
+        self.latency = latency
+
+    def result(self):
+        _sleep(self.latency)
+        return self._result
+
+
+class FakeDocumentAnalysisClient:
+    def __init__(self, pages_per_document=5, lines_per_page=30, latency=0.0, throttle=None):
+        self.pages_per_document = pages_per_document
+        self.lines_per_page = lines_per_page
+        self.latency = latency
+        self.throttle = throttle
+
+    def begin_analyze_document_from_url(self, model_id, url):
+        if self.throttle is not None:
+            self.throttle.check()
+        seed = int(hashlib.md5(url.split("?")[0].encode("utf-8")).hexdigest(), 16)
+        pages = [
+            types.SimpleNamespace(
+                page_number=number,
+                lines=[types.SimpleNamespace(content=line) for line in synthetic_page_lines(seed + number, self.lines_per_page)],
+            )
+            for number in range(1, self.pages_per_document + 1)
+        ]
+        return FakePoller(types.SimpleNamespace(pages=pages), self.latency)
+
+
+# === Azure OpenAI embeddings ===
+class FakeEmbeddings:
+    def __init__(self, dimensions, latency, throttle=None):
+        self.dimensions = dimensions
+        self.latency = latency
+        self.throttle = throttle
+
+    def create(self, model, input):
+        _call(self.latency, self.throttle)
+        data = [types.SimpleNamespace(index=i, embedding=fake_embedding(text, self.dimensions)) for i, text in enumerate(input)]
+        return types.SimpleNamespace(data=data)
+
+
+class FakeOpenAI:
+    def __init__(self, dimensions=64, latency=0.0, throttle=None):
+        self.embeddings = FakeEmbeddings(dimensions, latency, throttle)
+
+
+def fake_embedding(text, dimensions=64):
+    # Deterministic bag-of-words hashing so similar texts get similar vectors
+    vector = [0.0] * dimensions
+    for word in text.lower().split():
+        bucket = int(hashlib.md5(word.encode("utf-8")).hexdigest(), 16)
+        vector[bucket % dimensions] += 1.0 if bucket & 1 else -1.0
+    norm = math.sqrt(sum(v * v for v in vector)) or 1.0
+    return [v / norm for v in vector]
+
+
+# === Azure AI Search ===
+class FakeIndexingResult:
+    def __init__(self, key, succeeded=True, status_code=200, error_message=None):
+        self.key = key
+        self.succeeded = succeeded
+        self.status_code = status_code
+        self.error_message = error_message
+
+
+class FakeSearchClient:
+    def __init__(self, latency=0.0, throttle=None):
+        self.latency = latency
+        self.throttle = throttle
+        self.documents = {}
+        self.lock = threading.Lock()
+
+    def upload_documents(self, documents):
+        _call(self.latency, self.throttle)
+        with self.lock:
+            for document in documents:
+                self.documents[document["id"]] = dict(document)
+        return [FakeIndexingResult(document["id"]) for document in documents]
+
+    merge_or_upload_documents = upload_documents
+
+    def delete_documents(self, documents):
+        _call(self.latency, self.throttle)
+        with self.lock:
+            for document in documents:
+                self.documents.pop(document["id"], None)
+        return [FakeIndexingResult(document["id"]) for document in documents]
+
+    def search(self, search_text=None, vector_queries=None, top=None):
+        _call(self.latency, self.throttle)
+        query = vector_queries[0]
+        with self.lock:
+            documents = list(self.documents.values())
+        scored = []
+        for document in documents:
+            score = sum(a * b for a, b in zip(query["vector"], document["embedding"]))
+            scored.append({**document, "@search.score": score})
+        scored.sort(key=lambda d: -d["@search.score"])
+        return scored[:query.get("k", 10)]
+
+
+# === Azure OpenAI chat completions (over HTTP) ===
+class FakeChatResponse:
+    def __init__(self, status_code, answer="", stream=False, token_latency=0.0):
+        self.status_code = status_code
+        self.answer = answer
+        self.stream = stream
+        self.token_latency = token_latency
+        self.text = "" if status_code == 200 else json.dumps({"error": {"code": str(status_code)}})
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def json(self):
+        return {"choices": [{"message": {"role": "assistant", "content": self.answer}}]}
+
+    def iter_lines(self, decode_unicode=False):
+        for word in self.answer.split(" "):
+            _sleep(self.token_latency)
+            yield "data: " + json.dumps({"choices": [{"delta": {"content": word + " "}}]})
+        yield "data: [DONE]"
+
+
+class FakeChatSession:
+    # Stands in for the requests.Session chat_client posts to. `latency` is the time to
+    # the first token, `token_latency` the time per streamed word; throttled calls
+    # return 429 like the real endpoint.
+    def __init__(self, latency=0.0, token_latency=0.0, throttle=None, answer_words=80):
+        self.latency = latency
+        self.token_latency = token_latency
+        self.throttle = throttle
+        self.answer_words = answer_words
+
+    def post(self, uri, headers=None, json=None, timeout=None, stream=False):
+        try:
+            _call(self.latency, self.throttle)
+        except FakeHttpError as e:
+            return FakeChatResponse(e.status_code)
+        # A deterministic "answer" made of words from the prompt
+        words = json["messages"][-1]["content"].split() or ["empty"]
+        answer = " ".join(words[i % len(words)] for i in range(self.answer_words))
+        return FakeChatResponse(200, answer, stream=stream, token_latency=self.token_latency if stream else 0.0)
+
+
+# === Synthetic content ===
+_words = (
+    "revenue profit ebitda growth company group fiscal year million billion assets liabilities "
+    "equity cash operating capital investment dividend share market oil gas energy strategy "
+    "report annual board director risk outlook performance margin segment subsidiary"
+).split()
+
+
+def synthetic_page_lines(seed, lines=30):
+    rng = random.Random(seed)
+    page = []
+    for _ in range(lines):
+        if rng.random() < 0.15:
+            page.append(f"{rng.choice(['Revenue', 'Net Profit', 'EBITDA'])} {rng.randint(100, 9999):,} {rng.randint(100, 9999):,}")
+        else:
+            page.append(" ".join(rng.choice(_words) for _ in range(rng.randint(6, 14))).capitalize() + ".")
+    return page
+
+
+def seed_landing_container(container_client, documents=20, prefix="report"):
+    # Uploads placeholder PDFs; the fake analyzer derives page text from the blob name
+    for i in range(documents):
+        container_client.upload_blob(name=f"{prefix}-{i:05d}.pdf", data=io.BytesIO(b"%PDF-fake"), overwrite=True)
+
+
+def synthetic_chunks(count, seed=0, lines=8):
+    # Retrieval rows shaped like step3.py's chunk metadata
+    return [
+        {
+            "text": " ".join(synthetic_page_lines(seed + i, lines)),
+            "source": f"report-{i // 40:05d}.json",
+            "page": (i // 4) % 10 + 1,
+            "chunk": i % 4,
+        }
+        for i in range(count)
+    ]
+
+
+def synthetic_questions(count, seed=0):
+    rng = random.Random(seed)
+    metrics = ["revenue", "net profit", "EBITDA", "total assets", "dividend", "operating margin"]
+    return [
+        f"What was the {rng.choice(metrics)} of the {rng.choice(_words)} {rng.choice(_words)} in {rng.randint(2015, 2024)}?"
+        for _ in range(count)
+    ]
+
+
+ENTITY_KEYS = ["Revenue", "Net Profit", "EBITDA", "Total Assets", "Total Liabilities", "Operating Cash Flow"]
+
+
+def synthetic_entities(count, companies=50, years=range(2015, 2025), seed=0):
+    # Extracted-entity rows in the entity store's column layout
+    import numpy as np
+    import pandas as pd
+
+    rng = np.random.default_rng(seed)
+    years = list(years)
+    company_names = [f"Company {i:03d}" for i in range(companies)]
+    documents = rng.integers(0, max(1, count // 20), size=count)
+    return pd.DataFrame({
+        "Document": [f"report-{d:05d}.pdf" for d in documents],
+        "Company": [company_names[d % companies] for d in documents],
+        "Year": [years[d % len(years)] for d in documents],
+        "Key": rng.choice(ENTITY_KEYS, size=count),
+        "Value": rng.uniform(1e5, 1e9, size=count).round(2),
+        "Page": rng.integers(1, 60, size=count),
+        "Confidence": rng.uniform(0.6, 1.0, size=count).round(3),
+    })
@@ -0,0 +1,168 @@
+import heapq
+import json
+import math
+import os
+import re
+import time
+from collections import Counter
+
+from metrics import registry
+
+# Hybrid lexical + vector retrieval for the Chat page.
+#
+# A BM25 inverted index over the parsed page text (built by build_lexical_index.py,
+# chunked the same way step3.py chunks pages for embedding) catches exact terms and
+# figures ("EBITDA 2023") that vector search ranks poorly. HybridRetriever runs both
+# searches, merges them with reciprocal-rank fusion and optionally reranks the fused
+# candidates by query-term coverage, so fewer chunks are needed in the prompt.
+# Results have the same shape as retriever.py's: text, source, page, score.
+
+_token = re.compile(r"[a-z]+|\d[\d,]*(?:\.\d+)?")
+_stopwords = frozenset(
+    "a an and are as at be by for from has have in is it its of on or that the this to was were what which who with "
+    "how did does do".split()
+)
+
+
+def tokenize(text):
+    # Lower-cased words and numbers; thousands separators are dropped so "4,034" matches "4034"
+    return [
+        token.replace(",", "") for token in _token.findall(text.lower())
+        if token not in _stopwords
+    ]
+
+
+class BM25Index:
+    kind = "bm25"
+
+    def __init__(self, rows, k1=1.5, b=0.75, version=None):
+        self.rows = rows
+        self.k1 = k1
+        self.b = b
+        self.version = version or str(time.time())
+        self.postings = {}  # term -> [[row, term frequency], ...]
+        self.lengths = []
+        for i, row in enumerate(rows):
+            counts = Counter(tokenize(row["text"]))
+            self.lengths.append(sum(counts.values()))
+            for term, tf in counts.items():
+                self.postings.setdefault(term, []).append([i, tf])
+        self._prepare()
+
+    def _prepare(self):
+        self.average_length = (sum(self.lengths) / len(self.lengths)) if self.lengths else 0.0
+        count = len(self.rows)
+        self.idf = {
+            term: math.log(1 + (count - len(posting) + 0.5) / (len(posting) + 0.5))
+            for term, posting in self.postings.items()
+        }
+
+    def search(self, query, k=10):
+        scores = {}
+        k1, b, average = self.k1, self.b, self.average_length or 1.0
+        for term in set(tokenize(query)):
+            idf = self.idf.get(term)
+            if idf is None:
+                continue
+            for i, tf in self.postings[term]:
+                norm = k1 * (1 - b + b * self.lengths[i] / average)
+                scores[i] = scores.get(i, 0.0) + idf * tf * (k1 + 1) / (tf + norm)
+        return [self._result(i, score) for i, score in heapq.nlargest(k, scores.items(), key=lambda item: item[1])]
+
+    def _result(self, i, score):
+        row = self.rows[i]
+        return {
+            "text": row["text"], "source": row.get("source", ""), "page": row.get("page", 1),
+            "chunk": row.get("chunk"), "score": score,
+        }
+
+    def save(self, path):
+        os.makedirs(path, exist_ok=True)
+        with open(os.path.join(path, "rows.json"), "w", encoding="utf-8") as f:
+            json.dump(self.rows, f, ensure_ascii=False)
+        with open(os.path.join(path, "postings.json"), "w", encoding="utf-8") as f:
+            json.dump({"postings": self.postings, "lengths": self.lengths}, f)
+        with open(os.path.join(path, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump({"kind": self.kind, "version": self.version, "count": len(self.rows), "k1": self.k1, "b": self.b}, f)
+
+
+def load_lexical_index(path):
+    with open(os.path.join(path, "meta.json"), "r", encoding="utf-8") as f:
+        meta = json.load(f)
+    with open(os.path.join(path, "rows.json"), "r", encoding="utf-8") as f:
+        rows = json.load(f)
+    with open(os.path.join(path, "postings.json"), "r", encoding="utf-8") as f:
+        data = json.load(f)
+    index = BM25Index.__new__(BM25Index)
+    index.rows = rows
+    index.k1 = meta["k1"]
+    index.b = meta["b"]
+    index.version = meta["version"]
+    index.postings = data["postings"]
+    index.lengths = data["lengths"]
+    index._prepare()
+    return index
+
+
+# === Fusion and reranking ===
+def _key(result):
+    return result.get("source", ""), result.get("page", 1), result["text"].strip()
+
+
+def reciprocal_rank_fusion(result_lists, rrf_k=60, weights=None):
+    # Each list is best-first; a result's fused score is sum(weight / (rrf_k + rank))
+    weights = weights or [1.0] * len(result_lists)
+    fused = {}
+    for results, weight in zip(result_lists, weights):
+        for rank, result in enumerate(results, start=1):
+            key = _key(result)
+            if key not in fused:
+                fused[key] = {**result, "score": 0.0}
+            fused[key]["score"] += weight / (rrf_k + rank)
+    return sorted(fused.values(), key=lambda r: -r["score"])
+
+
+def rerank(query, results, weight=0.5):
+    # Lightweight reranker: blends the fused rank score with how many of the query's
+    # terms (numbers and years count double) appear in the chunk
+    terms = set(tokenize(query))
+    if not terms or not results:
+        return results
+    importance = {term: 2.0 if term[0].isdigit() else 1.0 for term in terms}
+    total = sum(importance.values())
+    top = results[0]["score"] or 1.0
+    reranked = []
+    for result in results:
+        present = set(tokenize(result["text"]))
+        coverage = sum(w for term, w in importance.items() if term in present) / total
+        reranked.append({**result, "score": (1 - weight) * result["score"] / top + weight * coverage})
+    return sorted(reranked, key=lambda r: -r["score"])
+
+
+class HybridRetriever:
+    kind = "hybrid"
+
+    def __init__(self, vector_retriever, lexical_index, candidates=30, rrf_k=60, use_reranker=True, rerank_weight=0.5):
+        self.vector_retriever = vector_retriever
+        self.lexical_index = lexical_index
+        self.candidates = candidates
+        self.rrf_k = rrf_k
+        self.use_reranker = use_reranker
+        self.rerank_weight = rerank_weight
+
+    @property
+    def version(self):
+        return f"hybrid:{self.vector_retriever.version}:{self.lexical_index.version}:{int(self.use_reranker)}"
+
+    def search(self, vector, k=10, query=None):
+        with registry.timer("retrieval.vector"):
+            vector_results = self.vector_retriever.search(vector, k=self.candidates)
+        if not query:
+            return vector_results[:k]
+        with registry.timer("retrieval.lexical"):
+            lexical_results = self.lexical_index.search(query, k=self.candidates)
+        fused = reciprocal_rank_fusion([vector_results, lexical_results], rrf_k=self.rrf_k)
+        if self.use_reranker:
+            with registry.timer("retrieval.rerank"):
+                fused = rerank(query, fused, self.rerank_weight)
+        return fused[:k]
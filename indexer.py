@@ -0,0 +1,179 @@
+import json
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from metrics import registry
+from ocr import backoff_delay, is_throttled
+
+# Concurrent, size-aware uploads to Azure AI Search.
+#
+# Documents are packed into batches by serialized payload size (the service rejects
+# requests over 16 MB or 1000 documents), several batches are uploaded at once, and
+# only the documents whose IndexingResult failed with a transient status are retried.
+# Documents are added in groups (one group per embedding blob); `on_group_done(owner,
+# failed)` is called from the caller's thread once every document of a group has
+# either been indexed or given up on, so manifests can be updated without locking.
+#
+#   indexer = SearchIndexer(search_client, on_group_done=finish)
+#   indexer.add_group(blob_name, documents)
+#   indexer.close()
+
+MAX_BATCH_DOCUMENTS = 1000
+RETRYABLE_STATUSES = (409, 422, 429, 500, 503)  # per-document statuses worth another attempt
+
+
+def payload_size(document):
+    return len(json.dumps(document, separators=(",", ":")).encode("utf-8"))
+
+
+def prefetch(function, items, concurrency=8):
+    # Yields (item, function(item)) in completion order with at most `concurrency` calls
+    # in flight, consuming `items` lazily. Exceptions are yielded as the result.
+    concurrency = max(1, int(concurrency))
+    items = iter(items)
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        in_flight = {}
+
+        def submit_next():
+            for item in items:
+                in_flight[executor.submit(function, item)] = item
+                return True
+            return False
+
+        while len(in_flight) < concurrency and submit_next():
+            pass
+        while in_flight:
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                item = in_flight.pop(future)
+                error = future.exception()
+                yield item, error if error is not None else future.result()
+                submit_next()
+
+
+class SearchIndexer:
+    def __init__(self, search_client, max_batch_bytes=12000000, max_batch_documents=MAX_BATCH_DOCUMENTS,
+                 concurrency=4, max_retries=5, base_delay=1.0, on_group_done=None):
+        self.search_client = search_client
+        self.max_batch_bytes = max_batch_bytes
+        self.max_batch_documents = min(max_batch_documents, MAX_BATCH_DOCUMENTS)
+        self.concurrency = max(1, int(concurrency))
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.on_group_done = on_group_done
+        self.executor = ThreadPoolExecutor(max_workers=self.concurrency)
+        self.in_flight = set()
+        self.batch = []  # (document, owner)
+        self.batch_bytes = 0
+        self.groups = {}  # owner -> {"remaining", "failed"}
+        self.uploaded = 0
+        self.failed = 0
+        self.requests = 0
+        self.retries = 0
+        self.upload_seconds = 0.0
+        self.lock = threading.Lock()
+
+    # === Adding work ===
+    def add_group(self, owner, documents):
+        documents = list(documents)
+        self.groups[owner] = {"remaining": len(documents), "failed": {}}
+        if not documents:
+            self._group_done(owner)
+        for document in documents:
+            self.add(document, owner)
+
+    def add(self, document, owner):
+        size = payload_size(document)
+        if self.batch and (self.batch_bytes + size > self.max_batch_bytes or len(self.batch) >= self.max_batch_documents):
+            self._submit()
+        self.batch.append((document, owner))
+        self.batch_bytes += size
+
+    def _submit(self):
+        if not self.batch:
+            return
+        # Keep at most `concurrency` requests in flight; handle finished ones meanwhile
+        while len(self.in_flight) >= self.concurrency:
+            self._collect(wait(self.in_flight, return_when=FIRST_COMPLETED).done)
+        self.in_flight.add(self.executor.submit(self._upload, self.batch))
+        self.batch = []
+        self.batch_bytes = 0
+
+    def close(self):
+        self._submit()
+        while self.in_flight:
+            self._collect(wait(self.in_flight, return_when=FIRST_COMPLETED).done)
+        self.executor.shutdown()
+
+    # === Results (caller's thread) ===
+    def _collect(self, futures):
+        for future in futures:
+            self.in_flight.discard(future)
+            for document, owner, error in future.result():
+                group = self.groups[owner]
+                if error is None:
+                    self.uploaded += 1
+                else:
+                    self.failed += 1
+                    group["failed"][document["id"]] = error
+                group["remaining"] -= 1
+                if group["remaining"] == 0:
+                    self._group_done(owner)
+
+    def _group_done(self, owner):
+        group = self.groups.pop(owner)
+        if self.on_group_done is not None:
+            self.on_group_done(owner, group["failed"])
+
+    # === Uploads (worker threads) ===
+    def _upload(self, batch, attempt=0):
+        # Returns [(document, owner, error or None)] for every document of the batch
+        started = time.perf_counter()
+        try:
+            with registry.timer("index.upload"):
+                results = self.search_client.upload_documents(documents=[document for document, _ in batch])
+        except Exception as e:
+            with self.lock:
+                self.upload_seconds += time.perf_counter() - started
+            status = getattr(e, "status_code", None)
+            if status == 413 and len(batch) > 1:
+                # Over the request-size limit despite the estimate: split and upload both halves
+                middle = len(batch) // 2
+                return self._upload(batch[:middle], attempt) + self._upload(batch[middle:], attempt)
+            if is_throttled(e) and attempt < self.max_retries:
+                self._retry(e, attempt)
+                return self._upload(batch, attempt + 1)
+            registry.increment("index.failed", len(batch))
+            return [(document, owner, str(e)) for document, owner in batch]
+
+        with self.lock:
+            self.requests += 1
+            self.upload_seconds += time.perf_counter() - started
+
+        by_key = {result.key: result for result in results}
+        outcomes = []
+        retry = []
+        for document, owner in batch:
+            result = by_key.get(document["id"])
+            if result is None or result.succeeded:
+                outcomes.append((document, owner, None))
+            elif result.status_code in RETRYABLE_STATUSES and attempt < self.max_retries:
+                retry.append((document, owner))
+            else:
+                outcomes.append((document, owner, f"{result.status_code}: {result.error_message}"))
+        failed = sum(1 for *_, error in outcomes if error is not None)
+        registry.increment("index.documents", len(outcomes) - failed)
+        if failed:
+            registry.increment("index.failed", failed)
+        if retry:
+            # Only the documents the service rejected are sent again
+            self._retry(None, attempt)
+            outcomes += self._upload(retry, attempt + 1)
+        return outcomes
+
+    def _retry(self, error, attempt):
+        with self.lock:
+            self.retries += 1
+        registry.increment("index.retries")
+        time.sleep(backoff_delay(error, attempt, base_delay=self.base_delay))
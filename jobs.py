@@ -0,0 +1,459 @@
+import argparse
+import json
+import multiprocessing
+import os
+import signal
+import socket
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from metrics import registry, enable_jsonl
+
+# Background job queue for ingestion started from the UI.
+#
+# The Upload page spools each PDF to disk and enqueues an "ocr" job, then returns. Worker
+# processes (`python jobs.py work --processes 4`) claim jobs from a SQLite table and run
+# the same stages as pipeline.py, one document at a time:
+#
+#   ocr -> extract -> embed -> index
+#
+# A finished job enqueues the next stage of the same upload in the same transaction. A
+# failed job is retried after job_retry_delay * 2^(attempt - 1) seconds; after
+# job_max_attempts it is moved to the dead letters ("dead"), where it stays until it is
+# requeued from the Upload page or with `python jobs.py requeue`. Claimed jobs hold a
+# lease that the worker keeps extending, so jobs of a killed worker are picked up again.
+# Stage outputs are checkpointed in the ocr/embed/index manifests, so step3.py,
+# step4.py and pipeline.py skip documents the workers already processed.
+
+STAGES = ("ocr", "extract", "embed", "index")
+ACTIVE = ("queued", "running")
+
+
+class JobQueue:
+    def __init__(self, path="data/jobs.sqlite", max_attempts=3, retry_delay=30.0, lease_seconds=600.0):
+        self.path = path
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.lease_seconds = lease_seconds
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, upload TEXT, kind TEXT, name TEXT, payload TEXT, "
+                "status TEXT, attempts INTEGER DEFAULT 0, max_attempts INTEGER, available_at REAL, "
+                "lease_until REAL, worker TEXT, error TEXT, result TEXT, "
+                "created_at REAL, started_at REAL, finished_at REAL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_ready ON jobs (status, available_at)")
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_upload ON jobs (upload)")
+            conn.execute("CREATE TABLE IF NOT EXISTS workers (id TEXT PRIMARY KEY, pid INTEGER, host TEXT, seen REAL)")
+
+    @contextmanager
+    def _connect(self):
+        # Autocommit connection; callers open BEGIN IMMEDIATE where a read must not race a write
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    @contextmanager
+    def _transaction(self):
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+
+    @staticmethod
+    def _insert(conn, upload, kind, name, payload, max_attempts, now):
+        return conn.execute(
+            "INSERT INTO jobs (upload, kind, name, payload, status, max_attempts, available_at, created_at) "
+            "VALUES (?, ?, ?, ?, 'queued', ?, ?, ?)",
+            (upload, kind, name, json.dumps(payload), max_attempts, now, now),
+        ).lastrowid
+
+    # === Producer side ===
+    def enqueue(self, kind, name, payload, upload=None):
+        # Returns the upload id that groups this job with the stages it leads to
+        upload = upload or uuid.uuid4().hex
+        with self._transaction() as conn:
+            self._insert(conn, upload, kind, name, payload, self.max_attempts, time.time())
+        registry.increment("jobs.enqueued", stage=kind)
+        return upload
+
+    def requeue(self, job_id=None):
+        # Moves one dead letter (or all of them) back to the queue with fresh attempts
+        query = "UPDATE jobs SET status = 'queued', attempts = 0, available_at = ?, error = NULL WHERE status = 'dead'"
+        params = [time.time()]
+        if job_id is not None:
+            query += " AND id = ?"
+            params.append(job_id)
+        with self._transaction() as conn:
+            return conn.execute(query, params).rowcount
+
+    # === Worker side ===
+    def claim(self, worker):
+        # The oldest ready job, or one whose worker stopped renewing its lease
+        now = time.time()
+        with self._transaction() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = 'dead', error = 'worker stopped while running it', finished_at = ? "
+                "WHERE status = 'running' AND lease_until < ? AND attempts >= max_attempts",
+                (now, now),
+            )
+            row = conn.execute(
+                "SELECT * FROM jobs WHERE (status = 'queued' AND available_at <= ?) "
+                "OR (status = 'running' AND lease_until < ?) ORDER BY id LIMIT 1",
+                (now, now),
+            ).fetchone()
+            if row is None:
+                return None
+            conn.execute(
+                "UPDATE jobs SET status = 'running', attempts = attempts + 1, worker = ?, started_at = ?, "
+                "lease_until = ? WHERE id = ?",
+                (worker, now, now + self.lease_seconds, row["id"]),
+            )
+        job = dict(row)
+        job["attempts"] += 1
+        job["payload"] = json.loads(job["payload"])
+        return job
+
+    def renew(self, job_id, worker):
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET lease_until = ? WHERE id = ? AND worker = ? AND status = 'running'",
+                (time.time() + self.lease_seconds, job_id, worker),
+            )
+
+    def complete(self, job, result, next_kind=None):
+        now = time.time()
+        with self._transaction() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = 'done', result = ?, finished_at = ?, error = NULL WHERE id = ?",
+                (json.dumps(result), now, job["id"]),
+            )
+            if next_kind is not None:
+                self._insert(conn, job["upload"], next_kind, job["name"], result, job["max_attempts"], now)
+
+    def fail(self, job, error):
+        # Schedules a retry with exponential backoff, or dead-letters the job; returns the new status
+        now = time.time()
+        if job["attempts"] >= job["max_attempts"]:
+            status, available_at = "dead", None
+        else:
+            status, available_at = "queued", now + self.retry_delay * 2 ** (job["attempts"] - 1)
+        with self._transaction() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = ?, error = ?, available_at = ?, finished_at = ? WHERE id = ?",
+                (status, error, available_at, now, job["id"]),
+            )
+        registry.increment("jobs.dead" if status == "dead" else "jobs.retries", stage=job["kind"])
+        return status
+
+    def heartbeat(self, worker):
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO workers (id, pid, host, seen) VALUES (?, ?, ?, ?)",
+                (worker, os.getpid(), socket.gethostname(), time.time()),
+            )
+
+    # === Progress ===
+    def uploads(self, upload_ids):
+        # Latest job of each upload: which stage it reached and how that stage is doing
+        if not upload_ids:
+            return []
+        marks = ", ".join("?" for _ in upload_ids)
+        with self._connect() as conn:
+            rows = conn.execute(
+                f"SELECT * FROM jobs WHERE id IN (SELECT MAX(id) FROM jobs WHERE upload IN ({marks}) GROUP BY upload)",
+                list(upload_ids),
+            ).fetchall()
+        latest = {row["upload"]: dict(row) for row in rows}
+        return [latest[upload] for upload in upload_ids if upload in latest]
+
+    def dead_letters(self, limit=100):
+        with self._connect() as conn:
+            rows = conn.execute("SELECT * FROM jobs WHERE status = 'dead' ORDER BY id DESC LIMIT ?", (limit,)).fetchall()
+        return [dict(row) for row in rows]
+
+    def counts(self):
+        # {(kind, status): jobs}
+        with self._connect() as conn:
+            rows = conn.execute("SELECT kind, status, COUNT(*) AS jobs FROM jobs GROUP BY kind, status").fetchall()
+        return {(row["kind"], row["status"]): row["jobs"] for row in rows}
+
+    def live_workers(self, within=30.0):
+        with self._connect() as conn:
+            return conn.execute("SELECT COUNT(*) FROM workers WHERE seen >= ?", (time.time() - within,)).fetchone()[0]
+
+
+def progress(job):
+    # Fraction of the stages an upload has completed
+    done = STAGES.index(job["kind"]) + (1 if job["status"] == "done" else 0)
+    return done / len(STAGES)
+
+
+def queue_from_env():
+    return JobQueue(
+        os.getenv("job_queue_path", "data/jobs.sqlite"),
+        max_attempts=int(os.getenv("job_max_attempts", "3")),
+        retry_delay=float(os.getenv("job_retry_delay", "30")),
+        lease_seconds=float(os.getenv("job_lease_seconds", "600")),
+    )
+
+
+# === Stage handlers ===
+class Ingestion:
+    # Runs one stage for one document with the pipeline.py stage code; each returns the
+    # payload of the next stage. Manifest entries are committed per document, since
+    # several worker processes share the manifest files.
+    def __init__(self, blob_service_client, document_client, openai_client, search_client, settings, entity_store, fallback=None):
+        self.services = (blob_service_client, document_client, openai_client, search_client)
+        self.settings = settings
+        self.entity_store = entity_store
+        self.fallback = fallback
+
+    def pipeline(self):
+        # Built per job so the manifests are read fresh from disk. Autosave is off: a full
+        # save would write this process's snapshot over entries other workers committed,
+        # so each stage commit()s only the entries it recorded. The near-duplicate state
+        # (dedupe.json, _duplicates.json) is updated under a lock file by the embed stage.
+        from pipeline import Pipeline
+
+        pipeline = Pipeline(*self.services, self.settings, shared_state=True)
+        for manifest in (pipeline.ocr_manifest, pipeline.embed_manifest, pipeline.index_manifest):
+            manifest.autosave_every = 0
+        return pipeline
+
+    def ocr(self, payload):
+        pipeline = self.pipeline()
+        name = payload["name"]
+        with open(payload["path"], "rb") as f:
+            data = f.read()
+        with registry.timer("blob.upload", stage="upload"):
+            uploaded = pipeline.landing.upload_blob(name=name, data=data, overwrite=True)
+        fingerprint = uploaded["etag"].strip('"')
+
+        emitted = []
+        pipeline.analyze((name, fingerprint, pipeline.blob_url(name)), emitted.append)
+        pipeline.ocr_manifest.commit(name)
+        parsed_name, parsed_etag, pages = emitted[0]
+        # The spool file is removed by the extract stage, which only exists once this job
+        # is recorded as done, so retries and requeued dead letters can still read it
+        return {"name": name, "path": payload["path"], "parsed_name": parsed_name, "parsed_etag": parsed_etag,
+                "pages": len(pages)}
+
+    def extract(self, payload):
+        from extraction import extract_document
+
+        payload = dict(payload)
+        spool_path = payload.pop("path", None)
+        if spool_path and os.path.exists(spool_path):
+            os.remove(spool_path)
+
+        pipeline = self.pipeline()
+        pages = json.loads(pipeline.parsed.download_blob(payload["parsed_name"]).readall())
+        with registry.timer("extract.document"):
+            rows = extract_document(
+                payload["name"], pages, fallback=self.fallback,
+                fallback_threshold=self.settings["extraction_fallback_threshold"],
+            )
+        registry.increment("extract.rows", len(rows))
+        # Replaces the rows of an earlier upload of the same document
+        self.entity_store.replace_document(payload["name"], rows)
+        return {**payload, "rows": len(rows)}
+
+    def embed(self, payload):
+        pipeline = self.pipeline()
+        parsed_name = payload["parsed_name"]
+        pages = json.loads(pipeline.parsed.download_blob(parsed_name).readall())
+        emitted = []
+        previous = set(pipeline.embed_manifest.outputs(parsed_name))
+        pipeline.embed((parsed_name, payload["parsed_etag"], pages), emitted.append)
+        pipeline.embed_manifest.commit(parsed_name)
+        # Embedding blobs the changed file no longer has were dropped from the index too
+        removed = previous - set(pipeline.embed_manifest.outputs(parsed_name))
+        if removed:
+            pipeline.index_manifest.commit(*removed)
+        return {**payload, "embeddings": [[name, fingerprint] for name, fingerprint, _ in emitted]}
+
+    def index(self, payload):
+        from pipeline import DONE
+
+        pipeline = self.pipeline()
+        for name, fingerprint in payload["embeddings"]:
+            pipeline.index_queue.put((name, fingerprint, list(pipeline.documents_from_blob(name))))
+        pipeline.index_queue.put(DONE)
+        pipeline.index()
+        if pipeline.stats["index"].failed:
+            raise RuntimeError(f"{pipeline.stats['index'].failed} embedding blobs of {payload['parsed_name']} were not indexed")
+        pipeline.index_manifest.commit(*[name for name, _ in payload["embeddings"]])
+        return {**payload, "indexed": len(payload["embeddings"])}
+
+
+def ingestion_from_env():
+    import services
+    from chat_client import complete_chat
+    from entity_store import get_store
+    from extraction import llm_fallback
+    from pipeline import settings_from_env
+
+    # One document at a time per worker process; parallelism comes from the process count
+    args = argparse.Namespace(
+        dry_run=False, ocr_workers=1, embed_workers=1, queue_size=0,
+        index_batch_size=int(os.getenv("index_batch_size", "1000")),
+        index_concurrency=int(os.getenv("index_concurrency", "4")),
+    )
+    settings = settings_from_env(args)
+    settings["extraction_fallback_threshold"] = float(os.getenv("extraction_fallback_threshold", "0.8"))
+    fallback = None
+    if os.getenv("extraction_llm_fallback", "false").lower() == "true":
+        session = services.http_session()
+        fallback = llm_fallback(lambda payload: complete_chat(session, os.getenv("gpt-4o-uri"), os.getenv("openai_key"), payload))
+    return Ingestion(
+        services.blob_service(), services.document_client(), services.openai_client(), services.search_client(),
+        settings, get_store(), fallback,
+    )
+
+
+# === Workers ===
+class _Lease(threading.Thread):
+    # Renews the lease of the running job and the worker heartbeat until stopped
+    def __init__(self, job_queue, worker, interval):
+        super().__init__(name="lease", daemon=True)
+        self.job_queue = job_queue
+        self.worker = worker
+        self.interval = interval
+        self.job_id = None
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.job_queue.heartbeat(self.worker)
+            if self.job_id is not None:
+                self.job_queue.renew(self.job_id, self.worker)
+
+
+def work(job_queue, handlers, worker=None, poll_seconds=1.0, stop=None, max_jobs=None):
+    # Claims and runs jobs until `stop` is set (or `max_jobs` have run)
+    worker = worker or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+    stop = stop or threading.Event()
+    lease = _Lease(job_queue, worker, min(10.0, job_queue.lease_seconds / 3))
+    lease.start()
+    job_queue.heartbeat(worker)
+    processed = 0
+    try:
+        while not stop.is_set() and (max_jobs is None or processed < max_jobs):
+            job = job_queue.claim(worker)
+            if job is None:
+                stop.wait(poll_seconds)
+                continue
+            lease.job_id = job["id"]
+            try:
+                with registry.timer("jobs.run", stage=job["kind"]):
+                    result = handlers[job["kind"]](job["payload"])
+            except Exception as e:
+                status = job_queue.fail(job, f"{type(e).__name__}: {e}")
+                print(f"❌ [{job['kind']}] {job['name']} (attempt {job['attempts']}/{job['max_attempts']}, now {status}): {e}")
+            else:
+                stage = STAGES.index(job["kind"])
+                next_kind = STAGES[stage + 1] if stage + 1 < len(STAGES) else None
+                job_queue.complete(job, result, next_kind)
+                print(f"✅ [{job['kind']}] {job['name']}")
+            finally:
+                lease.job_id = None
+                processed += 1
+                registry.flush()
+    finally:
+        lease.stopped.set()
+    return processed
+
+
+def _worker_process(poll_seconds):
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    enable_jsonl(os.getenv("metrics_path", "data/metrics.jsonl"))
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    ingestion = ingestion_from_env()
+    handlers = {stage: getattr(ingestion, stage) for stage in STAGES}
+    work(queue_from_env(), handlers, poll_seconds=poll_seconds, stop=stop)
+
+
+def run_workers(processes, poll_seconds=1.0):
+    children = [
+        multiprocessing.Process(target=_worker_process, args=(poll_seconds,), name=f"job-worker-{i}")
+        for i in range(processes)
+    ]
+    for child in children:
+        child.start()
+
+    def terminate(*_):
+        for child in children:
+            child.terminate()
+
+    signal.signal(signal.SIGTERM, terminate)
+    try:
+        for child in children:
+            child.join()
+    except KeyboardInterrupt:
+        terminate()
+
+
+_launched = None
+_launch_lock = threading.Lock()
+
+
+def ensure_workers(job_queue, processes):
+    # Starts `python jobs.py work` in the background unless workers are already heartbeating
+    global _launched
+    with _launch_lock:
+        if _launched is not None and _launched.poll() is None:
+            return False
+        if job_queue.live_workers():
+            return False
+        _launched = subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), "work", "--processes", str(processes)],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            start_new_session=True,
+        )
+        return True
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+
+    parser = argparse.ArgumentParser(description="Ingestion job queue")
+    commands = parser.add_subparsers(dest="command", required=True)
+    work_parser = commands.add_parser("work", help="run worker processes")
+    work_parser.add_argument("--processes", type=int, default=None, help="defaults to job_workers")
+    work_parser.add_argument("--poll-seconds", type=float, default=1.0)
+    commands.add_parser("status", help="job counts per stage and status")
+    requeue_parser = commands.add_parser("requeue", help="move dead letters back to the queue")
+    requeue_parser.add_argument("--id", type=int, default=None, help="one job instead of every dead letter")
+    args = parser.parse_args()
+
+    load_dotenv()
+    job_queue = queue_from_env()
+    if args.command == "work":
+        run_workers(args.processes or int(os.getenv("job_workers", "2")), args.poll_seconds)
+    elif args.command == "status":
+        for (kind, status), count in sorted(job_queue.counts().items(), key=lambda item: (STAGES.index(item[0][0]), item[0][1])):
+            print(f"{kind:<8}{status:<8}{count:>6}")
+        print(f"{job_queue.live_workers()} live workers")
+    else:
+        print(f"♻️ Requeued {job_queue.requeue(args.id)} dead jobs")
@@ -5,6 +5,9 @@ import datetime
 import os
 import json
 from dotenv import load_dotenv
+from ocr import analyze_documents, ThroughputStats
+from manifest import Manifest, blob_fingerprint
+from metrics import registry, enable_jsonl
 
 # Load environment variables
 load_dotenv()
@@ -17,6 +20,18 @@ output_container_name = os.getenv("parsed_container_name")  # name of output con
 endpoint = os.getenv("endpoint")
 key = os.getenv("key")
 
+# Number of analyses kept in flight, optional request rate cap (per second, 0 = none)
+# and how many times a throttled (429) request is retried with backoff
+analyze_concurrency = int(os.getenv("analyze_concurrency", "8"))
+analyze_rate_limit = float(os.getenv("analyze_rate_limit", "0"))
+analyze_max_retries = int(os.getenv("analyze_max_retries", "5"))
+
+# Set full_rebuild=true to ignore the manifest and reprocess every blob
+full_rebuild = os.getenv("full_rebuild", "false").lower() == "true"
+
+# Timings and counters are appended here for the Metrics page
+enable_jsonl(os.getenv("metrics_path", "data/metrics.jsonl"))
+
 # === INIT CLIENTS ===
 blob_service_client = BlobServiceClient.from_connection_string(blob_connection_string)
 input_container_client = blob_service_client.get_container_client(input_container_name)
@@ -30,38 +45,94 @@ except Exception as e:
 
 document_client = DocumentAnalysisClient(endpoint, AzureKeyCredential(key))
 
-# === LIST BLOBS + GENERATE SAS + PROCESS ===
-for blob in input_container_client.list_blobs():
-    # Generate SAS URL for each blob
-    sas_token = generate_blob_sas(
-        account_name=blob_service_client.account_name,
-        container_name=input_container_name,
-        blob_name=blob.name,
-        account_key=blob_service_client.credential.account_key,
-        permission=BlobSasPermissions(read=True),
-        expiry=datetime.datetime.utcnow() + datetime.timedelta(hours=1)
-    )
+# === Manifest of already analyzed PDFs ===
+manifest = Manifest("ocr", full_rebuild=full_rebuild)
+fingerprints = {}
+seen_blobs = set()
+skipped = 0
+
+# === LIST BLOBS + GENERATE SAS ===
+def sas_jobs():
+    global skipped
+    for blob in input_container_client.list_blobs():
+        seen_blobs.add(blob.name)
+        fingerprint = blob_fingerprint(blob)
+        if manifest.is_current(blob.name, fingerprint):
+            skipped += 1
+            continue
+        fingerprints[blob.name] = fingerprint
+
+        # Generate SAS URL for each blob
+        sas_token = generate_blob_sas(
+            account_name=blob_service_client.account_name,
+            container_name=input_container_name,
+            blob_name=blob.name,
+            account_key=blob_service_client.credential.account_key,
+            permission=BlobSasPermissions(read=True),
+            expiry=datetime.datetime.utcnow() + datetime.timedelta(hours=1)
+        )
 
-    blob_url = f"https://{blob_service_client.account_name}.blob.core.windows.net/{input_container_name}/{blob.name}?{sas_token}"
+        blob_url = f"https://{blob_service_client.account_name}.blob.core.windows.net/{input_container_name}/{blob.name}?{sas_token}"
 
-    print(f"Processing {blob.name}...")
+        print(f"Processing {blob.name}...")
+        yield blob.name, blob_url
 
-    poller = document_client.begin_analyze_document_from_url("prebuilt-read", blob_url)
-    result = poller.result()
+
+# === PROCESS (N analyses in flight) ===
+stats = ThroughputStats()
+
+for outcome in analyze_documents(
+    document_client,
+    sas_jobs(),
+    concurrency=analyze_concurrency,
+    rate_limit=analyze_rate_limit,
+    max_retries=analyze_max_retries,
+):
+    if outcome["error"] is not None:
+        stats.record(outcome)
+        print(f"❌ Failed {outcome['name']} after {outcome['retries']} retries: {outcome['error']}")
+        continue
+
+    result = outcome["result"]
 
     # Extract text
     output_json = []
     for page in result.pages:
-        text = " ".join([line.content for line in page.lines])
-        output_json.append({"page": page.page_number, "text": text})
+        lines = [line.content for line in page.lines]
+        output_json.append({"page": page.page_number, "text": " ".join(lines), "lines": lines})
 
     # Serialize JSON to string
     json_str = json.dumps(output_json, ensure_ascii=False, indent=2)
 
     # Upload JSON string as blob
-    json_blob_name = blob.name.replace(".pdf", ".json")
-    output_container_client.upload_blob(name=json_blob_name, data=json_str, overwrite=True)
+    json_blob_name = outcome["name"].replace(".pdf", ".json")
+    with registry.timer("blob.upload", stage="ocr"):
+        uploaded = output_container_client.upload_blob(name=json_blob_name, data=json_str, overwrite=True)
+
+    manifest.record(
+        outcome["name"],
+        fingerprints.pop(outcome["name"]),
+        outputs=[json_blob_name],
+        pages=len(output_json),
+        parsed_etag=uploaded["etag"].strip('"'),  # lets pipeline.py resume at the embed stage
+    )
+    stats.record(outcome, pages=len(output_json))
+    registry.increment("ocr.documents")
+    registry.increment("ocr.pages", len(output_json))
+    print(f"✅ Saved parsed {json_blob_name} to container '{output_container_name}' "
+          f"({len(output_json)} pages, {outcome['seconds']:.1f}s, {outcome['retries']} retries)")
+
+# === Remove parsed output of PDFs that were deleted ===
+for name in manifest.stale(seen_blobs):
+    for old_blob_name in manifest.outputs(name):
+        output_container_client.delete_blob(old_blob_name)
+        print(f"🗑️ Removed stale parsed file {old_blob_name}")
+    manifest.forget(name)
 
-    print(f"✅ Saved parsed {json_blob_name} to container '{output_container_name}'")
+manifest.save()
 
+summary = stats.summary()
+print(f"📊 {summary['documents']} documents ({summary['failed']} failed), {summary['pages']} pages in "
+      f"{summary['elapsed_seconds']}s — {summary['documents_per_minute']} docs/min, "
+      f"{summary['pages_per_second']} pages/s, {summary['retries']} retries, {skipped} unchanged skipped")
 print("🎉 All files processed and saved to Azure Blob Storage!")
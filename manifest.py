@@ -0,0 +1,111 @@
+import hashlib
+import json
+import os
+import threading
+from datetime import datetime, timezone
+
+# Persisted record of what each pipeline stage has already processed.
+#
+# Entries are keyed by input blob name and store a fingerprint (ETag, falling back
+# to the content MD5 or a hash of the bytes) so re-runs only touch new or changed
+# inputs. Each entry also remembers the outputs it produced so stale ones can be
+# cleaned up when an input changes or disappears.
+
+
+def blob_fingerprint(blob):
+    etag = getattr(blob, "etag", None)
+    if etag:
+        return etag.strip('"')
+    settings = getattr(blob, "content_settings", None)
+    content_md5 = getattr(settings, "content_md5", None)
+    if content_md5:
+        return bytes(content_md5).hex()
+    return f"{getattr(blob, 'size', '')}:{getattr(blob, 'last_modified', '')}"
+
+
+def content_hash(data):
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    return hashlib.sha256(data).hexdigest()
+
+
+def document_id(source, page, chunk=None):
+    # Deterministic search-index key (letters, digits, '-', '_' and '=' only), so re-runs are upserts
+    key = f"{source}|{page}" if chunk is None else f"{source}|{page}|{chunk}"
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+
+class Manifest:
+    def __init__(self, stage, directory=None, full_rebuild=False, autosave_every=25):
+        # autosave_every=0 leaves saving to save()/commit(), e.g. when processes share the file
+        self.stage = stage
+        self.autosave_every = autosave_every
+        directory = directory or os.getenv("manifest_dir", "data/manifests")
+        self.path = os.path.join(directory, f"{stage}.json")
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.dirty = 0
+        if not full_rebuild and os.path.exists(self.path):
+            with open(self.path, "r", encoding="utf-8") as f:
+                self.entries = json.load(f)
+
+    def is_current(self, name, fingerprint):
+        entry = self.entries.get(name)
+        return entry is not None and entry.get("fingerprint") == fingerprint
+
+    def outputs(self, name):
+        entry = self.entries.get(name) or {}
+        return list(entry.get("outputs", []))
+
+    def record(self, name, fingerprint, outputs=None, autosave_every=None, **info):
+        with self.lock:
+            self.entries[name] = {
+                "fingerprint": fingerprint,
+                "outputs": list(outputs or []),
+                "updated": datetime.now(timezone.utc).isoformat(),
+                **info,
+            }
+            self.dirty += 1
+            if autosave_every is None:
+                autosave_every = self.autosave_every
+            if autosave_every and self.dirty >= autosave_every:
+                self._save()
+
+    def forget(self, name):
+        with self.lock:
+            if self.entries.pop(name, None) is not None:
+                self.dirty += 1
+
+    def stale(self, seen_names):
+        # Inputs recorded by a previous run that no longer exist
+        return [name for name in self.entries if name not in seen_names]
+
+    def save(self):
+        with self.lock:
+            self._save()
+
+    def commit(self, *names):
+        # Saves just these entries, merged into the file under a lock file, for processes that
+        # share a manifest (the job queue workers); other entries are re-read from disk
+        from entity_store import FileLock
+
+        with self.lock, FileLock(f"{self.path}.lock"):
+            entries = {}
+            if os.path.exists(self.path):
+                with open(self.path, "r", encoding="utf-8") as f:
+                    entries = json.load(f)
+            for name in names:
+                if name in self.entries:
+                    entries[name] = self.entries[name]
+                else:
+                    entries.pop(name, None)
+            self.entries = entries
+            self._save()
+
+    def _save(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.entries, f, ensure_ascii=False, indent=1, sort_keys=True)
+        os.replace(tmp_path, self.path)
+        self.dirty = 0
@@ -0,0 +1,197 @@
+import atexit
+import json
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# Lightweight instrumentation for the ingestion scripts and the Chat page.
+#
+#   from metrics import registry
+#   with registry.timer("embed.request", stage="embed"):
+#       ...
+#   registry.increment("embed.tokens", 1234)
+#
+# Counters and histograms live in memory and can be rendered as Prometheus text.
+# With `enable_jsonl(path)` every observation is also buffered and appended to a JSON
+# lines file, which the Metrics page reads to show throughput and latency percentiles
+# across processes.
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _prometheus_name(name):
+    return name.replace(".", "_").replace("-", "_")
+
+
+def _prometheus_labels(labels, extra=None):
+    items = list(labels) + list((extra or {}).items())
+    if not items:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in items) + "}"
+
+
+def percentile(values, q):
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    position = (len(ordered) - 1) * q / 100
+    lower = math.floor(position)
+    upper = math.ceil(position)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+class Histogram:
+    def __init__(self, buckets=DEFAULT_BUCKETS, reservoir=2048):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.recent = []  # last `reservoir` observations, for percentiles
+        self.reservoir = reservoir
+
+    def observe(self, value):
+        self.sum += value
+        self.count += 1
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        else:
+            self.counts[-1] += 1
+        self.recent.append(value)
+        if len(self.recent) > self.reservoir:
+            del self.recent[:len(self.recent) - self.reservoir]
+
+
+class Registry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}  # (name, labels) -> value
+        self.histograms = {}  # (name, labels) -> Histogram
+        self.sink_path = None
+        self.buffer = []
+        self.flush_every = 200
+
+    # === Recording ===
+    def increment(self, name, value=1, **labels):
+        with self.lock:
+            key = (name, _label_key(labels))
+            self.counters[key] = self.counters.get(key, 0) + value
+            self._emit("counter", name, value, labels)
+
+    def observe(self, name, value, **labels):
+        with self.lock:
+            key = (name, _label_key(labels))
+            if key not in self.histograms:
+                self.histograms[key] = Histogram()
+            self.histograms[key].observe(value)
+            self._emit("histogram", name, value, labels)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        # Records the duration in seconds, and an `<name>.errors` count if the block raises
+        started = time.perf_counter()
+        try:
+            yield
+        except BaseException:
+            self.increment(f"{name}.errors", **labels)
+            raise
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    # === JSON lines sink ===
+    def _emit(self, kind, name, value, labels):
+        if self.sink_path is None:
+            return
+        self.buffer.append({"ts": time.time(), "pid": os.getpid(), "kind": kind, "name": name, "value": value, "labels": labels})
+        if len(self.buffer) >= self.flush_every:
+            self._flush()
+
+    def _flush(self):
+        if not self.buffer or self.sink_path is None:
+            return
+        os.makedirs(os.path.dirname(self.sink_path) or ".", exist_ok=True)
+        with open(self.sink_path, "a", encoding="utf-8") as f:
+            f.write("".join(json.dumps(event) + "\n" for event in self.buffer))
+        self.buffer = []
+
+    def flush(self):
+        with self.lock:
+            self._flush()
+
+    # === Export ===
+    def snapshot(self):
+        with self.lock:
+            return {
+                "counters": [
+                    {"name": name, "labels": dict(labels), "value": value}
+                    for (name, labels), value in sorted(self.counters.items())
+                ],
+                "histograms": [
+                    {
+                        "name": name,
+                        "labels": dict(labels),
+                        "count": h.count,
+                        "sum": round(h.sum, 6),
+                        "p50": percentile(h.recent, 50),
+                        "p95": percentile(h.recent, 95),
+                    }
+                    for (name, labels), h in sorted(self.histograms.items())
+                ],
+            }
+
+    def prometheus(self):
+        lines = []
+        with self.lock:
+            typed = set()
+            for (name, labels), value in sorted(self.counters.items()):
+                metric = _prometheus_name(name) + "_total"
+                if metric not in typed:
+                    lines.append(f"# TYPE {metric} counter")
+                    typed.add(metric)
+                lines.append(f"{metric}{_prometheus_labels(labels)} {value}")
+            for (name, labels), h in sorted(self.histograms.items()):
+                metric = _prometheus_name(name) + "_seconds"
+                if metric not in typed:
+                    lines.append(f"# TYPE {metric} histogram")
+                    typed.add(metric)
+                cumulative = 0
+                for bound, count in zip(list(h.buckets) + ["+Inf"], h.counts):
+                    cumulative += count
+                    lines.append(f"{metric}_bucket{_prometheus_labels(labels, {'le': bound})} {cumulative}")
+                lines.append(f"{metric}_sum{_prometheus_labels(labels)} {h.sum}")
+                lines.append(f"{metric}_count{_prometheus_labels(labels)} {h.count}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+
+def enable_jsonl(path):
+    # Also append every observation to `path`; buffered, and flushed at exit
+    if registry.sink_path is None:
+        atexit.register(registry.flush)
+    registry.sink_path = path
+
+
+def read_events(path, since=None, max_lines=200000):
+    # Reads the tail of a JSON lines metrics file
+    if not os.path.exists(path):
+        return []
+    with open(path, "r", encoding="utf-8") as f:
+        lines = f.readlines()[-max_lines:]
+    events = []
+    for line in lines:
+        try:
+            event = json.loads(line)
+        except ValueError:
+            continue
+        if since is None or event["ts"] >= since:
+            events.append(event)
+    return events
@@ -0,0 +1,157 @@
+import random
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from metrics import registry
+
+# Concurrent Document Intelligence analysis.
+#
+# The analyze client only needs a `begin_analyze_document_from_url(model_id, url)`
+# method returning a poller with `.result()`, so a local stub can stand in for
+# `DocumentAnalysisClient` when testing or benchmarking.
+
+
+# === Rate limiting ===
+class RateLimiter:
+    # Token bucket shared by all workers. rate is in requests per second, 0 disables it.
+    def __init__(self, rate=0, burst=None):
+        self.rate = float(rate or 0)
+        self.capacity = float(burst or max(1.0, self.rate))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        if self.rate <= 0:
+            return
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait_for = (1 - self.tokens) / self.rate
+            time.sleep(wait_for)
+
+
+# === Throttling / backoff ===
+def is_throttled(error):
+    status = getattr(error, "status_code", None)
+    if status is None:
+        status = getattr(getattr(error, "response", None), "status_code", None)
+    return status in (429, 503)
+
+
+def backoff_delay(error, attempt, base_delay=1.0, max_delay=60.0):
+    # Honour the service's Retry-After header when present, otherwise exponential backoff with jitter
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    retry_after = headers.get("Retry-After") or headers.get("retry-after")
+    if retry_after:
+        try:
+            return min(max_delay, float(retry_after))
+        except ValueError:
+            pass
+    return min(max_delay, base_delay * (2 ** attempt)) * (0.5 + random.random() / 2)
+
+
+# === Single document ===
+def analyze_one(document_client, name, url, model_id="prebuilt-read", limiter=None, max_retries=5, base_delay=1.0):
+    limiter = limiter or RateLimiter()
+    start = time.perf_counter()
+    attempt = 0
+    while True:
+        limiter.acquire()
+        try:
+            with registry.timer("ocr.analyze"):
+                poller = document_client.begin_analyze_document_from_url(model_id, url)
+                result = poller.result()
+            break
+        except Exception as e:
+            if not is_throttled(e) or attempt >= max_retries:
+                registry.increment("ocr.failed")
+                return {
+                    "name": name,
+                    "result": None,
+                    "error": e,
+                    "seconds": time.perf_counter() - start,
+                    "retries": attempt,
+                }
+            registry.increment("ocr.retries")
+            time.sleep(backoff_delay(e, attempt, base_delay=base_delay))
+            attempt += 1
+
+    return {
+        "name": name,
+        "result": result,
+        "error": None,
+        "seconds": time.perf_counter() - start,
+        "retries": attempt,
+    }
+
+
+# === Many documents ===
+def analyze_documents(document_client, jobs, concurrency=8, rate_limit=0, max_retries=5,
+                      model_id="prebuilt-read", base_delay=1.0):
+    # jobs is an iterable of (name, url) pairs. It is consumed lazily so that at most
+    # `concurrency` analyses are in flight and the listing never runs far ahead of them.
+    # Results are yielded in completion order; failures are yielded with `error` set.
+    concurrency = max(1, int(concurrency))
+    limiter = RateLimiter(rate_limit)
+    jobs = iter(jobs)
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        in_flight = set()
+
+        def submit_next():
+            for name, url in jobs:
+                in_flight.add(executor.submit(
+                    analyze_one, document_client, name, url, model_id, limiter, max_retries, base_delay
+                ))
+                return True
+            return False
+
+        while len(in_flight) < concurrency and submit_next():
+            pass
+
+        while in_flight:
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                in_flight.remove(future)
+                yield future.result()
+                submit_next()
+
+
+# === Throughput reporting ===
+class ThroughputStats:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.documents = 0
+        self.failed = 0
+        self.pages = 0
+        self.retries = 0
+        self.busy_seconds = 0.0
+
+    def record(self, outcome, pages=0):
+        self.retries += outcome["retries"]
+        self.busy_seconds += outcome["seconds"]
+        if outcome["error"] is not None:
+            self.failed += 1
+            return
+        self.documents += 1
+        self.pages += pages
+
+    def summary(self):
+        elapsed = max(time.perf_counter() - self.started, 1e-9)
+        return {
+            "documents": self.documents,
+            "failed": self.failed,
+            "pages": self.pages,
+            "retries": self.retries,
+            "elapsed_seconds": round(elapsed, 2),
+            "documents_per_minute": round(self.documents * 60 / elapsed, 2),
+            "pages_per_second": round(self.pages / elapsed, 2),
+            "mean_seconds_per_document": round(self.busy_seconds / max(1, self.documents + self.failed), 2),
+        }
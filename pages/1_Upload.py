@@ -2,52 +2,76 @@
 
 import streamlit as st
 import os
-import pandas as pd
 import uuid
-import random
-from dotenv import load_dotenv
+from jobs import ACTIVE, STAGES, ensure_workers, progress, queue_from_env
+from services import env, env_flag
 
-load_dotenv()
+# === Config ===
+# Uploads are spooled to job_spool_dir and processed by job_workers background worker
+# processes (jobs.py): OCR, entity extraction, embedding and indexing. The page only
+# enqueues and polls. Set job_autostart_workers=false when the workers run elsewhere
+# (e.g. `python jobs.py work` under a process supervisor).
+job_spool_dir = env("job_spool_dir", "data/uploads")
+job_workers = int(env("job_workers", "2"))
+job_autostart_workers = env_flag("job_autostart_workers", "true")
 
 st.set_page_config(page_title="Upload Documents", layout="centered")
 st.title("📥 Upload Documents")
 
-st.markdown("Upload PDFs to simulate adding extracted entity data.")
-
-# === Paths and storage setup ===
-data_path = "data/entities.csv"
-existing_entities = pd.read_csv(data_path) if os.path.exists(data_path) else pd.DataFrame(columns=[
-    "Document", "Company", "Year", "Key", "Value", "Page", "Confidence"])
-
-# === Simulated company datasets ===
-dummy_sets = {
-    "ADNOC": [
-        {"Document": "ADNOC_2023.pdf", "Company": "ADNOC", "Year": 2023, "Key": "Revenue", "Value": 4034, "Page": 3, "Confidence": 0.96},
-        {"Document": "ADNOC_2023.pdf", "Company": "ADNOC", "Year": 2023, "Key": "Net Profit", "Value": 1304, "Page": 3, "Confidence": 0.91},
-        {"Document": "ADNOC_2023.pdf", "Company": "ADNOC", "Year": 2023, "Key": "EBITDA", "Value": 2015, "Page": 3, "Confidence": 0.88}
-    ],
-    "ENOC": [
-        {"Document": "ENOC_2022.pdf", "Company": "ENOC", "Year": 2022, "Key": "Revenue", "Value": 2900, "Page": 2, "Confidence": 0.87},
-        {"Document": "ENOC_2022.pdf", "Company": "ENOC", "Year": 2022, "Key": "Net Profit", "Value": 1100, "Page": 2, "Confidence": 0.91}
-    ],
-    "Mubadala": [
-        {"Document": "Mubadala_2023.pdf", "Company": "Mubadala", "Year": 2023, "Key": "Investment Capital", "Value": 5200, "Page": 4, "Confidence": 0.89},
-        {"Document": "Mubadala_2023.pdf", "Company": "Mubadala", "Year": 2023, "Key": "Revenue", "Value": 1800, "Page": 4, "Confidence": 0.84}
-    ]
-}
-
-# === Upload simulation ===
+st.markdown("Upload PDFs to analyze, extract, embed and index them in the background.")
+
+# One queue handle per process; the SQLite file is shared with the workers
+@st.cache_resource(show_spinner=False)
+def get_job_queue():
+    return queue_from_env()
+
+job_queue = get_job_queue()
+if job_autostart_workers and ensure_workers(job_queue, job_workers):
+    st.toast(f"Started {job_workers} ingestion workers")
+
+# === Upload ===
 uploaded_files = st.file_uploader("Upload PDFs", type=["pdf"], accept_multiple_files=True)
 
-def append_entities(rows):
-    global existing_entities
-    new_df = pd.DataFrame(rows)
-    existing_entities = pd.concat([existing_entities, new_df], ignore_index=True)
-    existing_entities.to_csv(data_path, index=False)
-    st.success(f"Added {len(rows)} rows to entities.csv")
-
-if uploaded_files:
-    for file in uploaded_files:
-        company = random.choice(list(dummy_sets.keys()))
-        st.info(f"Simulated extraction for '{company}' from uploaded file: {file.name}")
-        append_entities(dummy_sets[company])
\ No newline at end of file
+# The uploader keeps its files across reruns: enqueue each one only once per session
+uploads = st.session_state.setdefault("upload_jobs", {})
+for file in uploaded_files or []:
+    upload_key = (file.name, file.size)
+    if upload_key in uploads:
+        continue
+    os.makedirs(job_spool_dir, exist_ok=True)
+    spool_path = os.path.join(job_spool_dir, f"{uuid.uuid4().hex}-{os.path.basename(file.name)}")
+    with open(spool_path, "wb") as f:
+        f.write(file.getvalue())
+    uploads[upload_key] = job_queue.enqueue("ocr", file.name, {"name": file.name, "path": spool_path})
+
+# === Progress ===
+if uploads:
+    st.subheader("Ingestion jobs")
+    live = job_queue.live_workers()
+    st.caption(f"{live} workers running" if live else "⚠️ No workers running — start them with `python jobs.py work`")
+
+    latest = job_queue.uploads(list(uploads.values()))
+    icons = {"queued": "⏳", "running": "⚙️", "done": "✅", "dead": "☠️"}
+    for job in latest:
+        if job["kind"] == STAGES[-1] and job["status"] == "done":
+            st.write(f"{icons['done']} {job['name']}: indexed")
+        elif job["status"] == "dead":
+            st.write(f"{icons['dead']} {job['name']}: {job['kind']} failed {job['attempts']} times — {job['error']}")
+        else:
+            retry = f", retrying after: {job['error']}" if job["status"] == "queued" and job["error"] else ""
+            st.write(f"{icons[job['status']]} {job['name']}: {job['kind']} {job['status']}{retry}")
+        st.progress(progress(job))
+
+    if any(job["status"] in ACTIVE for job in latest):
+        st.button("🔄 Refresh")
+
+# === Dead letters (from every session, not just this one) ===
+dead = job_queue.dead_letters()
+if dead:
+    with st.expander(f"☠️ {len(dead)} failed jobs"):
+        for job in dead:
+            left, right = st.columns([4, 1])
+            left.write(f"**{job['name']}** — {job['kind']} after {job['attempts']} attempts: {job['error']}")
+            if right.button("Retry", key=f"requeue-{job['id']}"):
+                job_queue.requeue(job["id"])
+                st.rerun()
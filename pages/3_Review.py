@@ -1,6 +1,7 @@
 import streamlit as st
-import pandas as pd
-import os
+from entity_store import get_store
+from extraction import parse_value
+from services import env
 
 st.set_page_config(page_title="Manual Review", layout="centered")
 st.title("👀 Manual Review")
@@ -10,37 +11,65 @@ Below are extracted entities with confidence < 90%.
 You can approve or update each one.
 """)
 
-entities_path = "data/entities.csv"
+# Same settings as the pipeline scripts, read from .env
+store = get_store(env("entity_store_backend", "csv"), env("entity_store_path"))
 
-if not os.path.exists(entities_path):
-    st.warning("No entities.csv file found. Please upload and process documents first.")
+if not store.exists():
+    st.warning("No extracted entities found. Please upload and process documents first.")
     st.stop()
 
-# Load data
-df = pd.read_csv(entities_path)
-low_conf_df = df[df["Confidence"] < 0.90]
+# === Review queue, one page at a time ===
+page_size = 25
+if "review_page" not in st.session_state:
+    st.session_state.review_page = 0
 
-if low_conf_df.empty:
+low_conf_df, total = store.low_confidence(0.90, offset=st.session_state.review_page * page_size, limit=page_size)
+
+if total == 0:
     st.success("✅ All entities meet the confidence threshold. Nothing to review.")
     st.stop()
 
-updated_rows = []
+page_count = (total + page_size - 1) // page_size
+if st.session_state.review_page >= page_count:
+    st.session_state.review_page = page_count - 1
+    st.rerun()
+
+st.caption(f"{total} entities to review — page {st.session_state.review_page + 1} of {page_count}")
+
+def format_value(value):
+    if value is None or value != value:
+        return ""
+    return str(int(value)) if float(value).is_integer() else str(value)
 
-for i, row in low_conf_df.iterrows():
+updates = {}
+invalid = []
+
+for _, row in low_conf_df.iterrows():
+    i = row["EntityId"]
     with st.expander(f"{row['Key']} ({row['Confidence']*100:.1f}%) – {row['Document']} page {row['Page']}"):
-        new_key = st.text_input(f"Entity Key ({i})", value=row["Key"], key=f"key_{i}")
-        new_value = st.text_input(f"Value ({i})", value=row["Value"], key=f"value_{i}")
+        new_key = st.text_input("Entity Key", value=row["Key"], key=f"key_{i}")
+        new_value = st.text_input("Value (millions, or e.g. 4.0bn)", value=format_value(row["Value"]), key=f"value_{i}")
         approve = st.checkbox("Approve and mark as reviewed", key=f"approve_{i}")
 
         if approve:
-            updated_row = row.copy()
-            updated_row["Key"] = new_key
-            updated_row["Value"] = new_value
-            updated_row["Confidence"] = 0.99
-            updated_rows.append((i, updated_row))
-
-if updated_rows:
-    for i, new_row in updated_rows:
-        df.iloc[i] = new_row
-    df.to_csv(entities_path, index=False)
-    st.success("✅ Updated entries saved to entities.csv.")
+            value = parse_value(new_value)
+            if value is None:
+                st.error(f"“{new_value}” is not a number. Enter an amount such as 1,234, (12.5) or 4.0bn.")
+                invalid.append(i)
+            else:
+                updates[i] = {"Key": new_key, "Value": value, "Confidence": 0.99}
+
+# Only the approved rows are written, addressed by EntityId, and nothing while a value is invalid
+if invalid:
+    st.error(f"Nothing saved: fix the {len(invalid)} invalid values above.")
+elif updates:
+    store.update(updates)
+    st.success(f"✅ Saved {len(updates)} reviewed entities.")
+
+previous_col, next_col = st.columns(2)
+if previous_col.button("⬅️ Previous", disabled=st.session_state.review_page == 0):
+    st.session_state.review_page -= 1
+    st.rerun()
+if next_col.button("Next ➡️", disabled=st.session_state.review_page >= page_count - 1):
+    st.session_state.review_page += 1
+    st.rerun()
@@ -1,51 +1,52 @@
 # === Page: 4_Dashboard.py ===
 
 import streamlit as st
-import pandas as pd
-import altair as alt
-import os
+from entity_store import get_store
+from aggregates import get_cube
+from services import env, lazy_module
 
 st.set_page_config(page_title="Dashboard", layout="wide")
 st.title("📊 Investment Insights Dashboard")
 
-data_file = "data/entities.csv"
+# Same settings as the pipeline scripts, read from .env
+store = get_store(env("entity_store_backend", "csv"), env("entity_store_path"))
 
-if not os.path.exists(data_file):
-    st.warning("No extracted entity data found in ../data/entities.csv")
+if not store.exists():
+    st.warning("No extracted entity data found in the entity store")
     st.stop()
 
-# Load CSV
-raw_df = pd.read_csv(data_file)
+# Pre-aggregated Company x Year x Key x Document cube (refreshed when the store changes)
+cube = get_cube(store)
 
 # === Sidebar filters ===
 st.sidebar.header("Filters")
-companies = raw_df["Company"].dropna().unique().tolist()
-years = sorted(raw_df["Year"].dropna().unique())
+companies, years = cube.options()
 
 selected_company = st.sidebar.selectbox("Select Company", ["All"] + companies)
 selected_year = st.sidebar.selectbox("Select Year", ["All"] + [str(y) for y in years])
 
-df = raw_df.copy()
-if selected_company != "All":
-    df = df[df["Company"] == selected_company]
-if selected_year != "All":
-    df = df[df["Year"] == int(selected_year)]
+company_filter = None if selected_company == "All" else selected_company
+year_filter = None if selected_year == "All" else int(selected_year)
+filtered = cube.filtered(company=company_filter, year=year_filter)
+summary = cube.summary(filtered)
 
 # === Show key metric summary ===
-st.metric("Total Reports", df["Document"].nunique())
-st.metric("Total Revenue Extracted", f"${df[df['Key'] == 'Revenue']['Value'].sum():,.2f}")
-st.metric("Average Confidence", f"{df['Confidence'].mean():.2%}")
+st.metric("Total Reports", summary["reports"])
+st.metric("Total Revenue Extracted", f"${summary['revenue']:,.2f}")
+st.metric("Average Confidence", f"{summary['average_confidence']:.2%}")
 
 # === Charts ===
 st.subheader("📈 Revenue by Company and Year")
 
-revenue_data = df[df["Key"] == "Revenue"]
+# One pre-aggregated row per bar instead of every raw entity
+revenue_data = cube.key_by_company_year(filtered, "Revenue")
 if not revenue_data.empty:
+    alt = lazy_module("altair")  # only imported once there is something to chart
     chart = alt.Chart(revenue_data).mark_bar().encode(
         x=alt.X("Year:O", title="Year"),
         y=alt.Y("Value:Q", title="Revenue", stack=False),
         color="Company:N",
-        tooltip=["Company", "Year", "Value", "Document"]
+        tooltip=["Company", "Year", "Value", "Documents"]
     ).interactive()
     st.altair_chart(chart, use_container_width=True)
 else:
@@ -53,4 +54,13 @@ else:
 
 # === Table ===
 st.subheader("📄 Extracted Entities Table")
-st.dataframe(df[["Company", "Year", "Key", "Value", "Document", "Page", "Confidence"]])
+table_limit = 1000
+filters = {}
+if company_filter is not None:
+    filters["Company"] = company_filter
+if year_filter is not None:
+    filters["Year"] = year_filter
+df = store.read(columns=["Company", "Year", "Key", "Value", "Document", "Page", "Confidence"], filters=filters)
+if len(df) > table_limit:
+    st.caption(f"Showing the first {table_limit:,} of {len(df):,} entities — use Export for the full table.")
+st.dataframe(df.head(table_limit))
@@ -1,22 +1,84 @@
-import streamlit as st
-import pandas as pd
 import os
+import streamlit as st
+from entity_store import get_store
+from aggregates import get_cube
+from export import FORMATS, export_entities, preview, remove_stale_exports
+from services import env
+
+# st.download_button holds the whole file in server memory for as long as the button is
+# shown, so exports larger than export_download_max_mb are refused: narrow the filters
+# or pick the more compact parquet format. Prepared files are deleted when the session
+# prepares another one, or after export_max_age_s by whichever session exports next.
+export_download_max_mb = float(env("export_download_max_mb", "200"))
+export_max_age_s = int(env("export_max_age_s", "3600"))
 
 st.set_page_config(page_title="Export Results", layout="centered")
 st.title("📤 Export to Excel")
 
-st.markdown("Export extracted entities and metadata to a CSV file.")
+st.markdown("Export extracted entities and metadata to a CSV, Excel or Parquet file.")
 
-data_file = "data/entities.csv"
+# Same settings as the pipeline scripts, read from .env
+store = get_store(env("entity_store_backend", "csv"), env("entity_store_path"))
 
-if not os.path.exists(data_file):
-    st.warning(f"No extracted entity data found in {os.path.abspath(data_file)}")
+if not store.exists():
+    st.warning("No extracted entity data found in the entity store")
     st.stop()
 
-# Load CSV
-mock_data = pd.read_csv(data_file)
+# === Filters (options come from the pre-aggregated cube, not the raw rows) ===
+cube = get_cube(store)
+companies, years = cube.options()
+keys = sorted(cube.get()["Key"].dropna().unique().tolist())
+
+selected_companies = st.multiselect("Companies", companies)
+selected_years = st.multiselect("Years", years)
+selected_keys = st.multiselect("Keys", keys)
+min_confidence = st.slider("Minimum confidence", 0.0, 1.0, 0.0, 0.01)
+file_format = st.selectbox("Format", list(FORMATS), format_func=str.upper)
+
+filters = {}
+if selected_companies:
+    filters["Company"] = selected_companies
+if selected_years:
+    filters["Year"] = [int(y) for y in selected_years]
+if selected_keys:
+    filters["Key"] = selected_keys
+min_confidence = min_confidence or None
+
+# === Bounded preview ===
+preview_rows = 200
+sample = preview(store, filters=filters, min_confidence=min_confidence, limit=preview_rows)
+if sample is None:
+    st.info("No entities match the current filters.")
+    st.stop()
+st.caption(f"Preview of up to {preview_rows} matching rows")
+st.dataframe(sample)
 
-st.dataframe(mock_data)
+# === Streaming export (written in chunks to a temporary file) ===
+if st.button("Prepare export"):
+    previous = st.session_state.pop("export_path", None)
+    if previous and os.path.exists(previous):
+        os.remove(previous)
+    remove_stale_exports(max_age=export_max_age_s)
+    with st.spinner("Exporting..."):
+        path, rows = export_entities(store, file_format, filters=filters, min_confidence=min_confidence)
+    size_mb = os.path.getsize(path) / 1e6
+    if size_mb > export_download_max_mb:
+        os.remove(path)
+        st.error(
+            f"The export is {size_mb:,.0f} MB ({rows:,} rows), above the {export_download_max_mb:,.0f} MB download limit. "
+            + ("Narrow the filters." if file_format == "parquet" else "Narrow the filters or export to Parquet.")
+        )
+    else:
+        st.session_state.export_path = path
+        st.session_state.export_format = file_format
+        st.session_state.export_rows = rows
 
-csv = mock_data.to_csv(index=False).encode('utf-8')
-st.download_button("Download CSV", data=csv, file_name="extracted_data.csv", mime="text/csv")
\ No newline at end of file
+if st.session_state.get("export_path") and os.path.exists(st.session_state.export_path):
+    mime, suffix = FORMATS[st.session_state.export_format]
+    with open(st.session_state.export_path, "rb") as f:
+        st.download_button(
+            f"Download {st.session_state.export_format.upper()} ({st.session_state.export_rows:,} rows)",
+            data=f,
+            file_name=f"extracted_data{suffix}",
+            mime=mime,
+        )
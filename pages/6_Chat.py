@@ -1,180 +1,326 @@
-import os
 import json
 import re
-import requests
+import time
 import streamlit as st
-from dotenv import load_dotenv
-from openai import OpenAI
-from azure.core.credentials import AzureKeyCredential
-from azure.search.documents import SearchClient
-from azure.storage.blob import BlobServiceClient, generate_blob_sas, BlobSasPermissions
-from datetime import datetime, timedelta, timezone
 from html import escape
-
-# Load environment variables
-load_dotenv()
+from embedder import count_tokens
+from manifest import document_id
+from hybrid import HybridRetriever, load_lexical_index
+from cache import ChatCache
+from conversation import Conversation
+from metrics import registry, enable_jsonl
+from services import env, env_flag, lazy_module, openai_client, search_client, blob_service, http_session, sas_url
 
 # === Config ===
-openai_key = os.getenv("openai_key")
-openai_endpoint = os.getenv("openai_endpoint")
-embedding_model = os.getenv("deployment_name")
-
-search_endpoint = os.getenv("search_endpoint")
-search_key = os.getenv("search_key")
-index_name = os.getenv("index_name")
-
-gpt4o_uri = os.getenv("gpt-4o-uri")
-container_name = os.getenv("parsed_container_name")
-doc_container_name = os.getenv("doc_container_name")
-connection_string = os.getenv("blob_connection_string")
-account_key = os.getenv("blob_account_key")
-
-# === Init clients ===
-openai_client = OpenAI(
-    api_key=openai_key,
-    base_url=openai_endpoint,
-    default_query={"api-version": "2023-05-15"}
-)
-
-search_client = SearchClient(
-    endpoint=search_endpoint,
-    index_name=index_name,
-    credential=AzureKeyCredential(search_key)
-)
+openai_key = env("openai_key")
+embedding_model = env("deployment_name")
+
+gpt4o_uri = env("gpt-4o-uri")
+container_name = env("parsed_container_name")
+embeddings_container_name = env("embeddings_container_name")
+doc_container_name = env("doc_container_name")
+account_key = env("blob_account_key")
+
+# Retrieved chunks shorter than min_chunk_words are dropped; the rest are added
+# best-first until context_token_budget is spent
+min_chunk_words = int(env("min_chunk_words", "8"))
+context_token_budget = int(env("context_token_budget", "1500"))
+
+# "azure" queries Azure AI Search, "local" uses the index built by build_local_index.py
+retriever_backend = env("retriever_backend", "azure")
+local_index_path = env("local_index_path", "data/local_index")
+
+# "hybrid" fuses the vector results with a BM25 index over the page text
+# (build_lexical_index.py) and reranks the fused candidates, so fewer chunks are needed
+retrieval_mode = env("retrieval_mode", "vector")
+lexical_index_path = env("lexical_index_path", "data/lexical_index")
+hybrid_candidates = int(env("hybrid_candidates", "30"))
+hybrid_rerank = env_flag("hybrid_rerank", "true")
+retrieval_top_k = int(env("retrieval_top_k", "6" if retrieval_mode == "hybrid" else "10"))
+
+# Query/retrieval/answer caches; set chat_cache_path to share them on disk across processes
+chat_cache_path = env("chat_cache_path", "")
+chat_cache_size = int(env("chat_cache_size", "1024"))
+chat_cache_ttl = int(env("chat_cache_ttl", "3600"))
+
+# Render GPT-4o answers token by token as they arrive
+stream_answers = env_flag("stream_answers", "true")
+
+# Multi-turn mode keeps the session's history. Follow-ups are rewritten into standalone
+# queries (query_rewrite=llm asks GPT-4o, heuristic carries over the previous question's
+# terms); a query embedding within chat_reuse_threshold cosine of an earlier one reuses
+# its chunks. The history gets history_token_budget tokens on top of the context budget:
+# the last history_recent_turns verbatim, older turns summarized.
+chat_multi_turn = env_flag("chat_multi_turn", "true")
+query_rewrite = env("query_rewrite", "llm")
+chat_reuse_threshold = float(env("chat_reuse_threshold", "0.92"))
+history_token_budget = int(env("history_token_budget", "1200"))
+history_recent_turns = int(env("history_recent_turns", "3"))
+history_summary_tokens = int(env("history_summary_tokens", "300"))
+answer_max_tokens = int(env("answer_max_tokens", "800"))
+
+# Timings and counters are appended here for the Metrics page
+enable_jsonl(env("metrics_path", "data/metrics.jsonl"))
+
+# === Clients ===
+# The SDK clients come from services.py: imported and built on first use, once per
+# process, so reruns and page switches don't pay for them again. The retriever
+# (numpy) and chat client (requests) modules are only imported once a question is asked.
+
+# The local index is loaded once per process and shared by every session
+@st.cache_resource(show_spinner=False)
+def get_local_index(path):
+    return lazy_module("retriever").load_index(path)
+
+@st.cache_resource(show_spinner=False)
+def get_lexical_index(path):
+    return load_lexical_index(path)
+
+def get_retriever():
+    if retriever_backend == "local":
+        retriever = get_local_index(local_index_path)
+    else:
+        retriever = lazy_module("retriever").AzureSearchRetriever(search_client())
+    if retrieval_mode == "hybrid":
+        try:
+            lexical_index = get_lexical_index(lexical_index_path)
+        except FileNotFoundError:
+            # Not cached, so the next question picks the index up once it has been built
+            st.warning(f"⚠️ No lexical index at {lexical_index_path} (run build_lexical_index.py); using vector search only.")
+            registry.increment("chat.lexical_index_missing")
+            return retriever
+        retriever = HybridRetriever(
+            retriever, lexical_index, candidates=hybrid_candidates, use_reranker=hybrid_rerank
+        )
+    return retriever
+
+# Pages step3.py collapsed into an already embedded near-duplicate chunk, keyed by the
+# document id of that chunk; reloaded every 10 minutes so new embedding runs show up
+@st.cache_resource(show_spinner=False, ttl=600)
+def get_duplicate_pages(container):
+    try:
+        data = blob_service().get_container_client(container).download_blob(lazy_module("embedding_store").DUPLICATES_BLOB).readall()
+    except Exception:
+        return {}  # deduplication disabled or not run yet
+    return json.loads(data)
+
+# One cache per process, shared by every Streamlit session
+@st.cache_resource(show_spinner=False)
+def get_chat_cache(path, size, ttl):
+    return ChatCache(disk_path=path or None, max_entries=size, ttl=ttl)
+
+chat_cache = get_chat_cache(chat_cache_path, chat_cache_size, chat_cache_ttl)
 
 # === SAS Token Generator ===
 def generate_sas_url(container, blob_name, expiry_minutes=60):
     if not account_key:
         raise ValueError("Missing blob_account_key in environment.")
-    blob_service = BlobServiceClient.from_connection_string(connection_string)
-    sas_token = generate_blob_sas(
-        account_name=blob_service.account_name,
-        container_name=container,
-        blob_name=blob_name,
-        account_key=account_key,
-        permission=BlobSasPermissions(read=True),
-        expiry=datetime.now(timezone.utc) + timedelta(minutes=expiry_minutes)
-    )
-    return f"https://{blob_service.account_name}.blob.core.windows.net/{container}/{blob_name}?{sas_token}"
+    return sas_url(container, blob_name, account_key, expiry_minutes)
 
 # === Streamlit UI ===
 st.set_page_config(page_title="Ask in Chat", layout="centered")
 st.title("🧠 Ask in Chat")
 
+# === Conversation (per session) ===
+conversation = None
+if chat_multi_turn:
+    if "conversation" not in st.session_state:
+        st.session_state.conversation = Conversation(
+            history_token_budget=history_token_budget,
+            recent_turns=history_recent_turns,
+            summary_tokens=history_summary_tokens,
+            reuse_threshold=chat_reuse_threshold,
+        )
+    conversation = st.session_state.conversation
+    if st.sidebar.button("🧹 New conversation"):
+        conversation.clear()
+    for turn in conversation.turns:
+        with st.chat_message("user"):
+            st.write(turn["question"])
+        with st.chat_message("assistant"):
+            st.write(turn["answer"], unsafe_allow_html=True)
+
+def rewrite_completion(payload):
+    with registry.timer("chat.rewrite"):
+        return lazy_module("chat_client").complete_chat(http_session(), gpt4o_uri, openai_key, payload)
+
 query = st.text_input("Ask your question:", placeholder="e.g. What was the revenue in 2023?")
 submit = st.button("Get Answer")
 
 if submit and query.strip():
+    question_started = time.perf_counter()
+    registry.increment("chat.questions")
     with st.spinner("Thinking..."):
         try:
-            # Step 1: Embed the query
-            embedding_response = openai_client.embeddings.create(
-                model=embedding_model,
-                input=[query]
-            )
-            query_vector = embedding_response.data[0].embedding
-
-            # Step 2: Search the vector index
-            results = search_client.search(
-                search_text=None,
-                vector_queries=[{
-                    "vector": query_vector,
-                    "k": 10,
-                    "fields": "embedding",
-                    "kind": "vector"
-                }]
-            )
+            # Step 0: Turn a follow-up into a standalone question
+            standalone = query
+            if conversation is not None:
+                standalone = conversation.standalone_query(query, rewrite_completion if query_rewrite == "llm" else None)
+                if standalone != query:
+                    st.caption(f"🔎 Searching for: {standalone}")
+
+            # Step 1: Embed the query (cached by normalized question text)
+            def embed_query():
+                with registry.timer("chat.embed"):
+                    embedding_response = openai_client().embeddings.create(
+                        model=embedding_model,
+                        input=[standalone]
+                    )
+                return embedding_response.data[0].embedding
+
+            query_vector, _ = chat_cache.embed(standalone, embed_query)
+
+            # Step 2: Search the index, vector or hybrid (cached per index version)
+            retriever = get_retriever()
+
+            search_mode = "hybrid" if retriever.kind == "hybrid" else "vector"
+
+            def search_index():
+                with registry.timer("chat.search", backend=retriever_backend, mode=search_mode):
+                    if search_mode == "hybrid":
+                        return retriever.search(query_vector, k=retrieval_top_k, query=standalone)
+                    return retriever.search(query_vector, k=retrieval_top_k)
+
+            # An earlier turn with a near-identical query already retrieved the chunks
+            results = conversation.reusable_chunks(query_vector, retriever.version) if conversation is not None else None
+            if results is not None:
+                registry.increment("chat.reused_retrievals")
+            else:
+                results, _ = chat_cache.retrieve(query_vector, retriever.version, retrieval_top_k, search_index)
 
             # Step 3: Clean and deduplicate
             seen_texts = set()
             cleaned_chunks = []
             for r in results:
                 text = r["text"].strip()
-                if not text or len(text.split()) < 30 or text in seen_texts:
+                if not text or len(text.split()) < min_chunk_words or text in seen_texts:
                     continue
                 seen_texts.add(text)
+                chunk_id = r.get("id")
+                if chunk_id is None and r.get("chunk") is not None:
+                    chunk_id = document_id(r.get("source", ""), r.get("page", 1), r["chunk"])
                 cleaned_chunks.append({
+                    "id": chunk_id,
                     "source": r.get("source", "").strip(),
                     "page": r.get("page", 1),
                     "text": text,
-                    "score": r["@search.score"]
+                    "score": r["score"]
                 })
 
             if not cleaned_chunks:
                 st.warning("⚠️ No relevant content found in the documents.")
                 st.stop()
 
-            cleaned_chunks = sorted(cleaned_chunks, key=lambda x: -x["score"])[:4]
+            # Keep the best chunks that fit in the prompt budget
+            selected_chunks = []
+            used_tokens = 0
+            for chunk in sorted(cleaned_chunks, key=lambda x: -x["score"]):
+                chunk_tokens = count_tokens(chunk["text"])
+                if selected_chunks and used_tokens + chunk_tokens > context_token_budget:
+                    continue
+                selected_chunks.append(chunk)
+                used_tokens += chunk_tokens
+            retrieved_chunks = cleaned_chunks  # kept with the turn for reuse
+            cleaned_chunks = selected_chunks
             context = "\n\n---\n\n".join([c["text"] for c in cleaned_chunks])
+            registry.increment("chat.context_tokens", used_tokens)
 
             # Step 4: Ask GPT-4o using the context
-            headers = {
-                "Content-Type": "application/json",
-                "api-key": openai_key
-            }
-
+            system_prompt = (
+                "You are a helpful assistant answering questions based strictly on the provided document context. "
+                "Always cite the source document file name (e.g., adnoc_financials.pdf) and the page number where the information came from, "
+                "formatted like this: (Source: adnoc_financials.pdf, Page 3). on a seperate line. "
+                "Do not guess or include information not explicitly stated in the provided context. "
+                "Do not summarize unrelated files. "
+                "Your goal is to deliver a precise, well-structured answer using only the content retrieved from the documents."
+            )
+            # Standalone question, so the answer doesn't depend on resolving references in the history
+            user_content = f"Answer the question: '{standalone}' using the context below:\n\n{context}"
+            if conversation is not None:
+                messages = conversation.messages(system_prompt, user_content)
+                registry.increment("chat.history_tokens", sum(count_tokens(m["content"]) for m in messages[1:-1]))
+            else:
+                messages = [{"role": "system", "content": system_prompt}, {"role": "user", "content": user_content}]
             payload = {
-                "messages": [
-                    {
-                        "role": "system",
-                        "content": (
-                            "You are a helpful assistant answering questions based strictly on the provided document context. "
-                            "Always cite the source document file name (e.g., adnoc_financials.pdf) and the page number where the information came from, "
-                            "formatted like this: (Source: adnoc_financials.pdf, Page 3). on a seperate line. "
-                            "Do not guess or include information not explicitly stated in the provided context. "
-                            "Do not summarize unrelated files. "
-                            "Your goal is to deliver a precise, well-structured answer using only the content retrieved from the documents."
-                        )
-                    },
-                    {
-                        "role": "user",
-                        "content": f"Answer the question: '{query}' using the context below:\n\n{context}"
-                    }
-                ],
+                "messages": messages,
                 "temperature": 0.3,
-                "max_tokens": 800
+                "max_tokens": answer_max_tokens
             }
 
-            response = requests.post(gpt4o_uri, headers=headers, json=payload)
+            st.subheader("GPT-4o Answer")
 
-            if response.status_code == 200:
-                try:
-                    answer = response.json()["choices"][0]["message"]["content"]
-                except (KeyError, IndexError):
-                    answer = "⚠️ Unexpected response format from GPT-4o."
+            # Failed requests raise so they are never cached
+            answer_key = chat_cache.answer_key(standalone, context)
+            chat_client = lazy_module("chat_client")
+            cached = chat_cache.answers.lookup(answer_key)
+            try:
+                if cached is not None:
+                    answer = cached["value"]
+                    registry.increment("chat.cached_answers")
+                    st.write(answer, unsafe_allow_html=True)
+                elif stream_answers:
+                    timings = {}
+                    answer = st.write_stream(chat_client.stream_chat(http_session(), gpt4o_uri, openai_key, payload, timings=timings))
+                    chat_cache.answers.store(answer_key, answer, timings["total_s"])
+                    registry.observe("chat.completion", timings["total_s"])
+                    registry.observe("chat.first_token", timings.get("first_token_s", timings["total_s"]))
+                    st.caption(
+                        f"First token after {timings.get('first_token_s', timings['total_s']):.2f}s, "
+                        f"full answer after {timings['total_s']:.2f}s"
+                    )
+                else:
+                    started = time.perf_counter()
+                    answer = chat_client.complete_chat(http_session(), gpt4o_uri, openai_key, payload)
+                    chat_cache.answers.store(answer_key, answer, time.perf_counter() - started)
+                    registry.observe("chat.completion", time.perf_counter() - started)
+                    st.write(answer, unsafe_allow_html=True)
+            except RuntimeError as e:
+                registry.increment("chat.completion.errors")
+                answer = str(e)
+                st.write(answer, unsafe_allow_html=True)
             else:
-                answer = f"❌ Request failed: {response.status_code} - {response.text}"
-
-            # === Display answer (safely, without markdown formatting)
-            lines = answer.strip().count('\n') + 1
-            dynamic_height = min(600, max(100, lines * 20))
-
-            st.subheader("GPT-4o Answer")
-            st.write(answer, unsafe_allow_html=True)
+                if conversation is not None:
+                    conversation.add_turn(query, standalone, answer, query_vector, retrieved_chunks, retriever.version)
 
             # === Show attached documents (unique files with page groupings)
             st.subheader("Attached Source Documents")
 
             file_page_map = {}
+            duplicate_pages = get_duplicate_pages(embeddings_container_name) if embeddings_container_name else {}
             for chunk in cleaned_chunks:
                 source = chunk.get("source", "").strip()
                 page = chunk.get("page", 1)
                 if not source:
                     continue
                 file_page_map.setdefault(source, set()).add(page)
+                # The same passage appears on these pages too, but was only embedded once
+                for duplicate_source, duplicate_page in duplicate_pages.get(chunk.get("id"), []):
+                    file_page_map.setdefault(duplicate_source, set()).add(duplicate_page)
 
             for source, pages in file_page_map.items():
                 try:
                     display_name = source.replace(".json", "").replace("-", " ").strip()
                     pdf_file = source.replace(".json", ".pdf")
-                    sas_url = generate_sas_url(doc_container_name, pdf_file, expiry_minutes=60)
+                    link = generate_sas_url(doc_container_name, pdf_file, expiry_minutes=60)
                     pages_str = ", ".join(str(p) for p in sorted(pages))
                     st.markdown(
-                        f'<a href="{sas_url}" target="_blank">📄 {display_name} (pages {pages_str})</a>',
+                        f'<a href="{link}" target="_blank">📄 {display_name} (pages {pages_str})</a>',
                         unsafe_allow_html=True
                     )
                 except Exception as e:
                     st.markdown(f"- ⚠️ Error rendering source link for {source}: {str(e)}")
 
         except Exception as e:
+            registry.increment("chat.errors")
             st.error(f"🚨 An error occurred: {str(e)}")
+
+    registry.observe("chat.total", time.perf_counter() - question_started)
+    registry.flush()  # the server rarely exits cleanly, so don't wait for the buffer to fill
+
+# === Cache statistics ===
+with st.sidebar.expander("⚡ Cache"):
+    for layer in chat_cache.stats():
+        st.caption(
+            f"{layer['layer']}: {layer['hit_rate']:.0%} hit rate "
+            f"({layer['hits']} hits / {layer['misses']} misses), {layer['saved_seconds']}s saved"
+        )
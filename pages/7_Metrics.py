@@ -0,0 +1,108 @@
+# === Page: 7_Metrics.py ===
+
+import time
+import streamlit as st
+from metrics import registry, read_events
+from services import env, lazy_module, report, import_profile
+
+# Written by main.py, step3.py, step4.py, pipeline.py and the Chat page
+metrics_path = env("metrics_path", "data/metrics.jsonl")
+
+st.set_page_config(page_title="Metrics", layout="wide")
+st.title("⏱️ Pipeline & Chat Metrics")
+
+windows = {"Last hour": 3600, "Last 24 hours": 86400, "Last 7 days": 7 * 86400, "All": None}
+window = st.sidebar.selectbox("Time window", list(windows))
+since = time.time() - windows[window] if windows[window] else None
+
+events = read_events(metrics_path, since=since)
+if not events:
+    st.info(f"No metrics recorded in {metrics_path} for this window yet.")
+    st.stop()
+
+pd = lazy_module("pandas")
+df = pd.DataFrame(events)
+df["stage"] = df["labels"].map(lambda labels: labels.get("stage") or labels.get("backend") or "")
+df["time"] = pd.to_datetime(df["ts"], unit="s")
+counters = df[df["kind"] == "counter"]
+timings = df[df["kind"] == "histogram"]
+
+
+def counter_total(name):
+    return int(counters.loc[counters["name"] == name, "value"].sum())
+
+
+def per_minute(name):
+    rows = counters[counters["name"] == name]
+    if rows.empty:
+        return 0.0
+    span = max(rows["ts"].max() - rows["ts"].min(), 60)
+    return rows["value"].sum() * 60 / span
+
+
+# === Throughput ===
+st.subheader("🚚 Ingestion throughput")
+columns = st.columns(4)
+for column, (label, name) in zip(columns, [
+    ("Documents analyzed", "ocr.documents"),
+    ("Pages analyzed", "ocr.pages"),
+    ("Chunks embedded", "embed.chunks"),
+    ("Documents indexed", "index.documents"),
+]):
+    column.metric(label, f"{counter_total(name):,}", f"{per_minute(name):,.1f}/min", delta_color="off")
+
+# === Latency ===
+st.subheader("🐢 Latency by call")
+latency = (
+    timings.groupby(["name", "stage"])["value"]
+    .agg(
+        calls="count",
+        p50=lambda v: v.quantile(0.5),
+        p95=lambda v: v.quantile(0.95),
+        max="max",
+        total_s="sum",
+    )
+    .reset_index()
+    .sort_values("total_s", ascending=False)
+)
+st.dataframe(latency.round(3), use_container_width=True)
+
+# === Retries, failures and tokens ===
+left, right = st.columns(2)
+with left:
+    st.subheader("🔁 Retries & failures")
+    problems = counters[counters["name"].str.endswith((".retries", ".errors", ".failed"))]
+    if problems.empty:
+        st.caption("No retries or failures recorded.")
+    else:
+        st.dataframe(
+            problems.groupby(["name", "stage"])["value"].sum().reset_index(name="count"),
+            use_container_width=True,
+        )
+
+with right:
+    st.subheader("🔤 Token usage")
+    st.metric("Embedding tokens", f"{counter_total('embed.tokens'):,}")
+    st.metric("Chat context tokens", f"{counter_total('chat.context_tokens'):,}")
+    st.metric("Chat history tokens", f"{counter_total('chat.history_tokens'):,}")
+    questions = counter_total("chat.questions")
+    st.metric("Chat questions", f"{questions:,}", f"{counter_total('chat.cached_answers'):,} answered from cache", delta_color="off")
+
+tokens = counters[counters["name"].isin(["embed.tokens", "chat.context_tokens", "chat.history_tokens"])]
+if not tokens.empty:
+    st.line_chart(tokens.set_index("time").groupby("name")["value"].resample("1h").sum().unstack(0).fillna(0))
+
+# === Cold start ===
+with st.expander("🚀 Cold start (imports and clients paid by this Streamlit process)"):
+    startup = report()
+    if startup:
+        st.dataframe(pd.DataFrame(startup), use_container_width=True)
+    else:
+        st.caption("Nothing imported or built lazily yet.")
+    if st.button("Profile cold imports"):
+        st.caption("Each module imported in a fresh interpreter with -X importtime")
+        st.dataframe(pd.DataFrame(import_profile()), use_container_width=True)
+
+# === Export ===
+with st.expander("Prometheus exposition (this Streamlit process)"):
+    st.code(registry.prometheus(), language="text")
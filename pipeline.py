@@ -0,0 +1,551 @@
+import argparse
+import datetime
+import io
+import json
+import os
+import queue
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from dotenv import load_dotenv
+from ocr import analyze_one, RateLimiter
+from manifest import Manifest, blob_fingerprint, document_id
+from chunking import chunk_page
+from embedder import BatchEmbedder
+from metrics import registry, enable_jsonl
+from indexer import SearchIndexer
+
+# End-to-end ingestion: PDF -> pages -> chunks/embeddings -> index batches.
+#
+# The three stages of main.py, step3.py and step4.py run concurrently, connected by
+# bounded queues so a slow stage applies backpressure instead of letting work pile up.
+# Progress is checkpointed in the same per-stage manifests the scripts use, so a crashed
+# run resumes where it stopped (a parsed-but-not-embedded PDF restarts at the embed
+# stage, an embedded-but-not-indexed one at the index stage).
+#
+#   python pipeline.py --ocr-workers 8 --embed-workers 2
+#   python pipeline.py --dry-run --dry-run-documents 50    # local fakes, no Azure calls
+
+DONE = object()
+
+
+class StageStats:
+    def __init__(self, name):
+        self.name = name
+        self.items = 0
+        self.failed = 0
+        self.busy_seconds = 0.0
+        self.lock = threading.Lock()
+
+    def record(self, seconds, failed=False):
+        with self.lock:
+            self.items += 1
+            self.failed += int(failed)
+            self.busy_seconds += seconds
+        registry.observe("pipeline.stage", seconds, stage=self.name)
+        if failed:
+            registry.increment("pipeline.failed", stage=self.name)
+
+
+def start_stage(name, handle, inbox, outbox, workers, downstream_workers, stats, stop=None):
+    # Runs `handle(item, emit)` on `workers` threads. When every worker has seen DONE,
+    # one DONE per downstream worker is passed on. Once `stop` is set, items are taken
+    # off the inbox but not handled, so nothing upstream blocks on a full queue.
+    remaining = [workers]
+    lock = threading.Lock()
+
+    def loop():
+        while True:
+            item = inbox.get()
+            if item is DONE:
+                break
+            if stop is not None and stop.is_set():
+                continue
+            started = time.perf_counter()
+            failed = False
+            try:
+                handle(item, outbox.put if outbox is not None else None)
+            except Exception as e:
+                failed = True
+                print(f"❌ [{name}] {e}")
+            stats.record(time.perf_counter() - started, failed)
+        with lock:
+            remaining[0] -= 1
+            last = remaining[0] == 0
+        if last and outbox is not None:
+            for _ in range(downstream_workers):
+                outbox.put(DONE)
+
+    threads = [threading.Thread(target=loop, name=f"{name}-{i}", daemon=True) for i in range(workers)]
+    for thread in threads:
+        thread.start()
+    return threads
+
+
+class Pipeline:
+    def __init__(self, blob_service_client, document_client, openai_client, search_client, settings, shared_state=False):
+        self.settings = settings
+        self.blob_service_client = blob_service_client
+        self.document_client = document_client
+        self.search_client = search_client
+        self.landing = blob_service_client.get_container_client(settings["doc_container_name"])
+        self.parsed = blob_service_client.get_container_client(settings["parsed_container_name"])
+        self.embeddings = blob_service_client.get_container_client(settings["embeddings_container_name"])
+
+        manifest_dir = settings["manifest_dir"]
+        full_rebuild = settings["full_rebuild"]
+        self.ocr_manifest = Manifest("ocr", manifest_dir, full_rebuild)
+        self.embed_manifest = Manifest("embed", manifest_dir, full_rebuild)
+        self.index_manifest = Manifest("index", manifest_dir, full_rebuild)
+
+        # Near-duplicate collapsing, shared with step3.py through dedupe.json. The embed
+        # manifest is then only saved right after it (see checkpoint_embed), so an entry
+        # never outlives the dedupe state it relies on. `shared_state` is set by the job
+        # workers: several processes then reload and save dedupe.json under a lock file
+        # around each use, so it isn't read up front.
+        self.dedupe = None
+        self.dedupe_lock = threading.Lock()
+        self.shared_state = shared_state
+        self.embedded_since_save = 0
+        if settings["near_duplicate_threshold"] > 0:
+            from dedupe import NearDuplicateIndex
+
+            self.dedupe = NearDuplicateIndex(
+                os.path.join(manifest_dir, "dedupe.json"), threshold=settings["near_duplicate_threshold"],
+                full_rebuild=full_rebuild or shared_state,
+            )
+            self.embed_manifest.autosave_every = 0
+
+        self.limiter = RateLimiter(settings["analyze_rate_limit"])
+        self.embedder = BatchEmbedder(
+            openai_client,
+            settings["deployment_name"],
+            max_inputs=settings["embedding_batch_size"],
+            max_batch_tokens=settings["embedding_batch_tokens"],
+            concurrency=settings["embedding_concurrency"],
+        )
+
+        queue_size = settings["queue_size"]
+        self.pdf_queue = queue.Queue(maxsize=queue_size)
+        self.page_queue = queue.Queue(maxsize=queue_size)
+        self.index_queue = queue.Queue(maxsize=queue_size)
+        self.stats = {name: StageStats(name) for name in ("ocr", "embed", "index")}
+        self.skipped = 0
+        self.index_requests = 0
+        self.stop = threading.Event()  # set when the index stage dies; the other stages wind down
+        self.index_error = None
+        self._embedding_etags = None  # listed once, for resuming index items of older manifests
+
+    # === Stage 0: list landing blobs, skipping or resuming checkpointed ones ===
+    def list_inputs(self):
+        for blob in self.landing.list_blobs():
+            if self.stop.is_set():
+                break
+            fingerprint = blob_fingerprint(blob)
+            parsed_name = blob.name.replace(".pdf", ".json")
+            if not self.ocr_manifest.is_current(blob.name, fingerprint):
+                self.pdf_queue.put((blob.name, fingerprint, self.blob_url(blob.name)))
+                continue
+
+            entry = self.ocr_manifest.entries[blob.name]
+            parsed_etag = entry.get("parsed_etag")
+            if not self.embed_manifest.is_current(parsed_name, parsed_etag):
+                # Parsed but not embedded: resume at the embed stage
+                pages = json.loads(self.parsed.download_blob(parsed_name).readall())
+                self.page_queue.put((parsed_name, parsed_etag, pages))
+                continue
+
+            # Embedding blobs whose current version (the ETag the embed stage recorded, or
+            # listed for older manifest entries) is not what the index manifest holds
+            etags = self.embed_manifest.entries[parsed_name].get("output_etags") or {}
+            unindexed = []
+            for name in self.embed_manifest.outputs(parsed_name):
+                if name.endswith(".meta.json"):
+                    continue
+                fingerprint = etags.get(name) or self.embedding_etags().get(name)
+                if not self.index_manifest.is_current(name, fingerprint):
+                    unindexed.append((name, fingerprint))
+            if unindexed:
+                # Embedded but not indexed: resume at the index stage
+                for name, fingerprint in unindexed:
+                    self.index_queue.put((name, fingerprint, list(self.documents_from_blob(name))))
+                continue
+
+            self.skipped += 1
+
+    def embedding_etags(self):
+        if self._embedding_etags is None:
+            self._embedding_etags = {blob.name: blob_fingerprint(blob) for blob in self.embeddings.list_blobs()}
+        return self._embedding_etags
+
+    def blob_url(self, blob_name):
+        if self.settings["dry_run"]:
+            return f"fake://{self.settings['doc_container_name']}/{blob_name}"
+        from azure.storage.blob import generate_blob_sas, BlobSasPermissions
+
+        sas_token = generate_blob_sas(
+            account_name=self.blob_service_client.account_name,
+            container_name=self.settings["doc_container_name"],
+            blob_name=blob_name,
+            account_key=self.blob_service_client.credential.account_key,
+            permission=BlobSasPermissions(read=True),
+            expiry=datetime.datetime.utcnow() + datetime.timedelta(hours=1)
+        )
+        return f"https://{self.blob_service_client.account_name}.blob.core.windows.net/{self.settings['doc_container_name']}/{blob_name}?{sas_token}"
+
+    # === Stage 1: OCR ===
+    def analyze(self, item, emit):
+        name, fingerprint, url = item
+        outcome = analyze_one(
+            self.document_client, name, url, limiter=self.limiter, max_retries=self.settings["analyze_max_retries"]
+        )
+        if outcome["error"] is not None:
+            raise RuntimeError(f"Failed {name} after {outcome['retries']} retries: {outcome['error']}")
+
+        pages = []
+        for page in outcome["result"].pages:
+            lines = [line.content for line in page.lines]
+            pages.append({"page": page.page_number, "text": " ".join(lines), "lines": lines})
+
+        parsed_name = name.replace(".pdf", ".json")
+        with registry.timer("blob.upload", stage="ocr"):
+            uploaded = self.parsed.upload_blob(
+                name=parsed_name, data=json.dumps(pages, ensure_ascii=False, indent=2), overwrite=True
+            )
+        parsed_etag = uploaded["etag"].strip('"')
+        self.ocr_manifest.record(name, fingerprint, outputs=[parsed_name], pages=len(pages), parsed_etag=parsed_etag)
+        registry.increment("ocr.documents")
+        registry.increment("ocr.pages", len(pages))
+        print(f"✅ Parsed {name} ({len(pages)} pages, {outcome['seconds']:.1f}s)")
+        emit((parsed_name, parsed_etag, pages))
+
+    # === Stage 2: chunk + embed ===
+    @contextmanager
+    def dedupe_state(self):
+        # Exclusive access to the near-duplicate state for this process, and for the other
+        # job workers when `shared_state` is set
+        with self.dedupe_lock:
+            if not self.shared_state:
+                yield self.dedupe
+                return
+            from entity_store import FileLock
+
+            with FileLock(f"{self.dedupe.path}.lock"):
+                self.dedupe.load()
+                yield self.dedupe
+                self.dedupe.save()
+                self.publish_duplicates()
+
+    def release(self, name):
+        # Call inside dedupe_state(). Files that referenced chunks of `name` lose their
+        # embed manifest entry, so the next run of pipeline.py or step3.py re-embeds them.
+        dependants = self.dedupe.release(name)
+        for dependant in dependants:
+            self.embed_manifest.forget(dependant)
+            print(f"↩️ {dependant} referenced chunks of {name}; it will be re-embedded next run")
+        return dependants
+
+    def publish_duplicates(self):
+        from embedding_store import DUPLICATES_BLOB
+
+        self.embeddings.upload_blob(
+            name=DUPLICATES_BLOB, data=json.dumps(self.dedupe.duplicates_by_chunk()), overwrite=True
+        )
+
+    def checkpoint_embed(self):
+        # With dedupe on, dedupe.json is saved first and the embed manifest right after it
+        if self.dedupe is None or self.shared_state:
+            return
+        with self.dedupe_lock:
+            self.embedded_since_save += 1
+            if self.embedded_since_save >= 25:
+                self.dedupe.save()
+                self.embed_manifest.save()
+                self.embedded_since_save = 0
+
+    def embed(self, item, emit):
+        parsed_name, parsed_etag, pages = item
+        chunks = [
+            {"page": page["page"], **chunk}
+            for page in pages if page["text"].strip()
+            for chunk in chunk_page(page, self.settings["chunk_max_tokens"], self.settings["chunk_overlap_tokens"])
+        ]
+        duplicates = {}
+        dependants = set()
+        if self.dedupe is not None:
+            # Near-duplicates of chunks embedded earlier (in this run or before) only get a reference
+            with self.dedupe_state() as dedupe:
+                dependants = self.release(parsed_name)  # its chunks are about to be re-embedded
+                chunks, duplicates = dedupe.collapse(parsed_name, chunks)
+            if self.shared_state and dependants:
+                self.embed_manifest.commit(*dependants)
+            registry.increment("embed.duplicates", len(duplicates))
+        vectors, failed = self.embedder.embed(
+            [((chunk["page"], chunk["chunk"]), chunk["text"]) for chunk in chunks]
+        )
+        if failed:
+            if self.dedupe is not None:
+                # Retried as a whole, together with the files that meanwhile referenced its chunks
+                with self.dedupe_state():
+                    dependants = self.release(parsed_name)
+                if self.shared_state and dependants:
+                    self.embed_manifest.commit(*dependants)
+            raise RuntimeError(f"Failed to embed {len(failed)} chunks of {parsed_name}; it will be retried next run")
+
+        rows = [{"source": parsed_name, **chunk} for chunk in chunks]
+        outputs = []  # (embedding blob name, etag, search documents)
+        if self.settings["embedding_format"] == "npy" and rows:
+            from embedding_store import shard_names, serialize_vectors
+
+            embeddings = [vectors[(row["page"], row["chunk"])] for row in rows]
+            vectors_name, meta_name = shard_names(parsed_name)
+            with registry.timer("blob.upload", stage="embed"):
+                uploaded = self.embeddings.upload_blob(name=vectors_name, data=serialize_vectors(embeddings), overwrite=True)
+                self.embeddings.upload_blob(name=meta_name, data=json.dumps(rows, ensure_ascii=False), overwrite=True)
+            documents = [self.search_document(row, embedding) for row, embedding in zip(rows, embeddings)]
+            outputs.append((vectors_name, uploaded["etag"].strip('"'), documents))
+            written_names = [vectors_name, meta_name]
+        else:
+            for row in rows:
+                embedding = vectors[(row["page"], row["chunk"])]
+                json_blob_name = parsed_name.replace(".json", f".page{row['page']}.chunk{row['chunk']}.embedding.json")
+                with registry.timer("blob.upload", stage="embed"):
+                    uploaded = self.embeddings.upload_blob(
+                        name=json_blob_name, data=json.dumps({"embedding": embedding, **row}), overwrite=True
+                    )
+                outputs.append((json_blob_name, uploaded["etag"].strip('"'), [self.search_document(row, embedding)]))
+            written_names = [output[0] for output in outputs]
+
+        # Drop embeddings for chunks that no longer exist in the changed file, and their
+        # search documents: no later upload overwrites those ids
+        for old_blob_name in set(self.embed_manifest.outputs(parsed_name)) - set(written_names):
+            self.embeddings.delete_blob(old_blob_name)
+            stale_ids = self.index_manifest.outputs(old_blob_name)
+            if stale_ids:
+                self.search_client.delete_documents(documents=[{"id": doc_id} for doc_id in stale_ids])
+            self.index_manifest.forget(old_blob_name)
+
+        self.embed_manifest.record(
+            parsed_name, parsed_etag, outputs=written_names, output_etags={name: etag for name, etag, _ in outputs},
+            duplicates=len(duplicates),
+        )
+        self.checkpoint_embed()
+        registry.increment("embed.chunks", len(rows))
+        print(f"✅ Embedded {len(rows)} chunks of {parsed_name}" + (f", {len(duplicates)} near-duplicates" if duplicates else ""))
+        for output in outputs:
+            emit(output)
+
+    @staticmethod
+    def search_document(row, embedding):
+        return {
+            "id": document_id(row["source"], row["page"], row.get("chunk")),
+            "text": row["text"],
+            "source": row["source"],
+            "page": row["page"],
+            "embedding": list(embedding),
+        }
+
+    def documents_from_blob(self, blob_name):
+        # Re-reads the search documents of an embedding blob when resuming at the index stage
+        if blob_name.endswith(".vectors.npy"):
+            import numpy as np
+
+            vectors = np.load(io.BytesIO(self.embeddings.download_blob(blob_name).readall()))
+            meta_name = blob_name[:-len(".vectors.npy")] + ".meta.json"
+            rows = json.loads(self.embeddings.download_blob(meta_name).readall())
+            for row, vector in zip(rows, vectors):
+                yield self.search_document(row, vector.tolist())
+            return
+        data = json.loads(self.embeddings.download_blob(blob_name).readall())
+        yield self.search_document(data, data.pop("embedding"))
+
+    # === Stage 3: index in size-bounded batches, several uploads in flight ===
+    def index(self):
+        # If indexing fails the pipeline stops: the error is kept for run(), and the queue
+        # is drained so embed workers blocked on a full index queue can finish
+        try:
+            self._index()
+        except Exception as e:
+            self.index_error = e
+            self.stop.set()
+            with self.stats["index"].lock:
+                self.stats["index"].failed += 1
+            registry.increment("pipeline.failed", stage="index")
+            print(f"❌ [index] {e}; stopping the pipeline")
+            while self.index_queue.get() is not DONE:
+                pass
+
+    def _index(self):
+        pending = {}  # embedding blob -> (fingerprint, ids)
+        stats = self.stats["index"]
+
+        def finish(name, failed):
+            fingerprint, ids = pending.pop(name)
+            with stats.lock:
+                stats.items += 1
+                stats.failed += int(bool(failed))
+            if failed:
+                print(f"❌ [index] {len(failed)} documents of {name} were not indexed; it will be retried next run")
+                return
+            removed = set(self.index_manifest.outputs(name)) - set(ids)
+            if removed:
+                self.search_client.delete_documents(documents=[{"id": doc_id} for doc_id in removed])
+            self.index_manifest.record(name, fingerprint, outputs=ids)
+
+        indexer = SearchIndexer(
+            self.search_client,
+            max_batch_bytes=self.settings["index_batch_bytes"],
+            max_batch_documents=self.settings["index_batch_size"],
+            concurrency=self.settings["index_concurrency"],
+            on_group_done=finish,
+        )
+        while True:
+            item = self.index_queue.get()
+            if item is DONE:
+                break
+            name, fingerprint, documents = item
+            pending[name] = (fingerprint, [d["id"] for d in documents])
+            indexer.add_group(name, documents)
+        indexer.close()
+        stats.busy_seconds = indexer.upload_seconds  # uploads overlap, so this can exceed the wall time
+        self.index_requests = indexer.requests
+        print(f"✅ Uploaded {indexer.uploaded} embeddings to index in {indexer.requests} requests")
+
+    # === Run ===
+    def run(self):
+        started = time.perf_counter()
+        ocr_workers = self.settings["ocr_workers"]
+        embed_workers = self.settings["embed_workers"]
+
+        threads = start_stage(
+            "ocr", self.analyze, self.pdf_queue, self.page_queue, ocr_workers, 0, self.stats["ocr"], self.stop
+        )
+        threads += start_stage(
+            "embed", self.embed, self.page_queue, self.index_queue, embed_workers, 1, self.stats["embed"], self.stop
+        )
+        indexer = threading.Thread(target=self.index, name="index", daemon=True)
+        indexer.start()
+
+        try:
+            self.list_inputs()
+        finally:
+            for _ in range(ocr_workers):
+                self.pdf_queue.put(DONE)
+            # The listing also feeds the embed stage directly (resumed files), so its DONEs
+            # are only sent once the OCR workers have finished; the embed stage then
+            # signals the indexer itself
+            for thread in threads[:ocr_workers]:
+                thread.join()
+            for _ in range(embed_workers):
+                self.page_queue.put(DONE)
+            for thread in threads[ocr_workers:]:
+                thread.join()
+            indexer.join()
+            if self.dedupe is not None:
+                # Before the embed manifest, and published for the Chat page like step3.py does
+                self.dedupe.save()
+                self.publish_duplicates()
+            for manifest in (self.ocr_manifest, self.embed_manifest, self.index_manifest):
+                manifest.save()
+        if self.index_error is not None:
+            raise RuntimeError(f"Indexing failed, the pipeline stopped early: {self.index_error}") from self.index_error
+
+        elapsed = time.perf_counter() - started
+        return {
+            "elapsed_seconds": round(elapsed, 2),
+            "skipped": self.skipped,
+            "embedding_requests": self.embedder.requests,
+            "index_requests": self.index_requests,
+            "stages": {
+                name: {"items": s.items, "failed": s.failed, "busy_seconds": round(s.busy_seconds, 2)}
+                for name, s in self.stats.items()
+            },
+        }
+
+
+def settings_from_env(args):
+    return {
+        "dry_run": args.dry_run,
+        "doc_container_name": os.getenv("doc_container_name", "landing"),
+        "parsed_container_name": os.getenv("parsed_container_name", "parsed"),
+        "embeddings_container_name": os.getenv("embeddings_container_name", "embeddings"),
+        "deployment_name": os.getenv("deployment_name", "embeddings"),
+        "manifest_dir": os.getenv("manifest_dir", "data/manifests"),
+        "full_rebuild": os.getenv("full_rebuild", "false").lower() == "true",
+        "analyze_rate_limit": float(os.getenv("analyze_rate_limit", "0")),
+        "analyze_max_retries": int(os.getenv("analyze_max_retries", "5")),
+        "embedding_batch_size": int(os.getenv("embedding_batch_size", "64")),
+        "embedding_batch_tokens": int(os.getenv("embedding_batch_tokens", "100000")),
+        "embedding_concurrency": int(os.getenv("embedding_concurrency", "4")),
+        "embedding_format": os.getenv("embedding_format", "json"),
+        "chunk_max_tokens": int(os.getenv("chunk_max_tokens", "400")),
+        "chunk_overlap_tokens": int(os.getenv("chunk_overlap_tokens", "60")),
+        "near_duplicate_threshold": float(os.getenv("near_duplicate_threshold", "0.9")),
+        "ocr_workers": args.ocr_workers,
+        "embed_workers": args.embed_workers,
+        "queue_size": args.queue_size,
+        "index_batch_size": args.index_batch_size,
+        "index_batch_bytes": int(os.getenv("index_batch_bytes", "12000000")),
+        "index_concurrency": args.index_concurrency,
+    }
+
+
+def azure_services():
+    from openai import OpenAI
+    from azure.ai.formrecognizer import DocumentAnalysisClient
+    from azure.core.credentials import AzureKeyCredential
+    from azure.search.documents import SearchClient
+    from azure.storage.blob import BlobServiceClient
+
+    blob_service_client = BlobServiceClient.from_connection_string(os.getenv("blob_connection_string"))
+    document_client = DocumentAnalysisClient(os.getenv("endpoint"), AzureKeyCredential(os.getenv("key")))
+    openai_client = OpenAI(
+        api_key=os.getenv("openai_key"),
+        base_url=os.getenv("openai_endpoint"),
+        default_query={"api-version": "2023-05-15"},
+    )
+    search_client = SearchClient(
+        endpoint=os.getenv("search_endpoint"),
+        index_name=os.getenv("index_name"),
+        credential=AzureKeyCredential(os.getenv("search_key"))
+    )
+    return blob_service_client, document_client, openai_client, search_client
+
+
+def fake_services(args, settings):
+    from fakes import (
+        FakeBlobServiceClient, FakeDocumentAnalysisClient, FakeOpenAI, FakeSearchClient, seed_landing_container,
+    )
+
+    blob_service_client = FakeBlobServiceClient()
+    seed_landing_container(blob_service_client.get_container_client(settings["doc_container_name"]), args.dry_run_documents)
+    document_client = FakeDocumentAnalysisClient(pages_per_document=args.dry_run_pages, latency=args.fake_latency)
+    return blob_service_client, document_client, FakeOpenAI(latency=args.fake_latency / 10), FakeSearchClient()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run OCR, embedding and indexing as one concurrent pipeline")
+    parser.add_argument("--ocr-workers", type=int, default=8)
+    parser.add_argument("--embed-workers", type=int, default=2)
+    parser.add_argument("--queue-size", type=int, default=32, help="capacity of each queue between stages")
+    parser.add_argument("--index-batch-size", type=int, default=1000, help="documents per upload (also capped by index_batch_bytes)")
+    parser.add_argument("--index-concurrency", type=int, default=4, help="index uploads in flight")
+    parser.add_argument("--dry-run", action="store_true", help="use local fake services and a throwaway manifest")
+    parser.add_argument("--dry-run-documents", type=int, default=20)
+    parser.add_argument("--dry-run-pages", type=int, default=5)
+    parser.add_argument("--fake-latency", type=float, default=0.05, help="simulated seconds per OCR call in --dry-run")
+    args = parser.parse_args()
+
+    load_dotenv()
+    settings = settings_from_env(args)
+    if args.dry_run:
+        settings["manifest_dir"] = tempfile.mkdtemp(prefix="pipeline-dry-run-")
+        services = fake_services(args, settings)
+    else:
+        services = azure_services()
+        enable_jsonl(os.getenv("metrics_path", "data/metrics.jsonl"))  # dry runs stay out of the Metrics page
+
+    summary = Pipeline(*services, settings).run()
+    print(f"📊 {json.dumps(summary)}")
+    print("🎉 Pipeline finished!")
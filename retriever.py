@@ -0,0 +1,191 @@
+import json
+import os
+import time
+
+import numpy as np
+
+# Pluggable top-k retrieval for the Chat page.
+#
+# Every backend exposes `search(vector, k)` returning dicts with `text`, `source`, `page`
+# and `score` (higher is better), best first:
+#   - AzureSearchRetriever: the Azure AI Search vector index (network call)
+#   - BruteForceIndex: exact cosine search over an in-memory float32 matrix, for small corpora
+#   - IVFIndex: approximate search that only scans the `n_probe` closest k-means clusters,
+#     for large corpora
+# Local indexes are built from the embeddings step3.py produces and persisted to a directory.
+
+
+class AzureSearchRetriever:
+    kind = "azure"
+
+    def __init__(self, search_client, manifest_path=None):
+        # The index is rebuilt outside this process (step4.py, pipeline.py, jobs.py), so the
+        # version follows the index manifest they write after every upload
+        self.search_client = search_client
+        self.manifest_path = manifest_path or os.path.join(os.getenv("manifest_dir", "data/manifests"), "index.json")
+
+    @property
+    def version(self):
+        try:
+            stat = os.stat(self.manifest_path)
+        except OSError:
+            return "azure"
+        return f"azure:{stat.st_mtime_ns}:{stat.st_size}"
+
+    def search(self, vector, k=10):
+        results = self.search_client.search(
+            search_text=None,
+            vector_queries=[{
+                "vector": vector,
+                "k": k,
+                "fields": "embedding",
+                "kind": "vector"
+            }]
+        )
+        return [
+            {
+                "id": r.get("id"),
+                "text": r["text"],
+                "source": r.get("source", ""),
+                "page": r.get("page", 1),
+                "score": r["@search.score"],
+            }
+            for r in results
+        ]
+
+
+def _normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def _top_k(scores, k):
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.zeros(0, dtype=np.int64)
+    top = np.argpartition(-scores, k - 1)[:k]
+    return top[np.argsort(-scores[top])]
+
+
+class BruteForceIndex:
+    kind = "brute"
+
+    def __init__(self, vectors, rows, version=None):
+        self.vectors = _normalize(vectors)
+        self.rows = rows
+        self.version = version or str(time.time())
+
+    def _result(self, i, score):
+        row = self.rows[i]
+        return {
+            "text": row["text"], "source": row.get("source", ""), "page": row.get("page", 1),
+            "chunk": row.get("chunk"), "score": float(score),
+        }
+
+    def search(self, vector, k=10):
+        if not len(self.rows):
+            return []
+        scores = self.vectors @ _normalize(vector)
+        return [self._result(i, scores[i]) for i in _top_k(scores, k)]
+
+    def _arrays(self):
+        return {"vectors": self.vectors}
+
+    def save(self, path):
+        os.makedirs(path, exist_ok=True)
+        np.savez(os.path.join(path, "index.npz"), **self._arrays())
+        with open(os.path.join(path, "rows.json"), "w", encoding="utf-8") as f:
+            json.dump(self.rows, f, ensure_ascii=False)
+        with open(os.path.join(path, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump(self._meta(), f)
+
+    def _meta(self):
+        return {"kind": self.kind, "version": self.version, "count": len(self.rows)}
+
+    @classmethod
+    def _from_arrays(cls, arrays, rows, meta):
+        index = cls.__new__(cls)
+        index.vectors = arrays["vectors"]
+        index.rows = rows
+        index.version = meta["version"]
+        return index
+
+
+class IVFIndex(BruteForceIndex):
+    kind = "ivf"
+
+    def __init__(self, vectors, rows, n_lists=None, n_probe=8, iterations=10, sample_size=20000, seed=0, version=None):
+        super().__init__(vectors, rows, version=version)
+        n_lists = n_lists or max(1, int(np.sqrt(len(rows))))
+        self.n_probe = n_probe
+        self.centroids = self._kmeans(n_lists, iterations, sample_size, seed)
+        self.assignments = np.argmax(self.vectors @ self.centroids.T, axis=1) if len(rows) else np.zeros(0, dtype=np.int64)
+        self._build_lists()
+
+    def _kmeans(self, n_lists, iterations, sample_size, seed):
+        # Spherical k-means on a sample of the (already normalized) vectors
+        rng = np.random.default_rng(seed)
+        if not len(self.vectors):
+            return np.zeros((0, 0), dtype=np.float32)
+        sample = self.vectors[rng.choice(len(self.vectors), min(sample_size, len(self.vectors)), replace=False)]
+        n_lists = min(n_lists, len(sample))
+        centroids = sample[rng.choice(len(sample), n_lists, replace=False)].copy()
+        for _ in range(iterations):
+            labels = np.argmax(sample @ centroids.T, axis=1)
+            for c in range(n_lists):
+                members = sample[labels == c]
+                if len(members):
+                    centroids[c] = members.mean(axis=0)
+            centroids = _normalize(centroids)
+        return centroids
+
+    def _build_lists(self):
+        order = np.argsort(self.assignments, kind="stable")
+        bounds = np.searchsorted(self.assignments[order], np.arange(len(self.centroids) + 1))
+        self.lists = [order[bounds[c]:bounds[c + 1]] for c in range(len(self.centroids))]
+
+    def search(self, vector, k=10, n_probe=None):
+        if not len(self.rows):
+            return []
+        query = _normalize(vector)
+        probes = _top_k(self.centroids @ query, n_probe or self.n_probe)
+        candidates = np.concatenate([self.lists[c] for c in probes])
+        scores = self.vectors[candidates] @ query
+        return [self._result(candidates[i], scores[i]) for i in _top_k(scores, k)]
+
+    def _arrays(self):
+        return {"vectors": self.vectors, "centroids": self.centroids, "assignments": self.assignments}
+
+    def _meta(self):
+        return {**super()._meta(), "n_probe": self.n_probe}
+
+    @classmethod
+    def _from_arrays(cls, arrays, rows, meta):
+        index = super()._from_arrays(arrays, rows, meta)
+        index.centroids = arrays["centroids"]
+        index.assignments = arrays["assignments"]
+        index.n_probe = meta["n_probe"]
+        index._build_lists()
+        return index
+
+
+_index_classes = {cls.kind: cls for cls in (BruteForceIndex, IVFIndex)}
+
+
+def build_index(vectors, rows, kind="auto", ivf_threshold=50000, n_lists=None, n_probe=8):
+    # "auto" uses exact search for small corpora and IVF above ivf_threshold vectors
+    if kind == "auto":
+        kind = "ivf" if len(rows) >= ivf_threshold else "brute"
+    if kind == "ivf":
+        return IVFIndex(vectors, rows, n_lists=n_lists, n_probe=n_probe)
+    return BruteForceIndex(vectors, rows)
+
+
+def load_index(path):
+    with open(os.path.join(path, "meta.json"), "r", encoding="utf-8") as f:
+        meta = json.load(f)
+    with open(os.path.join(path, "rows.json"), "r", encoding="utf-8") as f:
+        rows = json.load(f)
+    arrays = np.load(os.path.join(path, "index.npz"))
+    return _index_classes[meta["kind"]]._from_arrays(arrays, rows, meta)
@@ -0,0 +1,198 @@
+import importlib
+import os
+import re
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+from metrics import registry
+
+# Process-wide services for the Streamlit pages.
+#
+# Streamlit re-executes a page script on every interaction, but imported modules stay
+# in sys.modules. Everything here therefore lives once per process: `.env` is read on
+# the first `env()` call, heavy SDKs (openai, azure.*, altair, pandas) are imported on
+# first use instead of at the top of every page, and clients are built once and shared
+# by every session. Each import and client construction is timed; `report()` lists
+# them and `python services.py` prints a cold import-time profile of the heavy modules.
+
+HEAVY_MODULES = (
+    "pandas",
+    "altair",
+    "numpy",
+    "openai",
+    "requests",
+    "azure.storage.blob",
+    "azure.search.documents",
+    "azure.ai.formrecognizer",
+)
+
+_lock = threading.RLock()
+_env_loaded = False
+_instances = {}
+_timings = []  # {"kind", "name", "seconds"} in the order they happened
+
+
+def _record(kind, name, seconds):
+    _timings.append({"kind": kind, "name": name, "seconds": round(seconds, 4)})
+    registry.observe(f"startup.{kind}", seconds, stage=name)
+
+
+# === Config ===
+def env(name, default=None):
+    global _env_loaded
+    if not _env_loaded:
+        with _lock:
+            if not _env_loaded:
+                from dotenv import load_dotenv
+
+                load_dotenv()
+                _env_loaded = True
+    return os.getenv(name, default)
+
+
+def env_flag(name, default="false"):
+    return env(name, default).lower() == "true"
+
+
+# === Lazy imports ===
+def lazy_module(name):
+    module = sys.modules.get(name)
+    if module is not None:
+        return module
+    # The import system serializes concurrent imports of the same module itself
+    started = time.perf_counter()
+    module = importlib.import_module(name)
+    _record("import", name, time.perf_counter() - started)
+    return module
+
+
+def shared(name, factory):
+    # factory() runs once per process; later calls return the same object
+    instance = _instances.get(name)
+    if instance is not None:
+        return instance
+    with _lock:
+        if name not in _instances:
+            started = time.perf_counter()
+            _instances[name] = factory()
+            _record("client", name, time.perf_counter() - started)
+    return _instances[name]
+
+
+def warm_up(modules=HEAVY_MODULES):
+    # Imports `modules` on a daemon thread so the first page switch finds them loaded
+    def run():
+        for name in modules:
+            try:
+                lazy_module(name)
+            except ImportError:
+                pass
+
+    with _lock:
+        if "warm_up" in _instances:
+            return
+        _instances["warm_up"] = threading.Thread(target=run, name="warm-up", daemon=True)
+    _instances["warm_up"].start()
+
+
+# === Clients ===
+def blob_service():
+    def build():
+        blob = lazy_module("azure.storage.blob")
+        return blob.BlobServiceClient.from_connection_string(env("blob_connection_string"))
+
+    return shared("blob_service", build)
+
+
+def openai_client():
+    def build():
+        openai = lazy_module("openai")
+        return openai.OpenAI(
+            api_key=env("openai_key"),
+            base_url=env("openai_endpoint"),
+            default_query={"api-version": "2023-05-15"}
+        )
+
+    return shared("openai", build)
+
+
+def search_client():
+    def build():
+        documents = lazy_module("azure.search.documents")
+        credentials = lazy_module("azure.core.credentials")
+        return documents.SearchClient(
+            endpoint=env("search_endpoint"),
+            index_name=env("index_name"),
+            credential=credentials.AzureKeyCredential(env("search_key"))
+        )
+
+    return shared("search", build)
+
+
+def document_client():
+    def build():
+        formrecognizer = lazy_module("azure.ai.formrecognizer")
+        credentials = lazy_module("azure.core.credentials")
+        return formrecognizer.DocumentAnalysisClient(env("endpoint"), credentials.AzureKeyCredential(env("key")))
+
+    return shared("document_intelligence", build)
+
+
+def http_session():
+    return shared("http_session", lambda: lazy_module("chat_client").make_session())
+
+
+def sas_url(container, blob_name, account_key, expiry_minutes=60):
+    # Read-only link to a blob, e.g. for source documents shown in Chat
+    blob = lazy_module("azure.storage.blob")
+    service = blob_service()
+    sas_token = blob.generate_blob_sas(
+        account_name=service.account_name,
+        container_name=container,
+        blob_name=blob_name,
+        account_key=account_key,
+        permission=blob.BlobSasPermissions(read=True),
+        expiry=datetime.now(timezone.utc) + timedelta(minutes=expiry_minutes)
+    )
+    return f"https://{service.account_name}.blob.core.windows.net/{container}/{blob_name}?{sas_token}"
+
+
+# === Profile ===
+def report():
+    # Imports and client constructions paid by this process, slowest first
+    return sorted(_timings, key=lambda timing: -timing["seconds"])
+
+
+_importtime_line = re.compile(r"import time:\s+(\d+)\s+\|\s+(\d+)\s+\|\s*(\S+)")
+
+
+def import_profile(modules=HEAVY_MODULES):
+    # Cold import cost of each module, measured in a fresh interpreter with -X importtime
+    profile = []
+    for name in modules:
+        started = time.perf_counter()
+        completed = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", f"import {name}"],
+            capture_output=True, text=True
+        )
+        wall = time.perf_counter() - started
+        if completed.returncode != 0:
+            profile.append({"module": name, "seconds": None, "wall_s": round(wall, 3), "error": "not installed"})
+            continue
+        cumulative = 0
+        for line in completed.stderr.splitlines():
+            match = _importtime_line.match(line)
+            if match and match.group(3) == name:
+                cumulative = int(match.group(2))
+        profile.append({"module": name, "seconds": round(cumulative / 1e6, 3), "wall_s": round(wall, 3), "error": None})
+    return sorted(profile, key=lambda entry: -(entry["seconds"] or 0))
+
+
+if __name__ == "__main__":
+    print(f"{'module':<28}{'import s':>10}{'process s':>11}")
+    for entry in import_profile():
+        seconds = "-" if entry["seconds"] is None else f"{entry['seconds']:.3f}"
+        print(f"{entry['module']:<28}{seconds:>10}{entry['wall_s']:>11.3f}  {entry['error'] or ''}")
@@ -3,6 +3,12 @@ import json
 from openai import OpenAI
 from azure.storage.blob import BlobServiceClient
 from dotenv import load_dotenv
+from manifest import Manifest, blob_fingerprint
+from embedder import BatchEmbedder
+from embedding_store import write_shard, DUPLICATES_BLOB
+from chunking import chunk_page
+from dedupe import NearDuplicateIndex
+from metrics import registry, enable_jsonl
 
 # Load environment variables
 load_dotenv()
@@ -16,6 +22,33 @@ blob_connection_string = os.getenv("blob_connection_string")
 parsed_container_name = os.getenv("parsed_container_name")
 embedding_container_name = os.getenv("embeddings_container_name")
 
+# Set full_rebuild=true to ignore the manifest and re-embed every parsed file
+full_rebuild = os.getenv("full_rebuild", "false").lower() == "true"
+
+# "json" (one blob per page) or "npy" (one float32 matrix + metadata blob per document)
+embedding_format = os.getenv("embedding_format", "json")
+
+# Inputs / tokens per embeddings request, requests in flight, and how many pages
+# (across files) are collected before a round of batched requests is sent
+embedding_batch_size = int(os.getenv("embedding_batch_size", "64"))
+embedding_batch_tokens = int(os.getenv("embedding_batch_tokens", "100000"))
+embedding_concurrency = int(os.getenv("embedding_concurrency", "4"))
+embedding_wave_pages = int(os.getenv("embedding_wave_pages", "2000"))
+
+# Pages are split into line-aware chunks of at most chunk_max_tokens, each repeating the
+# last chunk_overlap_tokens of the previous one. chunk_max_tokens=0 embeds whole pages.
+chunk_max_tokens = int(os.getenv("chunk_max_tokens", "400"))
+chunk_overlap_tokens = int(os.getenv("chunk_overlap_tokens", "60"))
+
+# Chunks whose estimated similarity to an already embedded chunk reaches
+# near_duplicate_threshold are not embedded again; they are published as extra
+# (source, page) references of that chunk in _duplicates.json. 0 disables it.
+near_duplicate_threshold = float(os.getenv("near_duplicate_threshold", "0.9"))
+manifest_dir = os.getenv("manifest_dir", "data/manifests")
+
+# Timings and counters are appended here for the Metrics page
+enable_jsonl(os.getenv("metrics_path", "data/metrics.jsonl"))
+
 # === INIT CLIENTS ===
 openai_client = OpenAI(
     api_key=openai_key,
@@ -27,39 +60,170 @@ blob_service_client = BlobServiceClient.from_connection_string(blob_connection_s
 parsed_container_client = blob_service_client.get_container_client(parsed_container_name)
 embedding_container_client = blob_service_client.get_container_client(embedding_container_name)
 
-# === PROCESS EACH JSON FILE ===
+embedder = BatchEmbedder(
+    openai_client,
+    deployment_name,
+    max_inputs=embedding_batch_size,
+    max_batch_tokens=embedding_batch_tokens,
+    concurrency=embedding_concurrency,
+)
+
+# Saved together with dedupe.json after every wave (dedupe.json first), never on its own
+manifest = Manifest("embed", full_rebuild=full_rebuild, autosave_every=0 if near_duplicate_threshold > 0 else 25)
+dedupe = None
+if near_duplicate_threshold > 0:
+    dedupe = NearDuplicateIndex(
+        os.path.join(manifest_dir, "dedupe.json"), threshold=near_duplicate_threshold, full_rebuild=full_rebuild
+    )
+seen_blobs = set()
+skipped = 0
+
+def release(name):
+    # Files that referenced chunks of `name` are re-embedded on the next run
+    if dedupe is None:
+        return set()
+    dependants = dedupe.release(name)
+    for dependant in dependants:
+        manifest.forget(dependant)
+        print(f"↩️ {dependant} referenced chunks of {name}; it will be re-embedded next run")
+    return dependants
+
+# === EMBED A WAVE OF FILES AND UPLOAD THEIR CHUNKS ===
+def flush(files):
+    # Near-duplicates of chunks embedded earlier (in this run or before) only get a reference
+    duplicates = {}
+    items = []
+    for name, _, chunks in files:
+        if dedupe is not None:
+            chunks, file_duplicates = dedupe.collapse(name, chunks)
+            duplicates.update({(name, *key): canonical for key, canonical in file_duplicates.items()})
+        items.extend(((name, chunk["page"], chunk["chunk"]), chunk["text"]) for chunk in chunks)
+
+    with registry.timer("embed.wave"):
+        embeddings, failed = embedder.embed(items)
+    registry.increment("embed.chunks", len(embeddings))
+    registry.increment("embed.failed", len(failed))
+    registry.increment("embed.duplicates", len(duplicates))
+
+    # A file with failed chunks is retried next run, together with the files referencing its chunks
+    retry = {key[0] for key in failed}
+    for name in list(retry):
+        retry |= release(name)
+
+    for name, fingerprint, chunks in files:
+        written = []
+        rows = []
+        vectors = []
+        for chunk in chunks:
+            key = (name, chunk["page"], chunk["chunk"])
+            if key in duplicates:
+                continue
+            embedding = embeddings.get(key)
+            if embedding is None:
+                print(f"❌ Failed to embed page {chunk['page']} chunk {chunk['chunk']} of {name}: {failed.get(key)}")
+                continue
+
+            output = {
+                "embedding": embedding,
+                "text": chunk["text"],
+                "source": name,
+                "page": chunk["page"],
+                "chunk": chunk["chunk"],
+                "offset": chunk["offset"]
+            }
+
+            if embedding_format == "npy":
+                # Collected into one float32 shard per document below
+                rows.append({field: value for field, value in output.items() if field != "embedding"})
+                vectors.append(embedding)
+                continue
+
+            json_blob_name = name.replace(".json", f".page{chunk['page']}.chunk{chunk['chunk']}.embedding.json")
+            with registry.timer("blob.upload", stage="embed"):
+                embedding_container_client.upload_blob(
+                    name=json_blob_name,
+                    data=json.dumps(output),
+                    overwrite=True
+                )
+
+            written.append(json_blob_name)
+            print(f"✅ Embedded page {chunk['page']} chunk {chunk['chunk']} of {name} → {json_blob_name}")
+
+        if name in retry:
+            continue  # leave the file out of the manifest so failed chunks are retried next run
+
+        if rows:
+            with registry.timer("blob.upload", stage="embed"):
+                written = write_shard(embedding_container_client, name, rows, vectors)
+            print(f"✅ Embedded {len(rows)} chunks of {name} → {written[0]}")
+
+        # Drop embeddings for chunks that no longer exist in the changed file
+        for old_blob_name in set(manifest.outputs(name)) - set(written):
+            embedding_container_client.delete_blob(old_blob_name)
+            print(f"🗑️ Removed stale embedding {old_blob_name}")
+
+        file_duplicates = sum(1 for key in duplicates if key[0] == name)
+        if file_duplicates:
+            print(f"♻️ {file_duplicates} chunks of {name} duplicate already embedded chunks")
+        manifest.record(name, fingerprint, outputs=written, duplicates=file_duplicates)
+
+    # A manifest entry never outlives the dedupe state it relies on
+    if dedupe is not None:
+        dedupe.save()
+        manifest.save()
+
+# === PROCESS EACH NEW OR CHANGED JSON FILE ===
+wave = []
+wave_pages = 0
+
 for blob in parsed_container_client.list_blobs():
     if not blob.name.endswith(".json"):
         continue
 
-    blob_data = parsed_container_client.download_blob(blob.name).readall()
-    pages = json.loads(blob_data)
-
-    for page in pages:
-        page_text = page["text"]
-        if not page_text.strip():
-            continue  # skip empty pages
-
-        response = openai_client.embeddings.create(
-            model=deployment_name,
-            input=[page_text]
-        )
-        embedding = response.data[0].embedding
-
-        output = {
-            "embedding": embedding,
-            "text": page_text,
-            "source": blob.name,
-            "page": page["page"]
-        }
-
-        json_blob_name = blob.name.replace(".json", f".page{page['page']}.embedding.json")
-        embedding_container_client.upload_blob(
-            name=json_blob_name,
-            data=json.dumps(output),
-            overwrite=True
-        )
-
-        print(f"✅ Embedded page {page['page']} of {blob.name} → {json_blob_name}")
+    seen_blobs.add(blob.name)
+    fingerprint = blob_fingerprint(blob)
+    if manifest.is_current(blob.name, fingerprint):
+        skipped += 1
+        continue
+
+    release(blob.name)  # its chunks are about to be re-embedded
+
+    with registry.timer("blob.download", stage="embed"):
+        blob_data = parsed_container_client.download_blob(blob.name).readall()
+    pages = [page for page in json.loads(blob_data) if page["text"].strip()]  # skip empty pages
+    chunks = [
+        {"page": page["page"], **chunk}
+        for page in pages
+        for chunk in chunk_page(page, chunk_max_tokens, chunk_overlap_tokens)
+    ]
+
+    wave.append((blob.name, fingerprint, chunks))
+    wave_pages += len(pages)
+    if wave_pages >= embedding_wave_pages:
+        flush(wave)
+        wave = []
+        wave_pages = 0
+
+if wave:
+    flush(wave)
+
+# === Remove embeddings of parsed files that were deleted ===
+for name in manifest.stale(seen_blobs):
+    for old_blob_name in manifest.outputs(name):
+        embedding_container_client.delete_blob(old_blob_name)
+        print(f"🗑️ Removed stale embedding {old_blob_name}")
+    manifest.forget(name)
+    release(name)
+
+# === Publish which pages each kept chunk also stands for ===
+if dedupe is not None:
+    embedding_container_client.upload_blob(
+        name=DUPLICATES_BLOB, data=json.dumps(dedupe.duplicates_by_chunk()), overwrite=True
+    )
+    dedupe.save()
+
+manifest.save()
+print(f"⏭️ Skipped {skipped} unchanged files")
+print(f"📊 {embedder.requests} embedding requests, {embedder.tokens} tokens, {embedder.retries} retries")
 
 print("🎉 All embeddings generated and uploaded!")
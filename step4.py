@@ -1,10 +1,13 @@
 import os
 import json
-import uuid
 from azure.core.credentials import AzureKeyCredential
 from azure.search.documents import SearchClient
 from azure.storage.blob import BlobServiceClient
 from dotenv import load_dotenv
+from manifest import Manifest, blob_fingerprint, document_id
+from embedding_store import VECTORS_SUFFIX, sync_shards, load_shard
+from metrics import registry, enable_jsonl
+from indexer import SearchIndexer, prefetch
 
 # === Load environment variables
 load_dotenv()
@@ -17,6 +20,22 @@ index_name = os.getenv("index_name")
 blob_connection_string = os.getenv("blob_connection_string")
 embedding_container_name = os.getenv("embeddings_container_name")
 
+# Set full_rebuild=true to ignore the manifest and re-upload every embedding
+full_rebuild = os.getenv("full_rebuild", "false").lower() == "true"
+
+# "json" (one blob per page) or "npy" (one float32 matrix + metadata blob per document)
+embedding_format = os.getenv("embedding_format", "json")
+embedding_cache_dir = os.getenv("embedding_cache_dir", "data/embeddings")
+
+# Batches are packed up to index_batch_bytes of JSON (the service limit is 16 MB),
+# index_concurrency uploads are kept in flight and index_prefetch blobs are read ahead
+index_batch_bytes = int(os.getenv("index_batch_bytes", "12000000"))
+index_concurrency = int(os.getenv("index_concurrency", "4"))
+index_prefetch = int(os.getenv("index_prefetch", "16"))
+
+# Timings and counters are appended here for the Metrics page
+enable_jsonl(os.getenv("metrics_path", "data/metrics.jsonl"))
+
 # === Init clients
 search_client = SearchClient(
     endpoint=search_endpoint,
@@ -27,35 +46,110 @@ search_client = SearchClient(
 blob_service_client = BlobServiceClient.from_connection_string(blob_connection_string)
 embedding_container_client = blob_service_client.get_container_client(embedding_container_name)
 
-# === Loop through each embedding file
-documents_to_upload = []
+manifest = Manifest("index", full_rebuild=full_rebuild)
+seen_blobs = set()
+skipped = 0
 
-for blob in embedding_container_client.list_blobs():
-    if not blob.name.endswith(".embedding.json"):
-        continue
+# === Read the search documents held by one embedding blob
+def read_documents(blob_name):
+    if blob_name.endswith(VECTORS_SUFFIX):
+        vectors, rows = load_shard(shard_paths[blob_name])  # memory-mapped float32 matrix
+        for vector, row in zip(vectors, rows):
+            yield {
+                "id": document_id(row["source"], row["page"], row.get("chunk")),  # Deterministic ID so re-runs are upserts
+                "text": row["text"],
+                "source": row["source"],
+                "page": row["page"],
+                "embedding": vector.tolist()
+            }
+        return
 
-    blob_data = embedding_container_client.download_blob(blob.name).readall()
+    with registry.timer("blob.download", stage="index"):
+        blob_data = embedding_container_client.download_blob(blob_name).readall()
     data = json.loads(blob_data)
-
-    document = {
-        "id": str(uuid.uuid4()),  # Unique ID for index
+    yield {
+        "id": document_id(data["source"], data["page"], data.get("chunk")),  # Deterministic ID so re-runs are upserts
         "text": data["text"],
         "source": data["source"],
         "page": data["page"],
         "embedding": data["embedding"]
     }
 
-    documents_to_upload.append(document)
+# === Mark a blob as indexed once all of its documents are uploaded
+fingerprints = {}  # blob name -> fingerprint, until the blob is indexed
+document_ids = {}  # blob name -> ids of its documents
+
+def finish(name, failed):
+    fingerprint = fingerprints.pop(name)
+    ids = document_ids.pop(name)
+    if failed:
+        # Left out of the manifest so the blob is retried next run
+        print(f"❌ {len(failed)} documents of {name} were not indexed: {next(iter(failed.values()))}")
+        return
+    removed = set(manifest.outputs(name)) - set(ids)
+    if removed:
+        search_client.delete_documents(documents=[{"id": doc_id} for doc_id in removed])
+    manifest.record(name, fingerprint, outputs=ids)
+
+indexer = SearchIndexer(
+    search_client,
+    max_batch_bytes=index_batch_bytes,
+    concurrency=index_concurrency,
+    on_group_done=finish,
+)
+
+# === Loop through each new or changed embedding file
+if embedding_format == "npy":
+    # Mirror changed shards locally so they can be memory-mapped
+    shard_paths = {
+        os.path.relpath(path, embedding_cache_dir).replace(os.sep, "/"): path
+        for path in sync_shards(embedding_container_client, embedding_cache_dir)
+    }
+    suffix = VECTORS_SUFFIX
+else:
+    suffix = ".embedding.json"
+
+def changed_blobs():
+    global skipped
+    for blob in embedding_container_client.list_blobs():
+        if not blob.name.endswith(suffix):
+            continue
+
+        seen_blobs.add(blob.name)
+        fingerprint = blob_fingerprint(blob)
+        if manifest.is_current(blob.name, fingerprint):
+            skipped += 1
+            continue
+
+        fingerprints[blob.name] = fingerprint
+        yield blob.name
+
+# Blobs are downloaded concurrently while earlier batches upload
+for blob_name, documents in prefetch(lambda name: list(read_documents(name)), changed_blobs(), index_prefetch):
+    if isinstance(documents, Exception):
+        fingerprints.pop(blob_name)
+        print(f"❌ Failed to read {blob_name}: {documents}")
+        continue
+    document_ids[blob_name] = [document["id"] for document in documents]
+    indexer.add_group(blob_name, documents)
+
+indexer.close()
+print(f"✅ Uploaded {indexer.uploaded} embeddings to index in {indexer.requests} requests "
+      f"({indexer.failed} failed, {indexer.retries} retries)")
 
-    # Upload in batches of 100
-    if len(documents_to_upload) == 100:
-        search_client.upload_documents(documents=documents_to_upload)
-        print(f"✅ Uploaded 100 embeddings to index")
-        documents_to_upload = []
+# === Remove index entries whose embedding blob was deleted
+stale_ids = set()
+for name in manifest.stale(seen_blobs):
+    stale_ids.update(manifest.outputs(name))
+    manifest.forget(name)
+# Ids re-uploaded from another blob (e.g. after switching embedding_format) stay in the index
+for name in seen_blobs:
+    stale_ids.difference_update(manifest.outputs(name))
+if stale_ids:
+    search_client.delete_documents(documents=[{"id": doc_id} for doc_id in stale_ids])
+    print(f"🗑️ Removed {len(stale_ids)} stale documents from index")
 
-# Upload remaining documents
-if documents_to_upload:
-    search_client.upload_documents(documents=documents_to_upload)
-    print(f"✅ Uploaded final {len(documents_to_upload)} embeddings to index")
+manifest.save()
+print(f"⏭️ Skipped {skipped} unchanged embeddings")
 
 print("🎉 All documents uploaded to Azure AI Search index!")
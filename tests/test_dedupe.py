@@ -0,0 +1,127 @@
+import json
+import types
+
+import pytest
+
+pytest.importorskip("numpy")
+pytest.importorskip("dotenv")
+
+from dedupe import NearDuplicateIndex
+from embedding_store import DUPLICATES_BLOB
+from fakes import FakeBlobServiceClient, FakeOpenAI, FakeSearchClient
+from manifest import document_id
+from pipeline import Pipeline
+
+from test_pipeline import make_settings
+
+BOILERPLATE = (
+    "This report contains forward looking statements that involve risks and uncertainties. "
+    "Actual results may differ materially from those expressed or implied in these statements."
+)
+
+
+def chunks(*texts):
+    return [{"page": page, "chunk": 0, "text": text} for page, text in enumerate(texts, start=1)]
+
+
+class BoilerplateAnalyzer:
+    # Every document gets the same disclaimer page plus one page of its own
+    def begin_analyze_document_from_url(self, model_id, url):
+        name = url.split("/")[-1]
+        pages = [
+            types.SimpleNamespace(page_number=1, lines=[types.SimpleNamespace(content=BOILERPLATE)]),
+            types.SimpleNamespace(
+                page_number=2, lines=[types.SimpleNamespace(content=f"Revenue of {name} grew in every segment this year.")]
+            ),
+        ]
+        return types.SimpleNamespace(result=lambda: types.SimpleNamespace(pages=pages))
+
+
+def test_collapse_keeps_one_canonical_and_release_returns_dependants():
+    dedupe = NearDuplicateIndex(threshold=0.8)
+    unique, duplicates = dedupe.collapse("a.json", chunks(BOILERPLATE, "Revenue grew by a third"))
+    assert len(unique) == 2 and not duplicates
+
+    unique, duplicates = dedupe.collapse("b.json", chunks(BOILERPLATE, "Net profit fell sharply"))
+    assert [chunk["text"] for chunk in unique] == ["Net profit fell sharply"]
+    assert duplicates == {(1, 0): document_id("a.json", 1, 0)}
+    assert dedupe.duplicates_by_chunk() == {document_id("a.json", 1, 0): [["b.json", 1]]}
+
+    # b's reference dies with a's canonical, so b has to be embedded again
+    assert dedupe.release("a.json") == {"b.json"}
+    assert dedupe.duplicates_by_chunk() == {}
+
+
+def test_state_round_trips_through_dedupe_json(tmp_path):
+    path = str(tmp_path / "dedupe.json")
+    dedupe = NearDuplicateIndex(path, threshold=0.8)
+    dedupe.collapse("a.json", chunks(BOILERPLATE))
+    dedupe.collapse("b.json", chunks(BOILERPLATE))
+    dedupe.save()
+
+    reloaded = NearDuplicateIndex(path, threshold=0.8)
+    assert reloaded.duplicates_by_chunk() == dedupe.duplicates_by_chunk()
+    unique, duplicates = reloaded.collapse("c.json", chunks(BOILERPLATE))
+    assert not unique and list(duplicates.values()) == [document_id("a.json", 1, 0)]
+
+
+def run_pipeline(blob_service, settings):
+    pipeline = Pipeline(blob_service, BoilerplateAnalyzer(), FakeOpenAI(dimensions=16), FakeSearchClient(), settings)
+    return pipeline, pipeline.run()
+
+
+@pytest.fixture
+def blob_service():
+    blob_service = FakeBlobServiceClient()
+    landing = blob_service.get_container_client("landing")
+    for name in ("a.pdf", "b.pdf", "c.pdf"):
+        landing.upload_blob(name=name, data=name.encode("utf-8"), overwrite=True)
+    return blob_service
+
+
+def test_pipeline_embeds_boilerplate_once_and_publishes_duplicates(blob_service, tmp_path):
+    settings = make_settings(tmp_path)
+    settings["near_duplicate_threshold"] = 0.8
+    pipeline, summary = run_pipeline(blob_service, settings)
+
+    embedded = [
+        name for name in blob_service.get_container_client("embeddings").blobs if name.endswith(".embedding.json")
+    ]
+    assert len(embedded) == 4  # one disclaimer + three revenue pages
+    assert sum(entry.get("duplicates", 0) for entry in pipeline.embed_manifest.entries.values()) == 2
+
+    published = json.loads(blob_service.get_container_client("embeddings").download_blob(DUPLICATES_BLOB).readall())
+    (canonical, pages), = published.items()
+    assert len(pages) == 2
+    assert canonical in {document_id(f"{name}.json", 1, 0) for name in "abc"}
+
+    # dedupe.json was saved with the manifest, so a second run has nothing to do
+    _, second = run_pipeline(blob_service, settings)
+    assert second["skipped"] == 3
+
+
+def test_job_workers_share_the_dedupe_state(blob_service, tmp_path):
+    pytest.importorskip("pandas")
+    from jobs import Ingestion
+
+    settings = make_settings(tmp_path)
+    settings["near_duplicate_threshold"] = 0.8
+    services = (blob_service, BoilerplateAnalyzer(), FakeOpenAI(dimensions=16), FakeSearchClient())
+    ingestion = Ingestion(*services, settings, entity_store=None)
+
+    payloads = []
+    for name in ("a.pdf", "b.pdf"):
+        pipeline = ingestion.pipeline()
+        emitted = []
+        pipeline.analyze((name, name, pipeline.blob_url(name)), emitted.append)
+        parsed_name, parsed_etag, _ = emitted[0]
+        payloads.append(ingestion.embed({"parsed_name": parsed_name, "parsed_etag": parsed_etag}))
+
+    # Each job ran in its own Pipeline, but the second still found the first one's disclaimer
+    assert [len(payload["embeddings"]) for payload in payloads] == [2, 1]
+    published = json.loads(blob_service.get_container_client("embeddings").download_blob(DUPLICATES_BLOB).readall())
+    assert published == {document_id("a.json", 1, 0): [["b.json", 1]]}
+
+    # and step3.py / pipeline.py see the same state
+    reloaded = NearDuplicateIndex(str(tmp_path / "dedupe.json"), threshold=0.8)
+    assert reloaded.duplicates_by_chunk() == published
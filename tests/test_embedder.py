@@ -0,0 +1,51 @@
+import types
+
+from embedder import BatchEmbedder, count_tokens, pack_batches
+from fakes import FakeHttpError, FakeOpenAI
+
+
+def test_pack_batches_respects_input_count_and_token_budget():
+    items = [(i, "word " * 40) for i in range(10)]
+    tokens = count_tokens("word " * 40)
+
+    batches = list(pack_batches(items, max_inputs=4, max_batch_tokens=10 ** 6))
+    assert [len(batch) for batch in batches] == [4, 4, 2]
+
+    batches = list(pack_batches(items, max_inputs=64, max_batch_tokens=tokens * 3))
+    assert [len(batch) for batch in batches] == [3, 3, 3, 1]
+    assert all(sum(t for _, _, t in batch) <= tokens * 3 for batch in batches)
+    assert [key for batch in batches for key, _, _ in batch] == list(range(10))
+
+
+def test_pack_batches_truncates_long_inputs():
+    (batch,) = pack_batches([("long", "word " * 5000)], max_input_tokens=100)
+    assert batch[0][2] <= 100
+
+
+class RejectingEmbeddings:
+    # Fails any request containing a "bad" input, and throttles the first request
+    def __init__(self):
+        self.inner = FakeOpenAI().embeddings
+        self.calls = 0
+
+    def create(self, model, input):
+        self.calls += 1
+        if self.calls == 1:
+            raise FakeHttpError(429, retry_after=0)
+        if any("bad" in text for text in input):
+            raise ValueError("invalid input")
+        return self.inner.create(model, input)
+
+
+def test_batch_embedder_retries_throttling_and_isolates_bad_inputs():
+    client = types.SimpleNamespace(embeddings=RejectingEmbeddings())
+    embedder = BatchEmbedder(client, "model", max_inputs=8, concurrency=1, base_delay=0)
+    items = [(i, f"page {i} text") for i in range(7)] + [(7, "bad input")]
+
+    embeddings, failed = embedder.embed(items)
+
+    assert sorted(embeddings) == list(range(7))
+    assert list(failed) == [7]
+    # Only the batch with the bad input was split: 1 throttled + 1 rejected request, then halves
+    assert embedder.retries >= 2
+    assert embedder.requests == 3
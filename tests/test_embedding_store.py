@@ -0,0 +1,41 @@
+import os
+
+import pytest
+
+pytest.importorskip("numpy")
+
+from embedding_store import iter_shards, load_shard, sync_shards, write_shard
+from fakes import FakeContainerClient
+
+
+def shard_rows(source, count):
+    return [{"source": source, "page": page, "chunk": 0, "text": f"{source} page {page}"} for page in range(1, count + 1)]
+
+
+def test_sync_shards_downloads_changes_and_prunes_deleted_documents(tmp_path):
+    container = FakeContainerClient("embeddings")
+    cache_dir = str(tmp_path / "cache")
+    write_shard(container, "reports/a.json", shard_rows("reports/a.json", 2), [[1.0, 0.0], [0.0, 1.0]])
+    write_shard(container, "b.json", shard_rows("b.json", 1), [[0.5, 0.5]])
+
+    paths = sorted(sync_shards(container, cache_dir))
+    assert [os.path.relpath(path, cache_dir).replace(os.sep, "/") for path in paths] == [
+        "b.vectors.npy",
+        "reports/a.vectors.npy",
+    ]
+    vectors, rows = load_shard(paths[1])
+    assert vectors.shape == (2, 2)
+    assert [row["page"] for row in rows] == [1, 2]
+
+    # b.json was deleted upstream and a.json changed
+    container.delete_blob("b.vectors.npy")
+    container.delete_blob("b.meta.json")
+    write_shard(container, "reports/a.json", shard_rows("reports/a.json", 1), [[1.0, 1.0]])
+
+    paths = sync_shards(container, cache_dir)
+    assert len(paths) == 1
+    assert not os.path.exists(os.path.join(cache_dir, "b.vectors.npy"))
+    assert not os.path.exists(os.path.join(cache_dir, "b.meta.json"))
+    shards = list(iter_shards(cache_dir))
+    assert len(shards) == 1
+    assert shards[0][0].tolist() == [[1.0, 1.0]]
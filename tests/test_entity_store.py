@@ -0,0 +1,98 @@
+import pytest
+
+pytest.importorskip("pandas")
+
+from entity_store import CSVBackend, EntityStore, ParquetBackend, SQLiteBackend
+
+
+def backend_params():
+    params = [pytest.param((CSVBackend, "entities.csv"), id="csv"), pytest.param((SQLiteBackend, "entities.sqlite"), id="sqlite")]
+    try:
+        import pyarrow  # noqa: F401
+        params.append(pytest.param((ParquetBackend, "entities.parquet"), id="parquet"))
+    except ImportError:
+        pass
+    return params
+
+
+def rows(document, *values):
+    return [
+        {"Document": document, "Company": "Acme", "Year": 2023, "Key": f"Metric {i}", "Value": value, "Page": 1, "Confidence": 0.95}
+        for i, value in enumerate(values)
+    ]
+
+
+class RecordingListener:
+    def __init__(self):
+        self.appended = []
+        self.invalidated = 0
+
+    def on_append(self, df, version_before, version_after):
+        self.appended.append(len(df))
+
+    def invalidate(self):
+        self.invalidated += 1
+
+
+@pytest.fixture(params=backend_params())
+def store(request, tmp_path):
+    backend_class, name = request.param
+    return EntityStore(backend_class(str(tmp_path / name)), compact_every=3)
+
+
+def test_append_and_update_by_entity_id(store):
+    store.append(rows("a.pdf", 1.0, 2.0))
+    entity_id = store.read()["EntityId"].iloc[0]
+    store.update({entity_id: {"Value": 10.0}})
+
+    df = store.read()
+    assert len(df) == 2
+    assert df.set_index("EntityId").loc[entity_id, "Value"] == 10.0
+
+
+def test_replace_document_swaps_only_that_documents_rows(store):
+    listener = RecordingListener()
+    store.listeners.append(listener)
+
+    store.replace_document("a.pdf", rows("a.pdf", 1.0, 2.0))
+    store.replace_document("b.pdf", rows("b.pdf", 3.0))
+    # A new document is appended, which the listener can fold in incrementally
+    assert listener.appended == [2, 1]
+    assert listener.invalidated == 0
+
+    # Re-processing (or retrying) a document never duplicates its entities
+    store.replace_document("a.pdf", rows("a.pdf", 5.0))
+    store.replace_document("a.pdf", rows("a.pdf", 5.0))
+    assert listener.invalidated == 2
+
+    df = store.read()
+    assert sorted(df["Value"].tolist()) == [3.0, 5.0]
+    assert df[df["Document"] == "b.pdf"]["Value"].tolist() == [3.0]
+    assert sorted(chunk_value for chunk in store.iter_chunks() for chunk_value in chunk["Value"]) == [3.0, 5.0]
+
+
+def test_replaced_rows_stay_deleted_after_compaction(store):
+    store.replace_document("a.pdf", rows("a.pdf", 1.0, 2.0))
+    store.replace_document("b.pdf", rows("b.pdf", 3.0))
+    store.replace_document("a.pdf", rows("a.pdf", 4.0))
+    store.compact()
+
+    df = store.read()
+    assert sorted(df["Value"].tolist()) == [3.0, 4.0]
+    if store.changes:
+        assert store.changes.read() == []
+
+
+def test_sqlite_indexes_are_created_with_the_table(tmp_path):
+    import sqlite3
+
+    store = EntityStore(SQLiteBackend(str(tmp_path / "entities.sqlite")))
+    store.append(rows("a.pdf", 1.0))
+    store.append(rows("b.pdf", 2.0))
+    conn = sqlite3.connect(store.backend.path)
+    try:
+        indexes = {name for (name,) in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+    finally:
+        conn.close()
+    assert {"entities_id", "entities_document", "entities_confidence"} <= indexes
+    assert len(store.read()) == 2
@@ -0,0 +1,33 @@
+from extraction import _header_years, extract_document, extract_page, parse_value
+
+
+def test_header_years_ignore_currency_unit_and_notes_words():
+    assert _header_years(["AED million Notes 2023 2022"]) == [2023, 2022]
+    assert _header_years(["US$'000 Note 2023 2022"]) == [2023, 2022]
+    assert _header_years(["In 2023 revenue grew compared with 2022 levels"]) is None
+
+
+def test_note_column_is_not_taken_as_the_value():
+    page = {"page": 4, "lines": ["AED million Notes 2023 2022", "Revenue 5 4,034 3,812", "Net profit 6 (120) 95"]}
+    rows = {row["Key"]: row for row in extract_page(page, year=2022)}
+    assert rows["Revenue"]["Value"] == 3812.0
+    assert rows["Revenue"]["Year"] == 2022
+    assert rows["Revenue"]["Confidence"] == 0.95
+    assert rows["Net Profit"]["Value"] == 95.0
+
+
+def test_note_column_without_headers():
+    rows = extract_page({"page": 1, "lines": ["Revenue 5 4,034 3,812"]}, year=2023)
+    assert [(row["Value"], row["Confidence"]) for row in rows] == [(4034.0, 0.88)]
+
+
+def test_prose_amounts_are_scaled_to_millions():
+    pages = [{"page": 1, "text": "Revenue increased to AED 4.2 billion in the year ended 31 December 2023."}]
+    rows = extract_document("Acme_2023.pdf", pages)
+    assert [(row["Company"], row["Year"], row["Key"], row["Value"]) for row in rows] == [("Acme", 2023, "Revenue", 4200.0)]
+
+
+def test_parse_value():
+    assert parse_value("(12.5)") == -12.5
+    assert parse_value("4.0bn") == 4000.0
+    assert parse_value("12%") is None
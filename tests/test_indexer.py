@@ -0,0 +1,75 @@
+from fakes import FakeHttpError, FakeIndexingResult, FakeSearchClient
+from indexer import SearchIndexer, payload_size
+
+
+def documents(owner, count, text="x" * 200):
+    return [{"id": f"{owner}-{i}", "content": text} for i in range(count)]
+
+
+class RecordingSearchClient(FakeSearchClient):
+    # Records batch sizes, rejects requests over `max_request_bytes` with 413 and fails
+    # the documents in `transient` once with a 503 result
+    def __init__(self, max_request_bytes=None, transient=(), permanent=()):
+        super().__init__()
+        self.max_request_bytes = max_request_bytes
+        self.transient = set(transient)
+        self.permanent = set(permanent)
+        self.batches = []
+
+    def upload_documents(self, documents):
+        if self.max_request_bytes and sum(payload_size(d) for d in documents) > self.max_request_bytes:
+            raise FakeHttpError(413)
+        self.batches.append(len(documents))
+        results = []
+        for document in documents:
+            if document["id"] in self.transient:
+                self.transient.discard(document["id"])
+                results.append(FakeIndexingResult(document["id"], succeeded=False, status_code=503, error_message="busy"))
+            elif document["id"] in self.permanent:
+                results.append(FakeIndexingResult(document["id"], succeeded=False, status_code=400, error_message="bad"))
+            else:
+                super().upload_documents([document])
+                results.append(FakeIndexingResult(document["id"]))
+        return results
+
+
+def test_batches_are_bounded_by_bytes_and_document_count():
+    client = RecordingSearchClient()
+    size = payload_size(documents("a", 1)[0])
+    indexer = SearchIndexer(client, max_batch_bytes=size * 5, max_batch_documents=3, concurrency=1)
+    indexer.add_group("a", documents("a", 7))
+    indexer.close()
+    assert client.batches == [3, 3, 1]
+
+    client = RecordingSearchClient()
+    indexer = SearchIndexer(client, max_batch_bytes=size * 2, concurrency=2)
+    indexer.add_group("a", documents("a", 7))
+    indexer.close()
+    assert sorted(client.batches) == [1, 2, 2, 2]
+    assert len(client.documents) == 7
+
+
+def test_only_failed_documents_are_retried_and_groups_report_failures():
+    client = RecordingSearchClient(transient={"a-1"}, permanent={"b-0"})
+    done = {}
+    indexer = SearchIndexer(client, concurrency=2, base_delay=0, on_group_done=lambda owner, failed: done.update({owner: failed}))
+    indexer.add_group("a", documents("a", 3))
+    indexer.add_group("b", documents("b", 2))
+    indexer.add_group("empty", [])
+    indexer.close()
+
+    assert client.batches == [5, 1]  # the retry only resent a-1
+    assert done["a"] == {}
+    assert list(done["b"]) == ["b-0"]
+    assert done["empty"] == {}
+    assert (indexer.uploaded, indexer.failed) == (4, 1)
+
+
+def test_oversized_requests_are_split():
+    size = payload_size(documents("a", 1)[0])
+    client = RecordingSearchClient(max_request_bytes=size * 2)
+    indexer = SearchIndexer(client, max_batch_bytes=size * 8, concurrency=1)
+    indexer.add_group("a", documents("a", 8))
+    indexer.close()
+    assert client.batches == [2, 2, 2, 2]
+    assert indexer.failed == 0
@@ -0,0 +1,49 @@
+from jobs import JobQueue, work
+
+
+def test_failed_jobs_are_retried_then_dead_lettered_and_requeued(tmp_path):
+    queue = JobQueue(str(tmp_path / "jobs.sqlite"), max_attempts=2, retry_delay=0)
+    queue.enqueue("ocr", "a.pdf", {"name": "a.pdf"})
+    attempts = []
+
+    def ocr(payload):
+        attempts.append(payload["name"])
+        raise RuntimeError("service down")
+
+    work(queue, {"ocr": ocr}, poll_seconds=0, max_jobs=2)
+    assert len(attempts) == 2
+    (dead,) = queue.dead_letters()
+    assert dead["error"] == "RuntimeError: service down"
+    assert queue.claim("worker") is None
+
+    assert queue.requeue(dead["id"]) == 1
+    assert queue.counts() == {("ocr", "queued"): 1}
+
+
+def test_finished_jobs_enqueue_the_next_stage_of_the_same_upload(tmp_path):
+    queue = JobQueue(str(tmp_path / "jobs.sqlite"))
+    upload = queue.enqueue("ocr", "a.pdf", {"name": "a.pdf"})
+    seen = []
+
+    def handler(kind):
+        def run(payload):
+            seen.append(kind)
+            return {**payload, kind: True}
+        return run
+
+    handlers = {kind: handler(kind) for kind in ("ocr", "extract", "embed", "index")}
+    assert work(queue, handlers, poll_seconds=0, max_jobs=4) == 4
+
+    assert seen == ["ocr", "extract", "embed", "index"]
+    (latest,) = queue.uploads([upload])
+    assert (latest["kind"], latest["status"]) == ("index", "done")
+    assert queue.claim("worker") is None
+
+
+def test_expired_leases_are_claimed_again(tmp_path):
+    queue = JobQueue(str(tmp_path / "jobs.sqlite"), lease_seconds=0)
+    queue.enqueue("ocr", "a.pdf", {})
+    first = queue.claim("killed worker")
+    second = queue.claim("other worker")
+    assert second["id"] == first["id"]
+    assert second["attempts"] == 2
@@ -0,0 +1,38 @@
+from manifest import Manifest, document_id
+
+
+def test_record_and_is_current(tmp_path):
+    manifest = Manifest("embed", directory=str(tmp_path), autosave_every=2)
+    manifest.record("a.json", "etag-1", outputs=["a.page1.embedding.json"])
+    assert manifest.is_current("a.json", "etag-1")
+    assert not manifest.is_current("a.json", "etag-2")
+    assert not manifest.is_current("b.json", "etag-1")
+
+    # Autosaved after two records; a new run resumes from the file
+    manifest.record("b.json", "etag-1")
+    resumed = Manifest("embed", directory=str(tmp_path))
+    assert resumed.outputs("a.json") == ["a.page1.embedding.json"]
+    assert resumed.stale({"a.json"}) == ["b.json"]
+    assert Manifest("embed", directory=str(tmp_path), full_rebuild=True).entries == {}
+
+
+def test_commit_merges_entries_of_processes_sharing_the_file(tmp_path):
+    first = Manifest("index", directory=str(tmp_path), autosave_every=0)
+    second = Manifest("index", directory=str(tmp_path), autosave_every=0)
+    first.record("a.json", "1")
+    first.record("old.json", "1")
+    first.commit("a.json", "old.json")
+    second.record("b.json", "1")
+    second.commit("b.json")
+    first.forget("old.json")
+    first.commit("old.json")
+
+    entries = Manifest("index", directory=str(tmp_path)).entries
+    assert sorted(entries) == ["a.json", "b.json"]
+    assert sorted(first.entries) == ["a.json", "b.json"]
+
+
+def test_document_id_is_deterministic_and_key_safe():
+    assert document_id("reports/a.json", 1, 0) == document_id("reports/a.json", 1, 0)
+    assert document_id("reports/a.json", 1, 0) != document_id("reports/a.json", 1, 1)
+    assert document_id("a.json", 1).isalnum()
@@ -0,0 +1,90 @@
+import argparse
+
+import pytest
+
+pytest.importorskip("dotenv")
+
+from fakes import FakeBlobServiceClient, FakeDocumentAnalysisClient, FakeOpenAI, FakeSearchClient, seed_landing_container
+from pipeline import Pipeline, settings_from_env
+
+
+class FlakySearchClient(FakeSearchClient):
+    failing = False
+
+    def upload_documents(self, documents):
+        if self.failing:
+            raise RuntimeError("search service unavailable")
+        return super().upload_documents(documents)
+
+    merge_or_upload_documents = upload_documents
+
+
+def make_settings(manifest_dir):
+    args = argparse.Namespace(
+        dry_run=True, ocr_workers=2, embed_workers=1, queue_size=4, index_batch_size=1000, index_concurrency=2,
+    )
+    settings = settings_from_env(args)
+    settings["manifest_dir"] = str(manifest_dir)
+    settings["full_rebuild"] = False
+    settings["embedding_format"] = "json"
+    return settings
+
+
+@pytest.fixture
+def services():
+    blob_service = FakeBlobServiceClient()
+    seed_landing_container(blob_service.get_container_client("landing"), documents=3)
+    return blob_service, FakeOpenAI(dimensions=16)
+
+
+def run(services, settings, document_client, search_client):
+    blob_service, openai = services
+    pipeline = Pipeline(blob_service, document_client, openai, search_client, settings)
+    return pipeline, pipeline.run()
+
+
+def test_second_run_skips_everything(services, tmp_path):
+    settings = make_settings(tmp_path)
+    search = FakeSearchClient()
+    _, first = run(services, settings, FakeDocumentAnalysisClient(pages_per_document=2), search)
+    assert first["stages"]["index"]["items"] > 0
+
+    _, second = run(services, settings, FakeDocumentAnalysisClient(pages_per_document=2), search)
+    assert second["skipped"] == 3
+    assert all(stage["items"] == 0 for stage in second["stages"].values())
+
+
+def test_changed_input_is_reindexed_after_a_failed_index_run(services, tmp_path):
+    settings = make_settings(tmp_path)
+    search = FlakySearchClient()
+    run(services, settings, FakeDocumentAnalysisClient(pages_per_document=2, lines_per_page=30), search)
+    old_texts = {document["text"] for document in search.documents.values() if document["source"] == "report-00000.json"}
+
+    # The PDF changes (new ETag, new text), is re-embedded, but indexing fails
+    blob_service, _ = services
+    blob_service.get_container_client("landing").upload_blob(name="report-00000.pdf", data=b"%PDF-edited", overwrite=True)
+    changed = FakeDocumentAnalysisClient(pages_per_document=2, lines_per_page=12)
+    search.failing = True
+    _, failed = run(services, settings, changed, search)
+    assert failed["stages"]["embed"]["items"] == 1
+    assert failed["stages"]["index"]["failed"] > 0
+
+    # Resuming picks the re-embedded blobs up at the index stage even though the index
+    # manifest still has entries for them
+    search.failing = False
+    pipeline, resumed = run(services, settings, changed, search)
+    assert resumed["stages"]["embed"]["items"] == 0
+    assert resumed["stages"]["index"]["items"] == failed["stages"]["index"]["items"]
+    # The index holds exactly the changed file's current chunks, none of the old ones
+    expected = {
+        document["id"]: document["text"]
+        for name in pipeline.embed_manifest.outputs("report-00000.json")
+        for document in pipeline.documents_from_blob(name)
+    }
+    indexed = {
+        document["id"]: document["text"]
+        for document in search.documents.values() if document["source"] == "report-00000.json"
+    }
+    assert indexed == expected
+    assert set(expected.values()) != old_texts
+    assert all(entry["fingerprint"] for entry in pipeline.index_manifest.entries.values())